@@ -0,0 +1,466 @@
+import os
+import tempfile
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'jet_tracking')
+
+
+def radial_labels(shape, bins=100, center=None):
+    """
+    Label every pixel with the radial sub-bin it falls in.
+
+    The radial bins used for the azimuthal average overlap: bin ``i``
+    covers ``radii[i] - bin_size < R < radii[i] + bin_size``.  Splitting the
+    radius into half-width sub-bins means bin ``i`` is exactly the union of
+    sub-bins ``i + 1`` and ``i + 2``, so one label per pixel is enough to
+    describe every bin.
+
+    Parameters
+    ----------
+    shape: tuple of int
+        Shape (rows, columns) of the assembled detector image.
+
+    bins: int (Default: 100)
+        Number of radial bins requested over the image.
+
+    center: tuple of float (Default: None)
+        Beam center (x, y) in pixels, defaults to the middle of the image.
+
+    Returns
+    -------
+    labels: ndarray
+        Sub-bin label of each pixel, 0 for pixels outside all bins.
+
+    n_bins: int
+        Number of radial bins actually generated.
+    """
+    x, y, edges, n_bins = _radial_edges(shape, bins, center)
+    R = np.hypot(x[np.newaxis, :], y[:, np.newaxis])
+    labels = np.searchsorted(edges, R, side='left')
+    labels[labels > n_bins + 1] = 0
+
+    return labels.astype(np.uint16), n_bins
+
+
+class RadialGeometry:
+    """
+    Compact description of the radial bins of a detector image.
+
+    Instead of one full size boolean mask per bin, the geometry keeps a
+    uint16 sub-bin label image and the flat pixel indices sorted by label
+    (CSR style, with per sub-bin offsets).  Both arrays can be cached on
+    disk and memory mapped read-only, so every rank on a node shares the
+    same pages.
+
+    Parameters
+    ----------
+    labels: ndarray
+        Sub-bin label image as returned by `radial_labels`.
+
+    order: ndarray
+        Flat pixel indices sorted by sub-bin label.
+
+    n_bins: int
+        Number of radial bins.
+    """
+    def __init__(self, labels, order, n_bins):
+        self._labels = labels
+        self._order = order
+        self._n_bins = int(n_bins)
+        sub_counts = np.bincount(labels.ravel(), minlength=self._n_bins + 2)
+        self._offsets = np.concatenate(([0], np.cumsum(sub_counts)))
+        # Bin i is the union of sub-bins i + 1 and i + 2
+        self._counts = sub_counts[1:-1] + sub_counts[2:]
+
+    @classmethod
+    def from_shape(cls, shape, bins=100, center=None):
+        """Compute the geometry for an image shape"""
+        labels, n_bins = radial_labels(shape, bins, center)
+        order = np.argsort(labels.ravel(), kind='stable').astype(np.int32)
+        return cls(labels, order, n_bins)
+
+    @classmethod
+    def cached(cls, shape, bins=100, center=None, cache_dir=None):
+        """
+        Load the geometry from the disk cache, computing it if needed.
+
+        Files are keyed by shape, bins and center and written atomically,
+        so concurrent readers never see a partial file.  The arrays are
+        memory mapped read-only.
+
+        Parameters
+        ----------
+        shape: tuple of int
+            Shape (rows, columns) of the assembled detector image.
+
+        bins: int (Default: 100)
+            Number of radial bins requested over the image.
+
+        center: tuple of float (Default: None)
+            Beam center (x, y) in pixels, defaults to the middle of the image.
+
+        cache_dir: str (Default: None)
+            Directory for the cache files, defaults to a jet_tracking
+            directory in the system temp dir.
+
+        Returns
+        -------
+        geometry: RadialGeometry
+        """
+        if center is None:
+            center = (shape[1] / 2, shape[0] / 2)
+        cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        key = (f'r_geometry_{shape[0]}x{shape[1]}_b{bins}_'
+               f'c{center[0]:g}_{center[1]:g}')
+        labels_file = os.path.join(cache_dir, f'{key}_labels.npy')
+        order_file = os.path.join(cache_dir, f'{key}_order.npy')
+        if not (os.path.exists(labels_file) and os.path.exists(order_file)):
+            os.makedirs(cache_dir, exist_ok=True)
+            geometry = cls.from_shape(shape, bins, center)
+            _atomic_save(order_file, geometry.order)
+            _atomic_save(labels_file, geometry.labels)
+        labels = np.load(labels_file, mmap_mode='r')
+        order = np.load(order_file, mmap_mode='r')
+        _, _, _, n_bins = _radial_edges(shape, bins, center)
+        return cls(labels, order, n_bins)
+
+    @property
+    def shape(self):
+        """Shape of the detector image"""
+        return self._labels.shape
+
+    @property
+    def n_bins(self):
+        """Number of radial bins"""
+        return self._n_bins
+
+    @property
+    def labels(self):
+        """Sub-bin label image, 0 outside of all bins"""
+        return self._labels
+
+    @property
+    def order(self):
+        """Flat pixel indices sorted by sub-bin"""
+        return self._order
+
+    @property
+    def counts(self):
+        """Number of pixels in each radial bin"""
+        return self._counts
+
+    def sub_sizes(self, low_bin, high_bin):
+        """Number of pixels in each sub-bin of a range of bins"""
+        return np.diff(self._offsets[low_bin + 1:high_bin + 3])
+
+    def bin_pixels(self, low_bin, high_bin=None):
+        """
+        Flat pixel indices of a bin or range of bins.
+
+        Parameters
+        ----------
+        low_bin: int
+            First bin of the range.
+
+        high_bin: int (Default: None)
+            Bin after the last bin of the range, just ``low_bin`` if None.
+
+        Returns
+        -------
+        idx: ndarray
+            Flat indices of every pixel in the range, ordered by sub-bin.
+        """
+        if high_bin is None:
+            high_bin = low_bin + 1
+        return self._order[self._offsets[low_bin + 1]:
+                           self._offsets[high_bin + 2]]
+
+    def mask(self, i):
+        """Boolean image mask of bin i"""
+        mask = np.zeros(self._labels.size, dtype=bool)
+        mask[self.bin_pixels(i)] = True
+        return mask.reshape(self.shape)
+
+
+def _radial_edges(shape, bins, center):
+    """Pixel axes relative to the center and the sub-bin edges"""
+    if center is None:
+        center = (shape[1] / 2, shape[0] / 2)
+    x = np.arange(shape[1]) - center[0]
+    y = np.arange(shape[0]) - center[1]
+    # The radius is monotonic in |x| and |y|, no need for the full grid
+    max_R = np.hypot(np.max(np.abs(x)), np.max(np.abs(y)))
+    min_R = np.hypot(np.min(np.abs(x)), np.min(np.abs(y)))
+    bin_size = (max_R - min_R) / bins
+    n_bins = len(np.arange(1, max_R, bin_size))
+    if n_bins + 2 > np.iinfo(np.uint16).max:
+        raise ValueError(f'Too many radial bins for uint16 labels: {n_bins}')
+    edges = 1 + (np.arange(n_bins + 2) - 1) * bin_size
+
+    return x, y, edges, n_bins
+
+
+def _atomic_save(filename, array):
+    """Save an array to a temporary file, then move it into place"""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename), suffix='.npy')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, array)
+        # mkstemp files are private, the cache is shared between users
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class RadialIndex:
+    """
+    Sparse index of detector pixels grouped by radial bin.
+
+    The pixels of any range of bins are a contiguous slice of the geometry
+    index.  For a given window of bins the flat pixel indices and per-pixel
+    weights are precomputed, and the summed bin averages of an event become
+    one gather and one dot product over the pixels in the window.
+
+    With a pixel map the index works on the unassembled (per panel) calib
+    array instead of the image: every raw pixel takes the radial sub-bin of
+    the image pixel it lands on, so the window can be summed without
+    assembling the image.  Bins are still normalized with the image pixel
+    counts, which gives the same result as going through the image.
+
+    Parameters
+    ----------
+    geometry: RadialGeometry
+        Radial bins of the detector image.
+
+    pixel_mask: ndarray (Default: None)
+        Mask in the layout of the data, image or raw array, pixels where
+        the mask is 0 are left out of the window.
+
+    pixel_map: ndarray (Default: None)
+        Flat image index of each raw pixel, e.g. from psana ``indexes_xy``
+        and ``np.ravel_multi_index``.
+    """
+    def __init__(self, geometry, pixel_mask=None, pixel_map=None):
+        self._geometry = geometry
+        self._pixels = geometry
+        self._pixel_map = None
+        self._pixel_mask = None
+        self._window = None
+        self._idx = None
+        self._weights = None
+        self._azav_labels = None
+        # Empty bins average to NaN, as in AzavEngine
+        counts = geometry.counts
+        self._inv_counts = np.full(len(counts), np.nan)
+        np.divide(1., counts, out=self._inv_counts, where=counts > 0)
+        self.pixel_map = pixel_map
+        self.pixel_mask = pixel_mask
+
+    @property
+    def geometry(self):
+        """Radial bins of the detector image"""
+        return self._geometry
+
+    @property
+    def n_bins(self):
+        """Number of radial bins"""
+        return self._geometry.n_bins
+
+    @property
+    def pixel_map(self):
+        """Flat image index of each raw pixel, None to index the image"""
+        return self._pixel_map
+
+    @pixel_map.setter
+    def pixel_map(self, pixel_map):
+        """
+        Switch between raw and image layouts, the pixel mask is reset since
+        it depends on the layout
+        """
+        if pixel_map is None:
+            self._pixels = self._geometry
+        else:
+            pixel_map = np.asarray(pixel_map)
+            labels = np.asarray(self._geometry.labels).ravel()[
+                pixel_map.ravel()].reshape(pixel_map.shape)
+            order = np.argsort(labels.ravel(), kind='stable')
+            self._pixels = RadialGeometry(labels, order.astype(np.int32),
+                                          self.n_bins)
+        self._pixel_map = pixel_map
+        self.pixel_mask = None
+
+    @property
+    def pixel_mask(self):
+        """Flattened pixel mask applied to the window"""
+        return self._pixel_mask
+
+    @pixel_mask.setter
+    def pixel_mask(self, mask):
+        """Set the pixel mask, this rebuilds the current window"""
+        if mask is not None:
+            mask = np.asarray(mask).ravel() != 0
+        self._pixel_mask = mask
+        self._azav_labels = None
+        self._rebuild()
+
+    @property
+    def window(self):
+        """Range of bins (low, high) currently indexed"""
+        return self._window
+
+    def set_window(self, low_bin, high_bin):
+        """
+        Precompute the pixels and weights for a range of bins.
+
+        Parameters
+        ----------
+        low_bin: int
+            First bin of the window.
+
+        high_bin: int
+            Bin after the last bin of the window.
+        """
+        low_bin = min(max(int(low_bin), 0), self.n_bins)
+        high_bin = min(max(int(high_bin), low_bin), self.n_bins)
+        if self._window == (low_bin, high_bin):
+            return
+        # Only the pixels of the window are touched, moving the window is
+        # a slice of the sorted index
+        idx = np.asarray(self._pixels.bin_pixels(low_bin, high_bin))
+        sub_sizes = self._pixels.sub_sizes(low_bin, high_bin)
+        # Weight of a sub-bin is the summed 1/count of the window bins
+        # it belongs to, so the dot product gives the sum of bin means
+        inv_counts = np.zeros(high_bin - low_bin + 2)
+        counts = self._geometry.counts[low_bin:high_bin]
+        np.divide(1., counts, out=inv_counts[1:-1], where=counts > 0)
+        sub_weights = inv_counts[:-1] + inv_counts[1:]
+        weights = np.repeat(sub_weights, sub_sizes)
+        if self._pixel_mask is not None:
+            keep = self._pixel_mask[idx]
+            idx = idx[keep]
+            weights = weights[keep]
+        self._idx = idx
+        self._weights = weights
+        self._window = (low_bin, high_bin)
+
+    def intensity(self, image):
+        """
+        Sum of the bin averages in the current window.
+
+        Parameters
+        ----------
+        image: ndarray
+            Assembled detector image, or the raw calib array if a pixel map
+            is set.
+
+        Returns
+        -------
+        intensity: float
+            Equivalent to summing ``np.mean(image[mask])`` over the radial
+            masks of the window.
+        """
+        if self._window is None:
+            raise RuntimeError('No window set, call set_window first')
+        return float(np.dot(image.ravel()[self._idx], self._weights))
+
+    def azav(self, image):
+        """
+        Azimuthal average over all radial bins, as from AzavEngine but in
+        the layout and with the pixel mask of the index.
+
+        Parameters
+        ----------
+        image: ndarray
+            Assembled detector image, or the raw calib array if a pixel map
+            is set.
+
+        Returns
+        -------
+        azav: ndarray
+            Mean intensity of each radial bin, masked pixels count as 0.
+        """
+        if self._azav_labels is None:
+            # Masked pixels are moved out of all bins, built on first use
+            labels = np.asarray(self._pixels.labels).ravel()
+            if self._pixel_mask is not None:
+                labels = np.where(self._pixel_mask, labels, 0)
+            self._azav_labels = labels
+        sub_sums = np.bincount(self._azav_labels, weights=image.ravel(),
+                               minlength=self.n_bins + 2)
+        return (sub_sums[1:-1] + sub_sums[2:]) * self._inv_counts
+
+    def _rebuild(self):
+        """Recompute the current window after a layout or mask change"""
+        if self._window is not None:
+            window = self._window
+            self._window = None
+            self.set_window(*window)
+
+
+class AzavEngine:
+    """
+    Full azimuthal average of a detector image in a single pass.
+
+    Every pixel is summed into its sub-bin with one ``np.bincount`` and
+    neighbouring sub-bins are added to get the (overlapping) radial bins,
+    which are then normalized with the cached pixel count of each bin.
+
+    Parameters
+    ----------
+    geometry: RadialGeometry
+        Radial bins of the detector image.
+
+    pixel_mask: ndarray (Default: None)
+        Image shaped mask, pixels where the mask is 0 are left out of the
+        sums.
+    """
+    def __init__(self, geometry, pixel_mask=None):
+        self._geometry = geometry
+        self._n_sub = geometry.n_bins + 2
+        counts = geometry.counts
+        # Empty bins average to NaN, like np.mean over an empty mask
+        self._inv_counts = np.full(len(counts), np.nan)
+        np.divide(1., counts, out=self._inv_counts, where=counts > 0)
+        self._labels = None
+        self.pixel_mask = pixel_mask
+
+    @property
+    def n_bins(self):
+        """Number of radial bins"""
+        return self._geometry.n_bins
+
+    @property
+    def pixel_mask(self):
+        """Flattened pixel mask applied to the sums"""
+        return self._pixel_mask
+
+    @pixel_mask.setter
+    def pixel_mask(self, mask):
+        """Set the pixel mask, masked pixels are moved out of all bins"""
+        labels = self._geometry.labels.ravel()
+        if mask is not None:
+            mask = np.asarray(mask).ravel() != 0
+            labels = np.where(mask, labels, 0).astype(np.uint16)
+        self._pixel_mask = mask
+        self._labels = labels
+
+    def azav(self, image):
+        """
+        Azimuthal average of an image over all radial bins.
+
+        Parameters
+        ----------
+        image: ndarray
+            Assembled detector image.
+
+        Returns
+        -------
+        azav: ndarray
+            Mean intensity of each radial bin, masked pixels count as 0.
+        """
+        sub_sums = np.bincount(self._labels, weights=image.ravel(),
+                               minlength=self._n_sub)
+        return (sub_sums[1:-1] + sub_sums[2:]) * self._inv_counts
@@ -0,0 +1,228 @@
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Index file kept next to the calibration results
+INDEX_NAME = 'jt_cal_index.jsonl'
+
+
+def typed_results(results):
+    """
+    Calibration results with plain Python values, numpy scalars become
+    int and float and the strings of results saved with ``str(v)`` are
+    parsed back.
+
+    Parameters
+    ----------
+    results: dict
+
+    Returns
+    -------
+    typed: dict
+    """
+    typed = {}
+    for key, value in results.items():
+        if isinstance(value, np.generic):
+            value = value.item()
+        elif isinstance(value, str):
+            value = _parse_value(value)
+        typed[key] = value
+
+    return typed
+
+
+def _parse_value(text):
+    """Number or None from its string, the string itself otherwise"""
+    if text == 'None':
+        return None
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+
+class CalibrationStore:
+    """
+    Calibration results of an experiment, indexed by hutch, experiment and
+    run in an append-only JSON lines file.
+
+    Every calibration appends one line, so readers never see a file being
+    rewritten.  Readers keep the entries in memory and only look at the
+    index again when its size or mtime changed, at most every
+    poll_interval seconds, reading just the appended lines.  Finding the
+    latest calibration is then a dictionary lookup instead of listing and
+    parsing the results directory on NFS.
+
+    Directories without an index fall back to the newest ``jt_cal*``
+    results file, which is only looked up again when the directory
+    changes.
+
+    Parameters
+    ----------
+    directory: str
+        Directory of the calibration results.
+
+    poll_interval: float (Default: 1.0)
+        Seconds between checks of the index.
+    """
+    def __init__(self, directory, poll_interval=1.0):
+        self._directory = Path(directory)
+        self._path = self._directory / INDEX_NAME
+        self._poll_interval = poll_interval
+        self._last_poll = None
+        self._stat = None
+        self._offset = 0
+        self._entries = []
+        self._latest = {}
+        self._legacy = None
+        self._legacy_mtime = None
+
+    @property
+    def directory(self):
+        """Directory of the calibration results"""
+        return self._directory
+
+    @property
+    def path(self):
+        """Index file"""
+        return self._path
+
+    @property
+    def entries(self):
+        """Every indexed calibration, oldest first"""
+        self._refresh()
+        return list(self._entries)
+
+    def add(self, results, hutch, experiment, run, results_file=None):
+        """
+        Index a calibration.
+
+        Parameters
+        ----------
+        results: dict
+            Calibration results, stored with typed values.
+
+        hutch: str
+
+        experiment: str
+
+        run: str or int
+
+        results_file: str (Default: None)
+            Results file written next to the index, if any.
+
+        Returns
+        -------
+        entry: dict
+        """
+        entry = {'hutch': hutch, 'experiment': experiment, 'run': str(run),
+                 'time': time.time(),
+                 'file': None if results_file is None else str(results_file),
+                 'results': typed_results(results)}
+        os.makedirs(self._directory, exist_ok=True)
+        # One write per line, so a reader sees whole lines or nothing
+        with open(self._path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+        return entry
+
+    def latest(self, hutch=None, experiment=None, run=None):
+        """
+        Most recent calibration matching the given keys.
+
+        Returns
+        -------
+        entry: dict or None
+            With hutch, experiment, run, time, file and results.
+        """
+        self._refresh()
+        if not self._entries:
+            return self._legacy_entry()
+        if hutch is None and experiment is None and run is None:
+            return self._entries[-1]
+        if hutch is not None and experiment is not None and run is not None:
+            return self._latest.get((hutch, experiment, str(run)))
+        for entry in reversed(self._entries):
+            if _matches(entry, hutch, experiment, run):
+                return entry
+        return None
+
+    def _refresh(self, now=None):
+        """Read the lines appended to the index since the last poll"""
+        if now is None:
+            now = time.monotonic()
+        if self._last_poll is not None and \
+                now - self._last_poll < self._poll_interval:
+            return
+        self._last_poll = now
+        try:
+            stat = os.stat(self._path)
+        except FileNotFoundError:
+            self._stat = None
+            return
+        key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if key == self._stat:
+            return
+        if self._stat is None or stat.st_ino != self._stat[0] or \
+                stat.st_size < self._offset:
+            # Replaced or truncated, start over
+            self._offset = 0
+            self._entries = []
+            self._latest = {}
+        with open(self._path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        # A line still being written is picked up by the next poll
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logger.warning(f'Skipping bad line in {self._path}')
+                continue
+            self._entries.append(entry)
+            self._latest[(entry['hutch'], entry['experiment'],
+                          entry['run'])] = entry
+        self._offset += end
+        self._stat = key
+
+    def _legacy_entry(self):
+        """Entry from the newest results file, for directories without an
+        index
+        """
+        try:
+            mtime = os.stat(self._directory).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if mtime == self._legacy_mtime:
+            return self._legacy
+        self._legacy_mtime = mtime
+        cal_files = list(self._directory.glob('jt_cal*'))
+        cal_files = [f for f in cal_files if f.name != INDEX_NAME]
+        if not cal_files:
+            self._legacy = None
+            return None
+        cal_file = max(cal_files, key=os.path.getmtime)
+        with open(cal_file) as f:
+            results = json.load(f)
+        self._legacy = {'hutch': None, 'experiment': None, 'run': None,
+                        'time': os.path.getmtime(cal_file),
+                        'file': str(cal_file),
+                        'results': typed_results(results)}
+
+        return self._legacy
+
+
+def _matches(entry, hutch, experiment, run):
+    """Whether an entry has the given keys, None matches anything"""
+    return ((hutch is None or entry['hutch'] == hutch) and
+            (experiment is None or entry['experiment'] == experiment) and
+            (run is None or entry['run'] == str(run)))
@@ -1,12 +1,12 @@
-import json
 import logging
-import os
 from argparse import ArgumentParser
 from pathlib import Path
 
 import numpy as np
 import yaml
 
+from .cal_store import CalibrationStore
+
 log = logging.getLogger("jet_tracker")
 
 
@@ -37,6 +37,7 @@ class Context:
         notification_time (int): Time duration for notifications.
         calibrated (bool): Flag indicating if calibration has been performed.
         calibration_values (dict): Dictionary containing calibration values.
+        cal_store (CalibrationStore): Index of the calibration results, opened on first use.
         naverage (int): Number of points for averaging.
         num_points (int): Number of points for graph display.
         averaging_size (int): Size of averaging for the time window.
@@ -146,6 +147,7 @@ class Context:
         self.notification_time = 2
         self.calibrated = False
         self.calibration_values = {}
+        self.cal_store = None
         self.naverage = self.graph_ave_time * self.refresh_rate  # number of points over the time wanted for averaging
         self.num_points = self.display_time * self.refresh_rate  # number of points over the graph time
         self.averaging_size = int(self.num_points / self.naverage)  # how many averages can fit within the time window
@@ -359,15 +361,14 @@ class Context:
         """
         results_dir = Path(f'/cds/home/opr/{self.HUTCH}opr/experiments/'
                            f'{self.EXPERIMENT}/jt_calib/')
-        cal_files = list(results_dir.glob('jt_cal*'))
-        cal_files.sort(key=os.path.getmtime)
-        if cal_files:
-            cal_file_path = cal_files[-1]
-            with open(cal_file_path) as f:
-                cal_results = json.load(f)
-            return cal_results, cal_file_path
-        else:
+        # The store keeps the index in memory, only reopen it if the
+        # experiment changed
+        if self.cal_store is None or self.cal_store.directory != results_dir:
+            self.cal_store = CalibrationStore(results_dir)
+        entry = self.cal_store.latest()
+        if entry is None:
             return None, None
+        return entry['results'], entry['file'] or self.cal_store.path
 
     def set_mode(self, mode):
         """
@@ -1,8 +1,7 @@
 import logging
 import threading
 import time
-from collections import deque
-from statistics import StatisticsError, mean, stdev
+from statistics import mean
 
 import cv2
 import numpy as np
@@ -16,6 +15,7 @@ from pcdsdevices.epics_motor import Motor
 from .motorMoving import MotorAction
 from .sketch.simJetImage import SimulatedImage
 from .tools.numGen import SimulationGenerator
+from .tools.shotStatus import ShotStatus
 from .tools.simMotorMoving import SimulatedMotor
 
 ologging = logging.getLogger('ophyd')
@@ -234,16 +234,11 @@ class StatusThread(QObject):
             The current status of the status thread.
         display_flag : list
             The display flag list.
-        cal_vals : list
-            The calibration values list.
-        averages : dict
-            The dictionary of average values.
-        flagged_events : dict
-            The dictionary of flagged events.
         current_values : dict
             The dictionary of current values.
-        buffers : dict
-            The dictionary of buffers.
+        shots : ShotStatus
+            Rolling statistics, flag counts and averages of the shots, and
+            the shots of a calibration in the GUI.
         calibration_values : dict
             The dictionary of calibration values.
         reader : ValueReader
@@ -277,19 +272,10 @@ class StatusThread(QObject):
         self.bad_scan_counter = 0
         self.status = ''
         self.display_flag = []
-        self.cal_vals = [[], [], []]
-        self.averages = {"i0": deque([0], 2000),
-                         "diff": deque([0], 2000),
-                         "ratio": deque([0], 2000),
-                         "time": deque([0], 2000)}
-        self.flagged_events = {
-            "high intensity": deque([0], 2000),
-            "missed shot": deque([0], 2000),
-            "dropped shot": deque([0], 2000)}
         self.current_values = {"i0": 0, "diff": 0, "ratio": 0, "dropped": 0}
-        self.buffers = {"i0": deque([np.nan], 2000),
-                        "diff": deque([np.nan], 2000),
-                        "ratio": deque([np.nan], 2000)}
+        # Updated with every shot, so averages and status are O(1)
+        self.shots = ShotStatus(self.averaging_size,
+                                self.notification_tolerance, self.num_cali)
         self.calibration_values = {'i0': {'mean': 0, 'stddev': 0,
                                           'range': (0, 0)},
                                    'diff': {'mean': 0, 'stddev': 0,
@@ -393,8 +379,7 @@ class StatusThread(QObject):
                 self.update_buffer(vals)
                 self.check_status_update()
                 if self._ave_count == self.averaging_size:
-                    self.calculate_averages()
-                    vals['ratio'] = [vals['ratio'], self.averages['ratio'][-1]]
+                    vals['ratio'] = [vals['ratio'], self.calculate_averages()]
                 else:
                     vals['ratio'] = [vals['ratio'], np.nan]
                 self.signals.refreshGraphs.emit(vals, self._count)
@@ -404,8 +389,7 @@ class StatusThread(QObject):
                 self.check_status_update()
                 self.calibrate(vals)
                 if self._ave_count == self.averaging_size:
-                    self.calculate_averages()
-                    vals['ratio'] = [vals['ratio'], self.averages['ratio'][-1]]
+                    vals['ratio'] = [vals['ratio'], self.calculate_averages()]
                 else:
                     vals['ratio'] = [vals['ratio'], np.nan]
                 self.signals.refreshGraphs.emit(vals, self._count)
@@ -484,6 +468,7 @@ class StatusThread(QObject):
             The new number of calibration value.
         """
         self.num_cali = n
+        self.shots.set_num_cali(n)
 
     def set_calibration_priority(self, p):
         """
@@ -510,62 +495,43 @@ class StatusThread(QObject):
 
     def calculate_averages(self):
         """
-        Calculate the averages of the buffer values and update the averages dictionary.
-        """
-        try:
-            i0 = self.buffers['i0'][-self.averaging_size:][~np.isnan(
-                list(self.flagged_events['dropped shot'])[-self.averaging_size:])]
-            diff = self.buffers['diff'][-self.averaging_size:][~np.isnan(
-                list(self.flagged_events['dropped shot'])[-self.averaging_size:])]
-            ratio = self.buffers['ratio'][-self.averaging_size:][~np.isnan(
-                list(self.flagged_events['dropped shot'])[-self.averaging_size:])]
-            avei0 = mean(list(i0))
-            avediff = mean(list(diff))
-            averatio = mean(list(ratio))
-        except StatisticsError:
-            ...
-        else:
-            self.averages['i0'].append(avei0)
-            self.averages['diff'].append(avediff)
-            self.averages['ratio'].append(averatio)
+        Calculate the averages over the averaging window and keep them.
+
+        Returns:
+        float
+            The latest average ratio.
+        """
+        return self.shots.average()
 
     def update_buffer(self, vals):
         """
-        Add values from the ValueReader to the buffers dictionary and check if the events should be flagged.
+        Add values from the ValueReader to the rolling statistics and check if the events should be flagged.
 
         Parameters:
         vals (dict): The values received from the ValueReader.
         """
-        v = [vals.get('diff'), vals.get('i0'),
-             vals.get('ratio'), vals.get('dropped')]
-        if self.calibrated:
-            self.event_flagging(v)
-        for k in self.buffers.keys():
-            self.buffers[k].append(vals.get(k))
+        # Flags are not counted until calibrated
+        ratio_range = self.calibration_values['ratio']['range'] \
+            if self.calibrated else None
+        self.shots.add(vals, ratio_range)
 
     def check_status_update(self):
         """
         Check the status update based on the flagged events and emit signals accordingly.
         """
         if self.calibrated:
-            p = int(1.5 * self.notification_tolerance)  # plus 10% of notification tolerance
-            miss = np.array(self.flagged_events['missed shot'])[-p:]
-            drop = np.array(self.flagged_events['dropped shot'])[-p:]
-            high = np.array(self.flagged_events['high intensity'])[-p:]
-            n_miss = np.count_nonzero(miss[~np.isnan(miss)])
-            n_drop = np.count_nonzero(drop[~np.isnan(drop)])
-            n_high = np.count_nonzero(high[~np.isnan(high)])
-            if n_miss > self.notification_tolerance:
+            flag = self.shots.status()
+            if flag == 'missed shot':
                 self.signals.changeStatus.emit("Warning, missed shots", "red")
                 self.processor_worker.count_flags_and_execute(
                     "missed shot", 20, self.missed_shots
                 )
-            elif n_drop > self.notification_tolerance:
+            elif flag == 'dropped':
                 self.signals.changeStatus.emit("Lots of dropped shots", "yellow")
                 self.processor_worker.count_flags_and_execute(
                     "dropped shot", 20, self.dropped_shots
                 )
-            elif n_high > self.notification_tolerance:
+            elif flag == 'high intensity':
                 self.signals.changeStatus.emit("High Intensity", "orange")
                 self.processor_worker.count_flags_and_execute(
                     "high intensity", 20, self.high_intensity
@@ -611,41 +577,6 @@ class StatusThread(QObject):
         b = (zright * sigma) + vmean
         return [a, b]
 
-    def event_flagging(self, vals):
-        """
-        Flags values that are outside of the values indicated from the gui.
-
-        Values that fall within the allowed range receive a value
-        of zero in self.flagged_events deque. Otherwise, that position gets
-        updated with the current value in the buffer.
-
-        Parameters:
-        vals
-            Values from the ValueReader in the order i0, diff, ratio
-        """
-
-        if self.calibrated:
-            if vals[2] > self.calibration_values['ratio']['range'][1]:
-                high_intensity = vals[2]
-                self.flagged_events['high intensity'].append(high_intensity)
-            else:
-                high_intensity = 0
-                self.flagged_events['high intensity'].append(high_intensity)
-            if vals[2] < self.calibration_values['ratio']['range'][0]:
-                missed_shot = vals[2]
-                if missed_shot == 0:
-                    missed_shot = 0.01
-                self.flagged_events['missed shot'].append(missed_shot)
-            else:
-                missed_shot = 0
-                self.flagged_events['missed shot'].append(missed_shot)
-        if not vals[3]:
-            dropped_shot = 0
-            self.flagged_events['dropped shot'].append(dropped_shot)
-        elif vals[3]:
-            dropped_shot = 1
-            self.flagged_events['dropped shot'].append(dropped_shot)
-
     def update_calibration_range(self):
         """
         Update the calibration range for the 'i0', 'diff', and 'ratio' signals.
@@ -725,27 +656,13 @@ class StatusThread(QObject):
                 self.signals.message.emit('calibration file: ' + str(cal_file))
 
         elif self.calibration_source == 'calibration in GUI':
-            if not v.get('dropped'):
-                self.cal_vals[0].append(v.get('i0'))
-                self.cal_vals[1].append(v.get('diff'))
-                self.cal_vals[2].append(v.get('ratio'))
-            if len(self.cal_vals[0]) > self.num_cali:
-                self.set_calibration_values('i0',
-                                            mean(self.cal_vals[0]),
-                                            stdev(self.cal_vals[0])
-                                            )
-                self.set_calibration_values('diff',
-                                            mean(self.cal_vals[1]),
-                                            stdev(self.cal_vals[1])
-                                            )
-                self.set_calibration_values('ratio',
-                                            mean(self.cal_vals[2]),
-                                            stdev(self.cal_vals[2])
-                                            )
+            cal_stats = self.shots.add_calibration_shot(v)
+            if cal_stats is not None:
+                for name, (vmean, std) in cal_stats.items():
+                    self.set_calibration_values(name, vmean, std)
                 self.update_calibration_range()
                 self.mode = "running"
                 self.calibrated = True
-                self.cal_vals = [[], [], []]
 
         else:
             self.signals.message.emit('was not able to calibrate')
@@ -0,0 +1,457 @@
+import numpy as np
+from mpi4py import MPI
+
+# Shots read at a time from an HDF5 dataset
+BLOCK_ROWS = 10000
+
+
+class Welford:
+    """
+    Count, mean and variance of values, which merge with those of other
+    values, e.g. of other ranks, without keeping the values.
+
+    Parameters
+    ----------
+    values: array like
+        Values along the first axis, may be empty.
+    """
+    def __init__(self, values):
+        values = np.asarray(values, dtype=float)
+        self.n = len(values)
+        self.mean = values.mean(axis=0) if self.n else \
+            np.zeros(values.shape[1:])
+        self.m2 = ((values - self.mean) ** 2).sum(axis=0)
+
+    @property
+    def var(self):
+        """Population variance, NaN without values"""
+        return self.m2 / self.n if self.n else \
+            np.full(np.shape(self.m2), np.nan)
+
+    def merge(self, other):
+        """Add the values of another Welford, with Chan's formula"""
+        n = self.n + other.n
+        if n:
+            delta = other.mean - self.mean
+            self.m2 = self.m2 + other.m2 + delta ** 2 * self.n * other.n / n
+            self.mean = self.mean + delta * other.n / n
+        self.n = n
+
+        return self
+
+
+class Histogram:
+    """
+    Histogram with fixed edges that can be filled piece by piece and
+    merged, e.g. filled on every rank and reduced to one.
+
+    Bins follow np.histogram, the last one includes its right edge.
+    Values outside the edges are counted in an underflow and an overflow
+    bin instead of being lost.
+
+    Parameters
+    ----------
+    edges: ndarray
+        Increasing bin edges.
+    """
+    def __init__(self, edges):
+        self._edges = np.asarray(edges, dtype=float)
+        # Underflow first and overflow last
+        self._counts = np.zeros(len(self._edges) + 1, dtype=np.int64)
+
+    @classmethod
+    def from_range(cls, low, high, bins=50):
+        """
+        Histogram of evenly spaced bins, with the same range handling as
+        np.histogram.
+
+        Parameters
+        ----------
+        low: float
+
+        high: float
+
+        bins: int (Default: 50)
+
+        Returns
+        -------
+        hist: Histogram
+        """
+        if not (np.isfinite(low) and np.isfinite(high)):
+            low, high = 0., 1.
+        elif low == high:
+            low, high = low - 0.5, high + 0.5
+        return cls(np.linspace(low, high, bins + 1))
+
+    @classmethod
+    def agreed(cls, values, bins=50, comm=None):
+        """
+        Empty histogram with the edges np.histogram would pick for the
+        values of every rank, a collective call.  Filled on every rank
+        and reduced, the counts are those of np.histogram of all the
+        values.
+
+        Parameters
+        ----------
+        values: array like
+            Local values, may be empty.
+
+        bins: int (Default: 50)
+
+        comm: MPI.Comm (Default: None)
+            Ranks to agree with, None for a single process.
+
+        Returns
+        -------
+        hist: Histogram
+        """
+        values = np.asarray(values, dtype=float)
+        low = values.min() if len(values) else np.inf
+        high = values.max() if len(values) else -np.inf
+        if comm is not None:
+            low = comm.allreduce(low, op=MPI.MIN)
+            high = comm.allreduce(high, op=MPI.MAX)
+        return cls.from_range(low, high, bins)
+
+    @property
+    def edges(self):
+        """Bin edges"""
+        return self._edges
+
+    @property
+    def counts(self):
+        """Counts inside the edges, as from np.histogram"""
+        return self._counts[1:-1]
+
+    @property
+    def underflow(self):
+        """Number of values below the first edge"""
+        return int(self._counts[0])
+
+    @property
+    def overflow(self):
+        """Number of values above the last edge"""
+        return int(self._counts[-1])
+
+    def index(self, values):
+        """
+        Bin of each value, 0 for underflow, 1 for the first bin and
+        len(edges) for overflow.
+        """
+        idx = np.searchsorted(self._edges, values, side='right')
+        # The last bin is closed
+        return np.where(np.equal(values, self._edges[-1]), idx - 1, idx)
+
+    def fill(self, values):
+        """Count values"""
+        self._counts += np.bincount(np.atleast_1d(self.index(values)),
+                                    minlength=len(self._counts))
+
+    def merge(self, other):
+        """Add the counts of a histogram with the same edges"""
+        if not np.array_equal(self._edges, other.edges):
+            raise ValueError('Histograms with different edges can not be '
+                             'merged')
+        self._counts += other._counts
+
+        return self
+
+    def reduce(self, comm, root=0):
+        """
+        Sum the counts of every rank, a collective call.
+
+        Returns
+        -------
+        hist: Histogram
+            Merged histogram on the root rank, None on the others.
+        """
+        is_root = comm.Get_rank() == root
+        total = np.empty_like(self._counts) if is_root else None
+        comm.Reduce(self._counts, total, op=MPI.SUM, root=root)
+        if not is_root:
+            return None
+        hist = Histogram(self._edges)
+        hist._counts = total
+
+        return hist
+
+
+class CalibrationStats:
+    """
+    Calibration shots kept on every rank and merged at the end, instead
+    of saving and reloading the small data.
+
+    Every rank keeps the i0, jet and azav of its own shots.  Once every
+    rank added its shots, the collective methods merge what the
+    calibration needs in the order it needs it: the i0 histogram on edges
+    agreed from the i0 range of every rank, then the azav and jet
+    statistics of the shots inside the i0 cut, then the intensity in the
+    peak window of those shots.  Only counts, sums and the per shot i0
+    and window intensity inside the cut reach the root rank, the results
+    are the same as from the small data of every shot.  Shots without a
+    finite i0 are skipped.
+
+    Parameters
+    ----------
+    n_azav: int
+        Number of azav bins.
+
+    comm: MPI.Comm (Default: None)
+        Communicator of the ranks to merge, None for a single process.
+    """
+    def __init__(self, n_azav, comm=None):
+        self._comm = comm
+        self._count = 0
+        self._i0 = np.empty(0)
+        self._jet = np.empty((0, 2))
+        self._azav = np.empty((0, int(n_azav)))
+
+    @property
+    def count(self):
+        """Number of shots added on this rank"""
+        return self._count
+
+    def add(self, azav, i0, jet_peak=np.nan, jet_loc=np.nan):
+        """
+        Add one shot.
+
+        Parameters
+        ----------
+        azav: ndarray
+            Azimuthal average of the shot.
+
+        i0: float
+
+        jet_peak: float (Default: NaN)
+
+        jet_loc: float (Default: NaN)
+        """
+        i0 = float(i0)
+        if not np.isfinite(i0):
+            return
+        if self._count == len(self._i0):
+            self._i0, self._jet, self._azav = (
+                _grown(a, self._count) for a in (self._i0, self._jet,
+                                                 self._azav))
+        self._i0[self._count] = i0
+        self._jet[self._count] = jet_peak, jet_loc
+        self._azav[self._count] = azav
+        self._count += 1
+
+    def i0_histogram(self, bins=50, root=0):
+        """
+        Histogram of the i0 of every shot, with the edges np.histogram
+        would pick for all of them.  A collective call.
+
+        Parameters
+        ----------
+        bins: int (Default: 50)
+
+        root: int (Default: 0)
+
+        Returns
+        -------
+        hist: Histogram
+            On the root rank, None on the others.
+        """
+        i0 = self._i0[:self._count]
+        hist = Histogram.agreed(i0, bins, self._comm)
+        hist.fill(i0)
+
+        return hist if self._comm is None else hist.reduce(self._comm, root)
+
+    def select(self, low, high):
+        """
+        Shots of this rank inside an i0 range, both edges excluded.
+
+        Returns
+        -------
+        sel: ndarray
+            Boolean mask for the other methods.
+        """
+        i0 = self._i0[:self._count]
+        return (i0 > low) & (i0 < high)
+
+    def mean_azav(self, sel, root=0):
+        """
+        Average azav of the selected shots of every rank, a collective
+        call.
+
+        Returns
+        -------
+        mean: ndarray
+            On the root rank, None on the others.  NaN without shots.
+        """
+        n = np.count_nonzero(sel)
+        # The sums of the rank, then the number of shots
+        local = np.zeros(self._azav.shape[1] + 1)
+        if n:
+            local[:-1] = n * mean_rows(self._azav[:self._count], sel)
+            local[-1] = n
+        total = local
+        if self._comm is not None:
+            is_root = self._comm.Get_rank() == root
+            total = np.empty_like(local) if is_root else None
+            self._comm.Reduce(local, total, op=MPI.SUM, root=root)
+            if not is_root:
+                return None
+        if not total[-1]:
+            return np.full(len(total) - 1, np.nan)
+
+        return total[:-1] / total[-1]
+
+    def jet_stats(self, sel, root=0):
+        """
+        Mean and standard deviation of the jet peak and location of the
+        selected shots of every rank, a collective call.
+
+        Returns
+        -------
+        stats: dict
+            On the root rank, None on the others.
+        """
+        moments = Welford(self._jet[:self._count][sel])
+        if self._comm is not None:
+            moments = self._comm.reduce(moments, op=_merge, root=root)
+            if moments is None:
+                return None
+        mean = moments.mean if moments.n else np.full(2, np.nan)
+        std = np.sqrt(moments.var)
+        return {'jet_location_mean': mean[1],
+                'jet_location_std': std[1],
+                'jet_peak_mean': mean[0],
+                'jet_peak_std': std[0]}
+
+    def window_values(self, sel, low_bin, high_bin, root=0):
+        """
+        i0 and intensity over a window of azav bins of the selected shots
+        of every rank, a collective call.
+
+        Parameters
+        ----------
+        sel: ndarray
+            Shots of this rank to use.
+
+        low_bin: int
+            First azav bin of the window.
+
+        high_bin: int
+            Bin after the last azav bin of the window.
+
+        root: int (Default: 0)
+
+        Returns
+        -------
+        i0: ndarray
+            On the root rank, None on the others.
+
+        peak_vals: ndarray
+            Intensity of each shot, None on the other ranks.
+        """
+        local = (self._i0[:self._count][sel],
+                 window_sums(self._azav[:self._count], low_bin, high_bin,
+                             sel))
+        if self._comm is None:
+            return local
+        parts = self._comm.gather(local, root=root)
+        if parts is None:
+            return None, None
+        i0, peak_vals = zip(*parts)
+
+        return np.concatenate(i0), np.concatenate(peak_vals)
+
+
+def _grown(array, count):
+    """Copy of the first count rows of an array, with twice the rows"""
+    grown = np.empty((max(2 * count, 64),) + array.shape[1:])
+    grown[:count] = array[:count]
+
+    return grown
+
+
+def _merge(a, b):
+    """Reduction operator of the Welford moments of two ranks"""
+    return a.merge(b)
+
+
+def _row_blocks(azav, sel, block_rows):
+    """
+    Slices of rows of an array or HDF5 dataset, with the selection of each
+    block, None when every row is used.
+    """
+    n_rows = len(azav)
+    if isinstance(azav, np.ndarray):
+        # Already in memory (or memory mapped), no need to split
+        block_rows = max(n_rows, 1)
+    for start in range(0, n_rows, block_rows):
+        rows = slice(start, min(start + block_rows, n_rows))
+        yield rows, None if sel is None else sel[rows]
+
+
+def window_sums(azav, low_bin, high_bin, sel=None, block_rows=BLOCK_ROWS):
+    """
+    Intensity in a window of azav bins of each shot.
+
+    Parameters
+    ----------
+    azav: ndarray or h5py.Dataset
+        Azav of the shots, one row per shot.
+
+    low_bin: int
+        First bin of the window.
+
+    high_bin: int
+        Bin after the window.
+
+    sel: ndarray (Default: None)
+        Boolean mask of the shots to use, None for all.
+
+    block_rows: int (Default: BLOCK_ROWS)
+        Rows read at a time from a dataset.
+
+    Returns
+    -------
+    sums: ndarray
+        One value per selected shot.
+    """
+    sums = []
+    for rows, keep in _row_blocks(azav, sel, block_rows):
+        block = azav[rows, low_bin:high_bin]
+        sums.append((block if keep is None else block[keep]).sum(1))
+
+    return np.concatenate(sums) if sums else np.empty(0)
+
+
+def mean_rows(azav, sel=None, block_rows=BLOCK_ROWS):
+    """
+    Average azav of the selected shots, without copying them.
+
+    Parameters
+    ----------
+    azav: ndarray or h5py.Dataset
+        Azav of the shots, one row per shot.
+
+    sel: ndarray (Default: None)
+        Boolean mask of the shots to use, None for all.
+
+    block_rows: int (Default: BLOCK_ROWS)
+        Rows read at a time from a dataset.
+
+    Returns
+    -------
+    mean: ndarray
+        NaN without shots.
+    """
+    total = np.zeros(azav.shape[1])
+    n = 0
+    for rows, keep in _row_blocks(azav, sel, block_rows):
+        block = azav[rows]
+        if keep is None:
+            total += block.sum(0)
+            n += len(block)
+        else:
+            # The mask product sums the rows in place of a fancy index copy
+            total += keep.astype(block.dtype) @ block
+            n += np.count_nonzero(keep)
+
+    return total / n if n else np.full(len(total), np.nan)
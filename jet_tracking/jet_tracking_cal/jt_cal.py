@@ -2,11 +2,9 @@ import json
 import logging
 import os
 import sys
-import time
 from argparse import ArgumentParser
 from pathlib import Path
 
-import h5py
 import matplotlib.pyplot as plt
 import numpy as np
 import panel as pn
@@ -15,13 +13,16 @@ import yaml
 from bokeh.models import ColorBar, Legend, LegendItem, LinearColorMapper, Span
 from bokeh.plotting import figure
 from mpi4py import MPI
-from scipy.optimize import curve_fit
 
 fpath = os.path.dirname(os.path.abspath(__file__))
 fpathup = '/'.join(fpath.split('/')[:-1])
 sys.path.append(fpathup)
 print(fpathup)
-from utils import get_evr_w_codes, get_r_masks  # NOQA
+from azav import AzavEngine, RadialGeometry  # NOQA
+from cal_stats import CalibrationStats, Histogram  # NOQA
+from cal_store import CalibrationStore  # NOQA
+from peak_fit import FAILED, estimate_peak  # NOQA
+from utils import get_evr_w_codes  # NOQA
 
 # Need to go to stdout for arp/sbatch
 logger = logging.getLogger(__name__)
@@ -35,69 +36,6 @@ SD_LOC = '/reg/d/psdm/'
 FFB_LOC = '/cds/data/drpsrcf/'
 
 
-def gaussian(x, a, mean, std, m, b):
-    """
-    Equation for gaussian with linear component
-
-    Parameters
-    ----------
-    x : float
-        X-coordinate.
-
-    a : float
-        Amplitude of Gaussian.
-
-    mean : float
-        Mean of Gaussian.
-
-    std : float
-        Standard deviation of Gaussian.
-
-    m : float
-        Slope of linear baseline.
-
-    b : float
-        Y-intercept of linear baseline.
-
-    Returns
-    -------
-    y : float
-        The y-coordinate for the given x-coordinate as defined by the
-        parameters given for the Gaussian on a slope with offset.
-    """
-    return (a * np.exp(-((x - mean) / 2 / std) ** 2)) + (m * x + b)
-
-
-def fit_line(ave_azav, fit_points=5):
-    """
-    Fit the line from edges of array
-
-    Parameters
-    ----------
-    ave_azav: ndarray
-        The average azimuthal average from calibration data 1D array of floats.
-
-    fit_points: int (Default: 5)
-        Number of points at each end of average azimuthal average to fit.
-
-    Returns
-    -------
-    m: float
-        slope of the fit
-
-    b: float
-        y intercept of fit
-    """
-    azav_len = len(ave_azav)
-    x0 = fit_points / 2
-    x1 = azav_len - (fit_points / 2)
-    y0 = np.mean(ave_azav[:fit_points])
-    y1 = np.mean(ave_azav[azav_len - fit_points:])
-    m, b = np.polyfit((x0, x1), (y0, y1), 1)
-
-    return m, b
-
-
 def peak_lr(array_data, threshold=0.1, bins=50):
     """Find max of normal distribution from histogram,
     search right and left until population falls below threshold,
@@ -106,14 +44,16 @@ def peak_lr(array_data, threshold=0.1, bins=50):
 
     Parameters
     ----------
-    array_data: array like
-        1D array data to cut on
+    array_data: array like or Histogram
+        1D array data to cut on, or a histogram of it, e.g. merged from
+        all ranks
 
     threshold: float
         percent of max population to throw out.  Upper/lower
 
     bins: int
-        Number of bins to generate for histogram we cut on
+        Number of bins to generate for histogram we cut on, unused with a
+        Histogram
 
     Returns
     -------
@@ -129,7 +69,11 @@ def peak_lr(array_data, threshold=0.1, bins=50):
     i0_med: float
         median i0 value
     """
-    hist_all, edges_all = np.histogram(array_data, bins=bins)
+    if isinstance(array_data, Histogram):
+        hist_all, edges_all = array_data.counts, array_data.edges
+    else:
+        hist_all, edges_all = np.histogram(array_data, bins=bins)
+
     # avoid cases where there are a lot of 0 intensity shots (peak at 0)
     hist = hist_all[1:]
     edges = edges_all[1:]
@@ -160,8 +104,9 @@ def peak_lr(array_data, threshold=0.1, bins=50):
 
 def calc_azav_peak(ave_azav):
     """
-    Get the peak from the gaussian fit with linear offset, if this
-    fails, just use the max value.  This could also use KDE.
+    Get the peak from the gaussian fit with linear offset, see
+    peak_fit.estimate_peak.  If there is no peak above the baseline, just
+    use the max value.
 
     Parameters
     ----------
@@ -173,24 +118,14 @@ def calc_azav_peak(ave_azav):
     peak: int
         index of the bin with the peak intensity
     """
-    azav_len = len(ave_azav)
-    # Fit the gaussian with line offset, fails for skewed gaussian
-    m, b = fit_line(ave_azav)
-    x = np.arange(azav_len)
-    mean = np.sum(x * ave_azav) / np.sum(ave_azav)
-    std = np.sqrt(np.sum((x - mean) ** 2 / azav_len))
-
-    # Try to get the peak from fit
-    try:
-        # Guass/w line args
-        p0 = [max(ave_azav), mean, std, m, b]
-        popt, _ = curve_fit(gaussian, x, ave_azav, p0=p0)
-        peak = int(round(popt[1]))
-    except Exception:
-        logger.info('Failed to fit Gaussian, using peak')
-        peak = np.argmax(ave_azav)
+    estimate = estimate_peak(ave_azav)
+    logger.info(f'Peak at bin {estimate.peak:.2f} +/- '
+                f'{estimate.uncertainty:.2f} from {estimate.method}, '
+                f'quality {estimate.quality}')
+    if estimate.quality == FAILED:
+        logger.warning('No peak above the azav baseline, using the max bin')
 
-    return peak
+    return int(round(estimate.peak))
 
 
 def get_integrated_intensity(ave_azav, peak_bin, delta_bin=3):
@@ -370,17 +305,20 @@ if __name__ == '__main__':
         logger.warning(f'Could not use MPI Data Source: {e}')
         sys.exit()
 
-    # Setup smd saver
-    jt_file = f'run{run}_jt_cal.h5'
-    if ffb:
-        jt_file_path = ''.join([FFB_LOC, hutch, '/', exp, '/scratch/',
-                                jt_file])
-    else:
-        jt_file_path = ''.join([SD_LOC, hutch, '/', exp, '/scratch/',
-                                jt_file])
-    if rank == 0:
-        logger.info(f'Will save small data to {jt_file_path}')
-    smd = ds.small_data(jt_file_path, gather_interval=100)
+    # Small data is only saved on request, the calibration comes from the
+    # statistics every rank accumulates
+    save_small_data = cal_params.get('save_small_data', False)
+    if save_small_data:
+        jt_file = f'run{run}_jt_cal.h5'
+        if ffb:
+            jt_file_path = ''.join([FFB_LOC, hutch, '/', exp, '/scratch/',
+                                    jt_file])
+        else:
+            jt_file_path = ''.join([SD_LOC, hutch, '/', exp, '/scratch/',
+                                    jt_file])
+        if rank == 0:
+            logger.info(f'Will save small data to {jt_file_path}')
+        smd = ds.small_data(jt_file_path, gather_interval=100)
 
     # Get the detectors from the config
     try:
@@ -392,11 +330,25 @@ if __name__ == '__main__':
         if jet_cam_name is not None:
             jet_cam = psana.Detector(jet_cam_name)
         evr = psana.Detector(evr_name)
-        masks = get_r_masks(det_map['shape'], cal_params['azav_bins'])
     except Exception as e:
         logger.warning(f'Unable to create psana detectors: {e}')
         sys.exit()
 
+    # Rank 0 fills the geometry cache, then every rank memory maps it
+    if rank == 0:
+        RadialGeometry.cached(det_map['shape'], cal_params['azav_bins'],
+                              cache_dir=det_map.get('cache_dir'))
+    comm.Barrier()
+    r_geometry = RadialGeometry.cached(det_map['shape'],
+                                       cal_params['azav_bins'],
+                                       cache_dir=det_map.get('cache_dir'))
+    # Fold the psana mask into the azav bins instead of every calib array
+    azav_engine = AzavEngine(r_geometry,
+                             pixel_mask=detector.image(int(run), psana_mask))
+    # Own communicator, so the merge can't get mixed up with the small
+    # data gathers
+    cal_stats = CalibrationStats(azav_engine.n_bins, comm=comm.Dup())
+
     if rank == 0:
         logger.info(f"Gathering small data for exp: {exp}, run: {run}, events:"
                     f" {cal_params['events']}")
@@ -414,9 +366,7 @@ if __name__ == '__main__':
             if calib is None:
                 print(f'No data in shot #{evt_idx}')
                 continue
-            calib = calib * psana_mask
-            det_image = detector.image(evt, calib)
-            azav = np.array([np.mean(det_image[mask]) for mask in masks])
+            azav = azav_engine.azav(detector.image(evt, calib))
 
             # Get i0 Data this is different for differe ipm detectors
             # Be nice not to waste cycles on getattr at some point
@@ -436,40 +386,51 @@ if __name__ == '__main__':
             else:
                 max_jet_val = 1e6
                 max_jet_idx = 1e6
-            smd.event(azav=azav, i0=i0_data, jet_peak=max_jet_val,
-                      jet_loc=max_jet_idx)
+            cal_stats.add(azav, i0_data, max_jet_val, max_jet_idx)
+            if save_small_data:
+                smd.event(azav=azav, i0=i0_data, jet_peak=max_jet_val,
+                          jet_loc=max_jet_idx)
         except Exception as e:
             logger.info(f'Unable to process event {evt_idx}: {e}')
 
         if evt_idx > num_events:
             break
 
-    smd.save()
+    # Every rank takes part in the merges once its loop is done, the cut
+    # and the peak are found on rank 0 and shared.  Before the small data
+    # save, which is a collective too.
+    i0_hist = cal_stats.i0_histogram()
+    i0_cut = None
     if rank == 0:
-        while not os.path.exists(jt_file_path):
-            time.sleep(0.1)
-        logger.info('Saved Small Data, Processing...')
-
-        f = h5py.File(jt_file_path, 'r')
-        i0_data = np.array(f['i0'])
-        azav_data = np.array(f['azav'])
-        jet_loc = np.array(f['jet_loc'])
-        jet_peak = np.array(f['jet_peak'])
-
+        logger.info(f'Merged statistics of {i0_hist.counts.sum()} shots, '
+                    'processing...')
         # Find I0 distribution and filter out unused values
-        i0_data = np.array(i0_data)
-        i0_hist, edges, i0_low, i0_high, i0_med = peak_lr(i0_data)
-        i0_idxs = np.where((i0_data > i0_low) & (i0_data < i0_high))
-        i0_high = 2*i0_high
-        i0_data_use = i0_data[i0_idxs]
-
+        i0_cut = peak_lr(i0_hist)
+    i0_hist, edges, i0_low, i0_high, i0_med = comm.bcast(i0_cut, root=0)
+    i0_use = cal_stats.select(i0_low, i0_high)
+    i0_high = 2*i0_high
+
+    if jet_cam_name is not None:
+        jet_stats = cal_stats.jet_stats(i0_use)
+    # Get the azav value we'll use
+    ave_azav = cal_stats.mean_azav(i0_use)
+    # Find the peak bin from average azav values
+    peak_bin = comm.bcast(calc_azav_peak(ave_azav) if rank == 0 else None,
+                          root=0)
+    # Go back through the shots and find peak values for all the
+    # intensities
+    low_bin = peak_bin - cal_params['delta_bin']
+    high_bin = peak_bin + cal_params['delta_bin']
+    i0_data_use, peak_vals = cal_stats.window_values(i0_use, low_bin,
+                                                     high_bin)
+    if save_small_data:
+        smd.save()
+    if rank == 0:
         if jet_cam_name is not None:
-            jet_loc_use = jet_loc[i0_idxs]
-            jet_loc_mean = np.mean(jet_loc_use)
-            jet_loc_std = np.std(jet_loc_use)
-            jet_peak_use = jet_peak[i0_idxs]
-            jet_peak_mean = np.mean(jet_peak_use)
-            jet_peak_std = np.std(jet_peak_use)
+            jet_loc_mean = jet_stats['jet_location_mean']
+            jet_loc_std = jet_stats['jet_location_std']
+            jet_peak_mean = jet_stats['jet_peak_mean']
+            jet_peak_std = jet_stats['jet_peak_std']
         else:
             jet_loc_mean = None
             jet_loc_std = None
@@ -479,12 +440,6 @@ if __name__ == '__main__':
         # Generate figure for i0 params
         p = peak_fig(f'{ipm_name}', i0_hist, edges, i0_med, i0_low, i0_high)
 
-        # Get the azav value we'll use
-        azav_use = [azav_data[idx] for idx in i0_idxs[0]]
-        ave_azav = np.array((np.sum(azav_use, axis=0)) / len(azav_use))
-        # Find the peak bin from average azav values
-        peak_bin = calc_azav_peak(ave_azav)
-
         # Get the integrated intensity and generate fig
         integrated_intensity = get_integrated_intensity(
             ave_azav, peak_bin, cal_params['delta_bin'])
@@ -493,10 +448,6 @@ if __name__ == '__main__':
         p1 = azav_fig(
             ave_azav, peak_bin, integrated_intensity, cal_params['delta_bin'])
 
-        # Go back through indices and find peak values for all the intensities
-        low_bin = peak_bin - cal_params['delta_bin']
-        high_bin = peak_bin + cal_params['delta_bin']
-        peak_vals = [azav[low_bin:high_bin].sum(axis=0) for azav in azav_use]
         # Now fit I0 vs diffraction intensities
         x, y, slope, intercept, sigma = fit_limits(i0_data_use, peak_vals,
                                                    i0_low, i0_high)
@@ -548,8 +499,9 @@ if __name__ == '__main__':
         # Write metadata to file
         res_file = ''.join([calib_dir, '/jt_cal_', run, '_results'])
         with open(res_file, 'w') as f:
-            results = {k: str(v) for k, v in results.items()}
-            json.dump(results, f)
+            json.dump({k: str(v) for k, v in results.items()}, f)
+        # Index the typed results for the trackers
+        CalibrationStore(calib_dir).add(results, hutch, exp, run, res_file)
         logger.info(f'Saved calibration to {res_file}')
 
         # try to also save calib results to exp directory in hutch opr home
@@ -560,8 +512,9 @@ if __name__ == '__main__':
                 Path(hopr_dir).mkdir(mode=777, parents=True)
             res_file = ''.join([hopr_dir, '/jt_cal_', run, '_results'])
             with open(res_file, 'w') as f:
-                results = {k: str(v) for k, v in results.items()}
-                json.dump(results, f)
+                json.dump({k: str(v) for k, v in results.items()}, f)
+            CalibrationStore(hopr_dir).add(results, hutch, exp, run,
+                                           res_file)
             logger.info(f'Saved calibration to {res_file}')
         except Exception as e:
             logger.warning(f'Unable to write to {hutch}opr experiment '
@@ -0,0 +1,228 @@
+"""
+Throughput benchmark of the MPI pipeline.
+
+Runs the master and N workers on synthetic frames for every combination
+of worker count, detector shape and number of radial bins, one mpiexec
+job per point, and writes events/s, stage latencies and master queue
+depth of every point to a JSON file::
+
+    python -m jet_tracking.mpi_scripts.bench_sweep --workers 1 2 4 \\
+        --configs jet_tracking/jt_configs/xcs_config.yml --rate 120
+
+The number of workers that keeps up with the rate is what to pass to
+run_mpi_script -p, plus one for the master.  The benchmark binds its own
+ports, away from the ones of a running tracker, change them with
+--api_port, --data_port and --pub_port if they are taken.
+
+The synthetic frames are already calibrated images, so the calib stage
+only has samples with psana, here azav covers the whole window sum.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+from .counters import percentile_summary
+from .event_source import make_synthetic_frames
+from .record_sender import DEFAULT_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+CONFIG_DIR = Path(__file__).resolve().parents[1] / 'jt_configs'
+
+
+def detector_shapes(configs):
+    """Detector shape and bins of the det_map of each config file"""
+    shapes = []
+    for config in configs:
+        with open(config) as f:
+            det_map = yaml.load(f, Loader=yaml.FullLoader)['det_map']
+        shapes.append((tuple(det_map['shape']), det_map['bins']))
+    return shapes
+
+
+def summarize_point(point, results):
+    """
+    Combine the rank results of one point.
+
+    Parameters
+    ----------
+    point: dict
+        Parameters of the point, copied to the summary.
+
+    results: list of dict
+        Result of every rank, master first.
+
+    Returns
+    -------
+    summary: dict
+    """
+    master, workers = results[0], results[1:]
+    elapsed = master['t_end'] - min(w['t_start'] for w in workers)
+    counts = {}
+    sender = {}
+    for worker in workers:
+        for key, value in worker['counts'].items():
+            counts[key] = counts.get(key, 0) + value
+        for key, value in worker['sender'].items():
+            sender[key] = sender.get(key, 0) + value
+    stages = {stage: percentile_summary(np.concatenate(
+        [w['stages'][stage] for w in workers]))
+        for stage in workers[0]['stages']}
+    stages['publish'] = percentile_summary(master['publish'])
+    summary = dict(point)
+    summary.update({
+        'elapsed': elapsed,
+        'published': master['published'],
+        'events_per_s': master['published'] / elapsed,
+        'timed_out': master['timed_out'],
+        'dropped_messages': master['dropped'],
+        'counts': counts,
+        'sender': sender,
+        'stages': stages,
+        'queue_depth': percentile_summary(master['queue_depth']),
+        'per_worker_events_per_s': [
+            sum(w['counts'].values()) / (w['t_end'] - w['t_start'])
+            for w in workers]})
+    if point['rate']:
+        # Keeping up means the requested rate made it through unharmed
+        summary['keeps_up'] = bool(
+            summary['events_per_s'] >= 0.95 * point['rate'] and
+            not master['timed_out'] and master['dropped'] == 0)
+
+    return summary
+
+
+def run_point(point, work_dir, mpiexec, ports, timeout, batch_size):
+    """
+    Run one mpiexec job and return its summary, None if it failed.  ports
+    has the api, data and pub ports of the master.
+    """
+    shape, bins = point['shape'], point['bins']
+    frames = os.path.join(work_dir, f'frames_{shape[0]}x{shape[1]}_'
+                          f'b{bins}.npy')
+    i0_path = os.path.splitext(frames)[0] + '_i0.npy'
+    if not os.path.exists(frames):
+        make_synthetic_frames(frames, shape, point['frames'],
+                              ring_bin=bins // 2, bins=bins)
+    out_dir = tempfile.mkdtemp(dir=work_dir, prefix='point_')
+    spec = {'shape': shape, 'bins': bins, 'events': point['events'],
+            'rate': point['rate'], 'frames': frames, 'i0': i0_path,
+            'cache_dir': os.path.join(work_dir, 'geometry'),
+            'out_dir': out_dir, 'api_port': ports['api'],
+            'data_port': ports['data'], 'pub_port': ports['pub'],
+            'timeout': timeout,
+            'send': {'batch_size': batch_size},
+            # Shots are gated with the i0 range of the synthetic frames
+            'calib': {'peak_bin': bins // 2, 'delta_bin': 3,
+                      'i0_low': 0.6, 'i0_high': 1.4}}
+    spec_file = os.path.join(out_dir, 'spec.json')
+    with open(spec_file, 'w') as f:
+        json.dump(spec, f)
+    cmd = shlex.split(mpiexec) + [
+        '-n', str(point['workers'] + 1), sys.executable, '-m',
+        'jet_tracking.mpi_scripts.mpi_bench', spec_file]
+    log_file = os.path.join(out_dir, 'mpi.log')
+    logger.info(f'Running {point}')
+    try:
+        with open(log_file, 'w') as log:
+            subprocess.run(cmd, check=True, timeout=timeout + 60,
+                           cwd=Path(__file__).resolve().parents[2],
+                           stdout=log, stderr=subprocess.STDOUT)
+    except (subprocess.CalledProcessError,
+            subprocess.TimeoutExpired) as e:
+        logger.warning(f'Benchmark point {point} failed: {e}, see '
+                       f'{log_file}')
+        return None
+    results = []
+    for rank in range(point['workers'] + 1):
+        with open(os.path.join(out_dir, f'rank{rank}.json')) as f:
+            results.append(json.load(f))
+
+    return summarize_point(point, results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4],
+                        help='worker counts to sweep')
+    parser.add_argument('--configs', nargs='+',
+                        default=[str(CONFIG_DIR / 'xcs_config.yml')],
+                        help='configs to take the detector shapes from')
+    parser.add_argument('--shapes', nargs='+',
+                        help='detector shapes as ROWSxCOLUMNS instead of '
+                        'the configs')
+    parser.add_argument('--bins', type=int, nargs='+',
+                        help='radial bins to sweep, defaults to the '
+                        'det_map bins')
+    parser.add_argument('--events', type=int, default=2000,
+                        help='events per point')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='event rate over all workers, 0 for as fast '
+                        'as possible')
+    parser.add_argument('--frames', type=int, default=20,
+                        help='synthetic frames replayed in a loop')
+    parser.add_argument('--batch_size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='records per worker message')
+    parser.add_argument('--mpiexec', default='mpiexec',
+                        help='launcher command with any extra options')
+    # Not the ports of the tracker, so both can run at the same time
+    parser.add_argument('--api_port', type=int, default=15005)
+    parser.add_argument('--data_port', type=int, default=18124,
+                        help='port of the master client data socket')
+    parser.add_argument('--pub_port', type=int, default=11235,
+                        help='port of the master worker command socket')
+    parser.add_argument('--timeout', type=float, default=300,
+                        help='seconds before a point is stopped')
+    parser.add_argument('--work_dir', help='directory for the frames and '
+                        'rank results, defaults to a temporary directory')
+    parser.add_argument('--output', default='jt_bench.json',
+                        help='JSON file for the results')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.shapes:
+        shapes = [(tuple(int(n) for n in s.split('x')), None)
+                  for s in args.shapes]
+    else:
+        shapes = detector_shapes(args.configs)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='jt_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+
+    ports = {'api': args.api_port, 'data': args.data_port,
+             'pub': args.pub_port}
+    points = []
+    for (shape, det_bins), workers in itertools.product(shapes,
+                                                        args.workers):
+        for bins in args.bins or [det_bins or 100]:
+            summary = run_point(
+                {'workers': workers, 'shape': list(shape), 'bins': bins,
+                 'events': args.events, 'rate': args.rate,
+                 'frames': args.frames},
+                work_dir, args.mpiexec, ports, args.timeout, args.batch_size)
+            if summary is not None:
+                logger.info(f"{workers} workers, {shape}, {bins} bins: "
+                            f"{summary['events_per_s']:.1f} events/s")
+                points.append(summary)
+
+    with open(args.output, 'w') as f:
+        json.dump({'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'host': os.uname().nodename,
+                   'mpiexec': args.mpiexec,
+                   'batch_size': args.batch_size,
+                   'points': points}, f, indent=2)
+    logger.info(f'Wrote {len(points)} points to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
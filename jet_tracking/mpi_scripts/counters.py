@@ -0,0 +1,162 @@
+import logging
+import time
+from collections import Counter
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EventCounters:
+    """
+    Count events per outcome and log the totals at a bounded rate,
+    instead of printing something for every event.
+
+    Parameters
+    ----------
+    name: str
+        Prefix of the log messages, e.g. the worker rank.
+
+    report_interval: float (Default: 10.0)
+        Minimum seconds between two reports.
+    """
+    def __init__(self, name, report_interval=10.0):
+        self._name = name
+        self._report_interval = report_interval
+        self._counts = Counter()
+        self._last_counts = Counter()
+        self._last_report = time.monotonic()
+        self._last_error = None
+
+    @property
+    def counts(self):
+        """Totals since the start of the run"""
+        return dict(self._counts)
+
+    def increment(self, key, n=1):
+        """Add n events to a counter"""
+        self._counts[key] += n
+
+    def error(self, message):
+        """Count an error, only the latest message is kept for the report"""
+        self._counts['errors'] += 1
+        self._last_error = message
+
+    def report(self, force=False):
+        """
+        Log the totals and rates if the report interval has passed.
+
+        Parameters
+        ----------
+        force: bool (Default: False)
+            Log even if the interval has not passed, e.g. at the end of a
+            run.
+
+        Returns
+        -------
+        reported: bool
+        """
+        now = time.monotonic()
+        elapsed = now - self._last_report
+        if not force and elapsed < self._report_interval:
+            return False
+        rates = {k: (v - self._last_counts[k]) / elapsed
+                 for k, v in self._counts.items()} if elapsed > 0 else {}
+        rates = ', '.join(f'{k}: {v:.1f}/s' for k, v in rates.items())
+        logger.info(f'{self._name} totals {dict(self._counts)} ({rates})')
+        if self._last_error is not None:
+            logger.warning(f'{self._name} last error: {self._last_error}')
+            self._last_error = None
+        self._last_counts = self._counts.copy()
+        self._last_report = now
+
+        return True
+
+
+def percentile_summary(samples, percentiles=(50, 90, 99)):
+    """
+    Summarize samples, e.g. durations or queue depths.
+
+    Parameters
+    ----------
+    samples: array_like
+        Values to summarize.
+
+    percentiles: tuple (Default: (50, 90, 99))
+        Percentiles to report.
+
+    Returns
+    -------
+    summary: dict
+        Number of samples, mean, max and the percentiles as ``p50`` etc.
+    """
+    samples = np.asarray(samples, dtype=float)
+    if len(samples) == 0:
+        return {'count': 0}
+    summary = {'count': len(samples), 'mean': float(samples.mean()),
+               'max': float(samples.max())}
+    for q, value in zip(percentiles, np.percentile(samples, percentiles)):
+        summary[f'p{q:g}'] = float(value)
+
+    return summary
+
+
+class StageTimer:
+    """
+    Keep the latest durations of each processing stage of an event.
+
+    `start` is called when an event starts and `mark` at the end of every
+    stage, which stores the time since the previous call.  Only the last
+    capacity durations of a stage are kept, none by default so timing
+    costs nothing but a clock read outside of benchmarks.
+
+    Parameters
+    ----------
+    stages: iterable of str
+        Names of the stages.
+
+    capacity: int (Default: 0)
+        Durations kept per stage.
+    """
+    def __init__(self, stages, capacity=0):
+        self._capacity = int(capacity)
+        self._samples = {stage: np.zeros(self._capacity) for stage in stages}
+        self._counts = dict.fromkeys(self._samples, 0)
+        self._last = None
+
+    @property
+    def stages(self):
+        """Names of the stages"""
+        return list(self._samples)
+
+    def start(self):
+        """Start timing an event"""
+        self._last = time.perf_counter()
+
+    def mark(self, stage):
+        """Store the time spent in a stage since the previous call"""
+        now = time.perf_counter()
+        self.add(stage, now - self._last)
+        self._last = now
+
+    @property
+    def capacity(self):
+        """Durations kept per stage"""
+        return self._capacity
+
+    def add(self, stage, seconds):
+        """Store a duration"""
+        if not self._capacity:
+            return
+        self._samples[stage][self._counts[stage] % self._capacity] = seconds
+        self._counts[stage] += 1
+
+    def samples(self, stage):
+        """Durations kept for a stage, not in time order once wrapped"""
+        return self._samples[stage][:min(self._counts[stage],
+                                         self._capacity)]
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """Summary of every stage in seconds, see `percentile_summary`"""
+        return {stage: percentile_summary(self.samples(stage), percentiles)
+                for stage in self._samples}
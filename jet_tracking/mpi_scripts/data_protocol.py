@@ -0,0 +1,206 @@
+import ast
+import struct
+import time
+from collections import namedtuple
+
+import numpy as np
+import zmq
+
+PROTOCOL_VERSION = 1
+# version, ndim, dtype descr length, sequence number, timestamp, rank
+_FIXED = struct.Struct('<BBHQdi')
+# Rank used when a message holds shots from several workers
+ANY_RANK = -1
+
+Header = namedtuple('Header', ['version', 'seq', 'timestamp', 'rank',
+                               'dtype', 'shape'])
+
+
+def pack_header(data, seq, timestamp, rank=ANY_RANK):
+    """
+    Binary header describing an array payload.
+
+    Parameters
+    ----------
+    data: ndarray
+        Array that will be sent as the payload frame.
+
+    seq: int
+        Sequence number of the message.
+
+    timestamp: float
+        Time of the message in seconds.
+
+    rank: int (Default: ANY_RANK)
+        MPI rank the data came from.
+
+    Returns
+    -------
+    header: bytes
+    """
+    descr = repr(np.lib.format.dtype_to_descr(data.dtype)).encode()
+    return b''.join((_FIXED.pack(PROTOCOL_VERSION, data.ndim, len(descr),
+                                 seq, timestamp, rank),
+                     struct.pack(f'<{data.ndim}Q', *data.shape),
+                     descr))
+
+
+def unpack_header(buf, dtypes=None):
+    """
+    Parse a header built by `pack_header`.
+
+    Parameters
+    ----------
+    buf: bytes like
+        Header frame.
+
+    dtypes: dict (Default: None)
+        Cache of already parsed dtype descriptions, avoids parsing the
+        same description for every message.
+
+    Returns
+    -------
+    header: Header
+    """
+    buf = memoryview(buf)
+    version, ndim, descr_len, seq, timestamp, rank = \
+        _FIXED.unpack_from(buf)
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f'Unsupported data protocol version {version}')
+    offset = _FIXED.size
+    shape = struct.unpack_from(f'<{ndim}Q', buf, offset)
+    offset += 8 * ndim
+    descr = bytes(buf[offset:offset + descr_len])
+    if dtypes is not None and descr in dtypes:
+        dtype = dtypes[descr]
+    else:
+        dtype = np.lib.format.descr_to_dtype(
+            ast.literal_eval(descr.decode()))
+        if dtypes is not None:
+            dtypes[descr] = dtype
+
+    return Header(version, seq, timestamp, rank, dtype, shape)
+
+
+class DataPublisher:
+    """
+    Send arrays as two frame multipart messages, a binary header and the
+    raw payload.
+
+    Both frames are delivered together or not at all, so subscribers can
+    never pair a header with the wrong payload.  The payload is handed to
+    zmq without copying; a batch of shots is simply a longer array.
+
+    Parameters
+    ----------
+    socket: zmq.Socket
+        Bound PUB socket.
+    """
+    def __init__(self, socket):
+        self._socket = socket
+        self._seq = 0
+
+    @property
+    def seq(self):
+        """Sequence number of the next message"""
+        return self._seq
+
+    def send(self, data, rank=ANY_RANK, timestamp=None):
+        """
+        Publish an array, never blocks.
+
+        Parameters
+        ----------
+        data: ndarray
+            Array to send, must not be modified after sending.
+
+        rank: int (Default: ANY_RANK)
+            MPI rank the data came from.
+
+        timestamp: float (Default: None)
+            Time of the data in seconds, defaults to now.
+
+        Returns
+        -------
+        sent: bool
+            False if zmq could not queue the message.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        data = np.ascontiguousarray(data)
+        header = pack_header(data, self._seq, timestamp, rank)
+        self._seq += 1
+        try:
+            self._socket.send_multipart([header, data], zmq.NOBLOCK,
+                                        copy=False, track=False)
+        except zmq.Again:
+            return False
+
+        return True
+
+
+class DataSubscriber:
+    """
+    Receive arrays sent by a `DataPublisher`.
+
+    Received arrays are views on the zmq message buffers, no copy is
+    made.  Gaps in the sequence numbers are counted as missed
+    messages.
+
+    Parameters
+    ----------
+    address: str
+        Address of the publisher, e.g. tcp://localhost:8124.
+
+    ctx: zmq.Context (Default: None)
+        Context to create the socket with, defaults to the global instance.
+    """
+    def __init__(self, address, ctx=None):
+        ctx = ctx or zmq.Context.instance()
+        self._socket = ctx.socket(zmq.SUB)
+        self._socket.connect(address)
+        self._socket.subscribe('')
+        self._dtypes = {}
+        self._next_seq = None
+        self._missed = 0
+
+    @property
+    def socket(self):
+        """SUB socket, e.g. to register with a poller"""
+        return self._socket
+
+    @property
+    def missed(self):
+        """Number of messages missed, based on sequence numbers"""
+        return self._missed
+
+    def recv(self, flags=0):
+        """
+        Receive the next array.
+
+        Parameters
+        ----------
+        flags: int (Default: 0)
+            zmq flags, zmq.NOBLOCK raises zmq.Again if nothing is waiting.
+
+        Returns
+        -------
+        header: Header
+
+        data: ndarray
+            View on the received payload.
+        """
+        frames = self._socket.recv_multipart(flags, copy=False)
+        if len(frames) != 2:
+            raise ValueError(f'Expected 2 frames, got {len(frames)}')
+        header = unpack_header(frames[0].buffer, self._dtypes)
+        if self._next_seq is not None and header.seq > self._next_seq:
+            self._missed += header.seq - self._next_seq
+        self._next_seq = header.seq + 1
+        data = np.frombuffer(frames[1].buffer, dtype=header.dtype)
+
+        return header, data.reshape(header.shape)
+
+    def close(self):
+        """Close the socket"""
+        self._socket.close(linger=0)
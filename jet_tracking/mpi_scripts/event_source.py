@@ -0,0 +1,342 @@
+import logging
+import os
+import time
+from collections import namedtuple
+
+import h5py
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Replayed event: index into the recording, pulse id and the wall time it
+# was handed out
+ReplayEvent = namedtuple('ReplayEvent', ['index', 'pulse_id', 'timestamp'])
+
+
+class EventSource:
+    """
+    Where a worker gets its events from.
+
+    The worker only goes through these methods, so the psana data source
+    can be swapped for a replay of recorded data.  An event is whatever
+    `events` yields, it is only handed back to the other methods.
+    """
+    def setup(self, r_index):
+        """
+        Prepare the radial index before the first event, e.g. fold in the
+        detector mask.
+
+        Parameters
+        ----------
+        r_index: RadialIndex
+        """
+
+    def events(self):
+        """Iterate over the events of this worker"""
+        raise NotImplementedError
+
+    def event_id(self, evt):
+        """
+        Identify an event.
+
+        Returns
+        -------
+        pulse_id: int
+
+        timestamp: float
+            Seconds since the epoch.
+        """
+        raise NotImplementedError
+
+    def event_codes(self, evt):
+        """Event codes of the event, None if not available"""
+        raise NotImplementedError
+
+    def i0(self, evt):
+        """Incoming intensity of the event"""
+        raise NotImplementedError
+
+    def intensity(self, evt, r_index, timer=None):
+        """
+        Integrated intensity in the current window of the radial index.
+
+        Parameters
+        ----------
+        evt: event of the EventSource
+
+        r_index: RadialIndex
+
+        timer: StageTimer (Default: None)
+            Sources that calibrate the detector data mark the 'calib'
+            stage once it is calibrated, the worker marks 'azav' after.
+
+        Returns
+        -------
+        intensity: float or None
+            None if the event has no detector data.
+        """
+        raise NotImplementedError
+
+    def azav(self, evt, r_index):
+        """
+        Azimuthal average over all radial bins of the radial index.
+
+        Returns
+        -------
+        azav: ndarray or None
+            None if the event has no detector data or the source can't
+            provide it.
+        """
+        return None
+
+    def jet(self, evt):
+        """
+        Jet projection of the event.
+
+        Returns
+        -------
+        jet: tuple or None
+            (jet_peak, jet_loc), None without a jet camera or when the
+            event has no jet camera image.
+        """
+        return None
+
+
+class ReplaySource(EventSource):
+    """
+    Hand out recorded events at a fixed rate, without psana.
+
+    Events are split between the workers round robin and paced on an
+    absolute schedule, so all workers together produce the requested rate.
+    A worker that falls behind catches up without sleeping.  Timestamps are
+    the wall time an event is handed out, so the master windows and orders
+    replayed shots as if they were live.
+
+    Parameters
+    ----------
+    n_events: int
+        Number of events in the recording.
+
+    rate: float (Default: None)
+        Events per second over all workers, None or 0 for as fast as
+        possible.
+
+    worker_index: int (Default: 0)
+        Index of this worker among the workers, from 0.
+
+    n_workers: int (Default: 1)
+        Number of workers sharing the recording.
+
+    event_codes: tuple (Default: (40,))
+        Event codes every replayed event carries.
+
+    loop: bool (Default: False)
+        Start over at the end of the recording, pulse ids keep increasing.
+
+    max_events: int (Default: None)
+        Stop after this many events over all workers.
+    """
+    def __init__(self, n_events, rate=None, worker_index=0, n_workers=1,
+                 event_codes=(40,), loop=False, max_events=None):
+        if n_events == 0:
+            raise ValueError('Nothing to replay, the recording is empty')
+        self._n_events = int(n_events)
+        self._rate = float(rate) if rate else None
+        self._worker_index = int(worker_index)
+        self._n_workers = int(n_workers)
+        self._event_codes = tuple(event_codes)
+        self._loop = loop
+        self._max_events = max_events
+
+    @property
+    def n_events(self):
+        """Number of events in the recording"""
+        return self._n_events
+
+    @property
+    def rate(self):
+        """Events per second over all workers, None if unpaced"""
+        return self._rate
+
+    def events(self):
+        """Yield the events of this worker on schedule"""
+        total = self._n_events if not self._loop else None
+        if self._max_events is not None:
+            total = self._max_events if total is None else \
+                min(total, self._max_events)
+        start = time.time()
+        seq = self._worker_index
+        while total is None or seq < total:
+            if self._rate is not None:
+                delay = start + seq / self._rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            yield ReplayEvent(seq % self._n_events, self._pulse_id(seq),
+                              time.time())
+            seq += self._n_workers
+
+    def event_id(self, evt):
+        return evt.pulse_id, evt.timestamp
+
+    def event_codes(self, evt):
+        return self._event_codes
+
+    def _pulse_id(self, seq):
+        """Pulse id of the seq-th replayed event"""
+        return seq
+
+
+class SmallDataReplay(ReplaySource):
+    """
+    Replay the small data HDF5 file written by jt_cal.
+
+    The file holds the azimuthal average of every shot instead of the
+    detector image, so the intensity is the sum of the azav bins in the
+    window, as in the calibration.  Everything is read into memory.
+
+    jt_cal only writes the file with ``save_small_data: true`` in the
+    ``cal_params`` of the config, it is off by default.
+
+    Parameters
+    ----------
+    path: str
+        Small data file with azav and i0, and optionally jet_peak, jet_loc
+        and fiducials.
+
+    kwargs:
+        Passed to ReplaySource.
+    """
+    def __init__(self, path, **kwargs):
+        if not os.path.isfile(path):
+            raise FileNotFoundError(
+                f'No small data file {path} to replay, run jt_cal with '
+                'cal_params: save_small_data: true to write one')
+        with h5py.File(path, 'r') as f:
+            self._azav = np.asarray(f['azav'])
+            self._i0 = np.asarray(f['i0'], dtype=float)
+            if 'jet_peak' in f and 'jet_loc' in f:
+                self._jet = np.stack([np.asarray(f['jet_peak']),
+                                      np.asarray(f['jet_loc'])], axis=1)
+            else:
+                self._jet = None
+            self._fiducials = np.asarray(f['fiducials']) \
+                if 'fiducials' in f else None
+        super().__init__(len(self._i0), **kwargs)
+        logger.info(f'Replaying {self.n_events} events from {path}')
+
+    def i0(self, evt):
+        return self._i0[evt.index]
+
+    def intensity(self, evt, r_index, timer=None):
+        low, high = r_index.window
+        return float(self._azav[evt.index, low:high].sum())
+
+    def azav(self, evt, r_index):
+        return self._azav[evt.index]
+
+    def jet(self, evt):
+        if self._jet is None:
+            return None
+        return tuple(self._jet[evt.index])
+
+    def _pulse_id(self, seq):
+        if self._fiducials is None:
+            return seq
+        n_loops, index = divmod(seq, self.n_events)
+        # Keep pulse ids increasing when the recording loops
+        return int(self._fiducials[index]) + \
+            n_loops * int(self._fiducials.max() + 1)
+
+
+class FrameReplay(ReplaySource):
+    """
+    Replay detector images from a memory mapped ``.npy`` file, e.g. made
+    with `make_synthetic_frames`.  Only the pixels of the window are read
+    from each frame.
+
+    Parameters
+    ----------
+    path: str
+        File with the stacked images, shape (n_events, rows, columns).
+
+    i0_path: str (Default: None)
+        ``.npy`` file with the i0 of every image, i0 is 1 if None.
+
+    kwargs:
+        Passed to ReplaySource.
+    """
+    def __init__(self, path, i0_path=None, **kwargs):
+        self._frames = np.load(path, mmap_mode='r')
+        if i0_path is not None:
+            self._i0 = np.load(i0_path).astype(float)
+        else:
+            self._i0 = np.ones(len(self._frames))
+        super().__init__(len(self._frames), **kwargs)
+        logger.info(f'Replaying {self.n_events} frames from {path}')
+
+    def i0(self, evt):
+        return self._i0[evt.index]
+
+    def intensity(self, evt, r_index, timer=None):
+        return r_index.intensity(self._frames[evt.index])
+
+    def azav(self, evt, r_index):
+        return r_index.azav(self._frames[evt.index])
+
+
+def make_synthetic_frames(path, shape, n_events, ring_bin=50, bins=100,
+                          i0_range=(0.5, 1.5), noise=0.1, seed=0):
+    """
+    Write synthetic detector images for FrameReplay: a ring scaled by a
+    random i0 on top of gaussian noise.
+
+    Parameters
+    ----------
+    path: str
+        ``.npy`` file for the images, the i0 values are saved next to it
+        with an ``_i0`` suffix.
+
+    shape: tuple
+        Image shape (rows, columns).
+
+    n_events: int
+        Number of images.
+
+    ring_bin: int (Default: 50)
+        Radial bin of the ring.
+
+    bins: int (Default: 100)
+        Number of radial bins the ring position refers to.
+
+    i0_range: tuple (Default: (0.5, 1.5))
+        Range of the uniform i0 values.
+
+    noise: float (Default: 0.1)
+        Standard deviation of the noise.
+
+    seed: int (Default: 0)
+        Seed of the random numbers.
+
+    Returns
+    -------
+    i0_path: str
+        File with the i0 values.
+    """
+    rng = np.random.default_rng(seed)
+    # Same center and bin size as the radial geometry of the image
+    rows, cols = np.indices(shape)
+    r = np.hypot(rows - shape[0] / 2, cols - shape[1] / 2)
+    width = r.max() / bins
+    ring = np.exp(-0.5 * ((r - 1 - (ring_bin + 1) * width) / width) ** 2)
+    ring = ring.astype(np.float32)
+    i0 = rng.uniform(*i0_range, n_events)
+    frames = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32,
+                                       shape=(n_events,) + tuple(shape))
+    for i in range(n_events):
+        frames[i] = i0[i] * ring + rng.normal(0, noise, shape)
+    frames.flush()
+    del frames
+    i0_path = os.path.splitext(path)[0] + '_i0.npy'
+    np.save(i0_path, i0)
+
+    return i0_path
@@ -0,0 +1,241 @@
+import logging
+import math
+import time
+
+import numpy as np
+from mpi4py import MPI
+
+logger = logging.getLogger(__name__)
+
+# Tag of the health reports workers send next to their records
+HEALTH_TAG = 998
+
+# Counters are totals since the start of the run, rates are computed by
+# the master from consecutive reports
+HEALTH_DTYPE = np.dtype([
+    ('rank', 'i4'),
+    ('active', 'u1'),
+    ('time', 'f8'),
+    ('events', 'u8'),
+    ('processed', 'u8'),
+    ('rejected', 'u8'),
+    ('errors', 'u8'),
+    ('busy', 'f8'),
+    ('latency_max', 'f8'),
+], align=True)
+
+
+class HealthReporter:
+    """
+    Worker side, time the events and send a health report to the master
+    at a fixed interval.
+
+    Parameters
+    ----------
+    comm: MPI.Comm
+        Communicator to send on.
+
+    dest: int (Default: 0)
+        Rank of the master.
+
+    interval: float (Default: 1.0)
+        Seconds between reports.
+    """
+    def __init__(self, comm, dest=0, interval=1.0):
+        self._comm = comm
+        self._dest = dest
+        self._interval = interval
+        self._report = np.zeros(1, dtype=HEALTH_DTYPE)
+        self._report['rank'] = comm.Get_rank()
+        self._req = MPI.REQUEST_NULL
+        self._busy = 0.
+        self._latency_max = 0.
+        self._last_sent = time.monotonic()
+
+    def event_done(self, latency):
+        """Account for the processing time of one event"""
+        self._busy += latency
+        self._latency_max = max(self._latency_max, latency)
+
+    def maybe_send(self, counters, active=True):
+        """
+        Send a report if the interval has passed and the previous one was
+        delivered, never blocks.
+
+        Parameters
+        ----------
+        counters: EventCounters
+            Event counters of the worker.
+
+        active: bool (Default: True)
+            Whether the worker is currently taking events.
+
+        Returns
+        -------
+        sent: bool
+        """
+        now = time.monotonic()
+        if now - self._last_sent < self._interval or not self._req.Test():
+            return False
+        counts = counters.counts
+        report = self._report
+        report['active'] = active
+        report['time'] = time.time()
+        report['processed'] = counts.get('processed', 0)
+        report['rejected'] = (counts.get('i0_rejected', 0)
+                              + counts.get('no_calib', 0))
+        report['errors'] = counts.get('errors', 0)
+        report['events'] = (report['processed'] + report['rejected']
+                            + report['errors']
+                            + counts.get('no_event_code', 0))
+        report['busy'] = self._busy
+        report['latency_max'] = self._latency_max
+        self._latency_max = 0.
+        self._req = self._comm.Isend([report, MPI.BYTE], dest=self._dest,
+                                     tag=HEALTH_TAG)
+        self._last_sent = now
+
+        return True
+
+    def close(self):
+        """Wait for the last report to be delivered"""
+        self._req.Wait()
+
+
+class WorkerHealthMonitor:
+    """
+    Master side, keep the latest health of every worker and find the
+    stragglers.
+
+    A worker is a straggler if its event rate is below straggler_ratio
+    times the median rate of the active workers, or if it has not reported
+    for longer than timeout.
+
+    Parameters
+    ----------
+    workers: iterable of int
+        Ranks of the workers.
+
+    straggler_ratio: float (Default: 0.5)
+        Fraction of the median event rate below which a worker lags.
+
+    timeout: float (Default: 5.0)
+        Seconds without a report before a worker is considered stalled.
+    """
+    def __init__(self, workers, straggler_ratio=0.5, timeout=5.0):
+        self._workers = list(workers)
+        self._straggler_ratio = straggler_ratio
+        self._timeout = timeout
+        self._active_workers = len(self._workers)
+        self._reports = {}
+        self._rates = {}
+        self._stragglers = set()
+
+    @property
+    def active_workers(self):
+        """Number of workers taking events, the lowest ranks are active"""
+        return self._active_workers
+
+    @active_workers.setter
+    def active_workers(self, n_workers):
+        self._active_workers = min(max(int(n_workers), 1),
+                                   len(self._workers))
+
+    @property
+    def active(self):
+        """Ranks of the active workers"""
+        return self._workers[:self._active_workers]
+
+    @property
+    def stragglers(self):
+        """Ranks found lagging by the last check"""
+        return self._stragglers
+
+    def update(self, report):
+        """
+        Store a health report.
+
+        Parameters
+        ----------
+        report: np.void
+            Report of HEALTH_DTYPE.
+        """
+        rank = int(report['rank'])
+        previous = self._reports.get(rank)
+        if previous is not None:
+            elapsed = float(report['time'] - previous['time'])
+            if elapsed > 0:
+                events = float(report['events']) - float(previous['events'])
+                busy = float(report['busy'] - previous['busy'])
+                self._rates[rank] = {
+                    'event_rate': events / elapsed,
+                    'utilization': busy / elapsed,
+                    'latency_mean': busy / events if events else 0.,
+                    'latency_max': float(report['latency_max'])}
+        self._reports[rank] = report.copy()
+
+    def check(self, now=None):
+        """
+        Look for stragglers among the active workers.
+
+        Parameters
+        ----------
+        now: float (Default: None)
+            Current time in seconds, defaults to now.
+
+        Returns
+        -------
+        lagging: set
+            Ranks that started lagging since the last check.
+
+        recovered: set
+            Ranks that stopped lagging since the last check.
+        """
+        if now is None:
+            now = time.time()
+        active = self.active
+        rates = [self._rates[r]['event_rate'] for r in active
+                 if r in self._rates]
+        median = np.median(rates) if rates else 0.
+        stragglers = set()
+        for rank in active:
+            report = self._reports.get(rank)
+            if report is None:
+                continue
+            if now - report['time'] > self._timeout:
+                stragglers.add(rank)
+            elif rank in self._rates and \
+                    self._rates[rank]['event_rate'] < \
+                    self._straggler_ratio * median:
+                stragglers.add(rank)
+        lagging = stragglers - self._stragglers
+        recovered = self._stragglers - stragglers
+        self._stragglers = stragglers
+
+        return lagging, recovered
+
+    def summary(self):
+        """Latest rates of every worker that reported twice"""
+        return {rank: dict(rates) for rank, rates in self._rates.items()}
+
+    def suggested_workers(self, target_utilization=0.8):
+        """
+        Number of workers needed to keep the active ones below the target
+        utilization at the current load.
+
+        Parameters
+        ----------
+        target_utilization: float (Default: 0.8)
+            Fraction of the time a worker should spend processing.
+
+        Returns
+        -------
+        n_workers: int or None
+            None until the active workers have reported rates.
+        """
+        rates = [self._rates[r] for r in self.active if r in self._rates]
+        if not rates:
+            return None
+        load = sum(r['utilization'] for r in rates)
+        return min(max(math.ceil(load / target_utilization), 1),
+                   len(self._workers))
@@ -1,6 +1,5 @@
 import argparse
 
-# import numpy as np
 import yaml
 import zmq
 
@@ -17,17 +16,12 @@ context = zmq.Context()
 socket = context.socket(zmq.PAIR)
 socket.connect(''.join(['tcp://localhost:', str(api_port)]))
 
-# Example for subscribing to np arrays zmq
-# context_data = zmq.Context()
-# socket_data = context_data.socket(zmq.SUB)
-# socket_data.connect(''.join(['tcp://localhost:', '8123']))
-# socket_data.subscribe("")  # All topics
+# Example for subscribing to the np arrays published by the master
+# from data_protocol import DataSubscriber
+# subscriber = DataSubscriber('tcp://localhost:8124')
 # while True:
-#     md = socket_data.recv_json(flags=0)
-#     msg = socket.recv(flags=0, copy=False, track=False)
-#     buf = memoryview(msg)
-#     data = np.frombuffer(buf, dtype=md['dtype'])
-#     print('data ', data.reshape(md['shape']))
+#     header, data = subscriber.recv()
+#     print(f'seq {header.seq} from rank {header.rank}: ', data)
 
 
 def abort():
@@ -42,3 +36,8 @@ def set_peak_bin(peak_bin):
 
 def set_delta_bin(delta_bin):
     socket.send_pyobj({'cmd': 'delta_bin', 'value': delta_bin})
+
+
+def set_active_workers(n_workers):
+    """Number of workers taking events, the others idle"""
+    socket.send_pyobj({'cmd': 'active_workers', 'value': n_workers})
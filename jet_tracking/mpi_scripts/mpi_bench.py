@@ -0,0 +1,145 @@
+"""
+One point of the pipeline benchmark, run under mpiexec by bench_sweep.
+
+Rank 0 runs the master, the other ranks run workers replaying synthetic
+frames.  The master stops once every event is published and each rank
+writes its timings to the output directory of the spec.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from threading import Timer
+
+from mpi4py import MPI
+
+from .counters import StageTimer
+from .data_protocol import ANY_RANK
+from .event_source import FrameReplay
+from .mpi_master import MpiMaster
+from .mpi_worker import MpiWorker
+
+fpath = os.path.dirname(os.path.abspath(__file__))
+fpathup = '/'.join(fpath.split('/')[:-1])
+sys.path.append(fpathup)
+
+from azav import RadialGeometry, RadialIndex  # noqa: E402
+
+
+class BenchMaster(MpiMaster):
+    """
+    Master that times publishing, samples the queue depth and stops once
+    n_events records are published.
+
+    Parameters
+    ----------
+    n_events: int
+        Records to publish before stopping.
+
+    args, kwargs:
+        Passed to MpiMaster.
+    """
+    def __init__(self, *args, n_events, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._n_events = n_events
+        self._published = 0
+        self.timer = StageTimer(('publish',), capacity=n_events)
+        self.queue_depth = []
+        self.t_end = None
+
+    @property
+    def published(self):
+        """Number of records published"""
+        return self._published
+
+    def publish(self, batch, rank=ANY_RANK):
+        self.queue_depth.append(len(self.queue))
+        start = time.perf_counter()
+        super().publish(batch, rank)
+        self.timer.add('publish', time.perf_counter() - start)
+        self._published += len(batch)
+        if self._published >= self._n_events and self.t_end is None:
+            self.t_end = time.time()
+            self.stop()
+
+    def stop(self):
+        """Leave the receive loop"""
+        self.abort = True
+        self.wake()
+
+
+def run_master(spec, n_events):
+    """Run the master until every event is published or the timeout"""
+    master = BenchMaster(0, spec['api_port'], {}, {}, sim=True,
+                         data_port=spec['data_port'],
+                         pub_port=spec['pub_port'],
+                         max_records=spec['send']['batch_size'],
+                         n_events=n_events)
+    timeout = Timer(spec['timeout'], master.stop)
+    timeout.daemon = True
+    timeout.start()
+    t_start = time.time()
+    master.start_run()
+    timeout.cancel()
+    return {'t_start': t_start,
+            't_end': master.t_end or time.time(),
+            'published': master.published,
+            'dropped': master.dropped,
+            'timed_out': master.t_end is None,
+            'publish': master.timer.samples('publish').tolist(),
+            'queue_depth': master.queue_depth}
+
+
+def run_worker(spec, r_index, rank, size):
+    """Replay the frames and return the worker timings"""
+    source = FrameReplay(spec['frames'], i0_path=spec['i0'],
+                         rate=spec['rate'], worker_index=rank - 1,
+                         n_workers=size - 1, loop=True,
+                         max_events=spec['events'])
+    worker = MpiWorker(source, r_index, spec['calib'], event_code=40,
+                       data_port=spec['pub_port'], send_params=spec['send'],
+                       timer_samples=spec['events'])
+    t_start = time.time()
+    worker.start_run()
+    return {'rank': rank,
+            't_start': t_start,
+            't_end': time.time(),
+            'counts': worker.counters.counts,
+            'sender': worker.sender.stats(),
+            'stages': {stage: worker.timer.samples(stage).tolist()
+                       for stage in worker.timer.stages}}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('spec', help='JSON file describing the point')
+    args = parser.parse_args()
+    with open(args.spec) as f:
+        spec = json.load(f)
+
+    comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+    size = comm.Get_size()
+    shape = tuple(spec['shape'])
+    # Rank 0 fills the geometry cache, then every rank memory maps it
+    if rank == 0:
+        RadialGeometry.cached(shape, spec['bins'],
+                              cache_dir=spec['cache_dir'])
+    comm.Barrier()
+    r_geometry = RadialGeometry.cached(shape, spec['bins'],
+                                       cache_dir=spec['cache_dir'])
+    # Workers only start once every rank is set up
+    if rank == 0:
+        comm.Barrier()
+        result = run_master(spec, spec['events'])
+    else:
+        r_index = RadialIndex(r_geometry)
+        comm.Barrier()
+        result = run_worker(spec, r_index, rank, size)
+    with open(os.path.join(spec['out_dir'], f'rank{rank}.json'), 'w') as f:
+        json.dump(result, f)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,18 +5,20 @@ import os
 import sys
 from pathlib import Path
 
-import psana
 import yaml
 from mpi4py import MPI
 
+from .event_source import FrameReplay, SmallDataReplay
 from .mpi_master import MpiMaster
 from .mpi_worker import MpiWorker
+from .record_sender import DEFAULT_BATCH_SIZE
 
 fpath = os.path.dirname(os.path.abspath(__file__))
 fpathup = '/'.join(fpath.split('/')[:-1])
 sys.path.append(fpathup)
 
-from utils import get_r_masks  # noqa: E402
+from azav import RadialGeometry, RadialIndex  # noqa: E402
+from cal_store import CalibrationStore, typed_results  # noqa: E402
 
 logger = logging.getLogger(__name__)
 
@@ -46,6 +48,13 @@ with open(args.cfg_file) as f:
     run = yml_dict['run']
     evr_name = yml_dict['evr_name']
     event_code = yml_dict['event_code']
+    reduction = yml_dict.get('reduction')
+    send_params = yml_dict.get('send', {})
+    reorder = yml_dict.get('reorder')
+    recorder = yml_dict.get('recorder')
+    recal_cfg = dict(yml_dict.get('recalibration') or {})
+    source_cfg = dict(yml_dict.get('source') or {'type': 'psana'})
+    cal_file_path = yml_dict.get('cal_file')
     # wf_length = yml_dict['wf_length']
 
 if jet_cam_name == 'None' or jet_cam_name == 'none':
@@ -55,45 +64,92 @@ if jet_cam_name == 'None' or jet_cam_name == 'none':
 calib_dir = Path(''.join(['/cds/data/psdm/', hutch, '/', exp, '/calib/']))
 jt_dir = Path(''.join([str(calib_dir), '/jt_results/']))
 
-# cal_files = sorted(os.listdir(jt_dir))
-cal_files = list(jt_dir.glob('jt_cal*'))
-cal_files.sort(key=os.path.getmtime)
-if cal_files:
-    cal_file_path = cal_files[-1]
-    # cal_file_path = ''.join([jt_dir, cal_file])
+# A cal_file from the config is used as is, e.g. for replays off site
+if cal_file_path is not None:
     print(f'Calibration file: {cal_file_path}')
     with open(cal_file_path) as f:
-        cal_results = json.load(f)
+        cal_results = typed_results(json.load(f))
 else:
-    logger.warning('You must run a calibration before starting jet tracking')
-    sys.exit()
+    cal_entry = CalibrationStore(jt_dir).latest()
+    if cal_entry is None:
+        logger.warning('You must run a calibration before starting jet '
+                       'tracking')
+        sys.exit()
+    print(f"Calibration of run {cal_entry['run']}: {cal_entry['file']}")
+    cal_results = cal_entry['results']
+
+source_type = source_cfg.pop('type')
+if source_type == 'psana':
+    # Only needed on site
+    import psana
+
+    from .psana_source import PsanaSource
 
-if sim:
-    # Run from offline data
-    exp_dir = ''.join(['/cds/data/psdm/', hutch, '/', exp, '/xtc/'])
-    dsname = ''.join(['exp=', exp, ':run=', run, ':smd:', 'dir=', exp_dir])
+    if sim:
+        # Run from offline data
+        exp_dir = ''.join(['/cds/data/psdm/', hutch, '/', exp, '/xtc/'])
+        dsname = ''.join(['exp=', exp, ':run=', run, ':smd:', 'dir=',
+                          exp_dir])
+    else:
+        # Run on shared memeory
+        dsname = 'shmem=psana.0:stop=no'
+        psana.setOption('psana.calib-dir', calib_dir)
+
+    ds = psana.DataSource(dsname)
+    detector = psana.Detector(det_map['name'])
+    ipm = (psana.Detector(ipm_name), ipm_det)
+    if jet_cam_name is not None:
+        jet_cam = psana.Detector(jet_cam_name)
+    else:
+        jet_cam = None
+    evr = psana.Detector(evr_name)
+    source = PsanaSource(ds, detector, ipm, jet_cam, jet_cam_axis, evr,
+                         raw_window=det_map.get('raw_window', False))
+elif source_type == 'smd' and not os.path.isfile(source_cfg.get('path', '')):
+    # Every rank stops, instead of the master waiting for the workers
+    logger.warning(f"No small data file {source_cfg.get('path')} to replay, "
+                   'run jt_cal with cal_params: save_small_data: true to '
+                   'write one')
+    sys.exit()
+elif source_type in ('smd', 'frames'):
+    # Replay recorded shots, workers share the events round robin
+    replay = SmallDataReplay if source_type == 'smd' else FrameReplay
+    source = None if rank == 0 else replay(
+        worker_index=rank - 1, n_workers=size - 1,
+        event_codes=(event_code,), **source_cfg)
 else:
-    # Run on shared memeory
-    dsname = 'shmem=psana.0:stop=no'
-    psana.setOption('psana.calib-dir', calib_dir)
-
-ds = psana.DataSource(dsname)
-detector = psana.Detector(det_map['name'])
-ipm = (psana.Detector(ipm_name), ipm_det)
-if jet_cam_name is not None:
-    jet_cam = psana.Detector(jet_cam_name)
+    logger.warning(f'Unknown event source {source_type}')
+    sys.exit()
+
+# Rank 0 fills the geometry cache, then every rank memory maps it
+if rank == 0:
+    RadialGeometry.cached(det_map['shape'], det_map['bins'],
+                          cache_dir=det_map.get('cache_dir'))
+comm.Barrier()
+r_geometry = RadialGeometry.cached(det_map['shape'], det_map['bins'],
+                                   cache_dir=det_map.get('cache_dir'))
+r_index = RadialIndex(r_geometry)
+
+# Workers send decimated azav profiles, the master follows the ring
+if recal_cfg:
+    profile = {'decimation': recal_cfg.pop('decimation', 10),
+               'interval': recal_cfg.pop('send_interval', 1.0)}
+    recalibration = dict(recal_cfg, n_bins=r_geometry.n_bins,
+                         peak_bin=int(cal_results['peak_bin']))
 else:
-    jet_cam = None
-evr = psana.Detector(evr_name)
-r_mask = get_r_masks(det_map['shape'])
+    profile = recalibration = None
 
 if rank == 0:
-    master = MpiMaster(rank, api_port, det_map, pv_map, sim=sim)
+    master = MpiMaster(rank, api_port, det_map, pv_map, sim=sim,
+                       reduction=reduction, reorder=reorder,
+                       recorder=recorder, recalibration=recalibration,
+                       max_records=send_params.get('batch_size',
+                                                   DEFAULT_BATCH_SIZE))
     master.start_run()
 else:
     peak_bin = int(cal_results['peak_bin'])
     delta_bin = int(cal_results['delta_bin'])
-    worker = MpiWorker(ds, detector, ipm, jet_cam, jet_cam_axis, evr, r_mask,
-                       cal_results, event_code=event_code)
+    worker = MpiWorker(source, r_index, cal_results, event_code=event_code,
+                       send_params=send_params, profile=profile)
     print('Worker')
     worker.start_run()
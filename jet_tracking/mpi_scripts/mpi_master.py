@@ -1,21 +1,36 @@
 import logging
 import time
 from collections import deque
-from threading import Lock, Thread
+from threading import Event, Lock, Thread
 
 import numpy as np
 import zmq
-from epics import caput
 from mpi4py import MPI
 
+from .data_protocol import ANY_RANK, DataPublisher
+from .health import HEALTH_DTYPE, HEALTH_TAG, WorkerHealthMonitor
+from .pv_publisher import PvPublisher
+from .recalibration import PROFILE_TAG, PeakRecalibrator, profile_nbytes
+from .recorder import RecordWriter
+from .records import RECORD_DTYPE, empty_records
+from .reduction import ShotReducer
+from .reorder import ReorderBuffer
+
 f = '%(asctime)s - %(levelname)s - %(filename)s:%(funcName)s - %(message)s'
 logging.basicConfig(level=logging.DEBUG, format=f)
 logger = logging.getLogger(__name__)
 
+# Tag the master uses to wake its own receive loop
+WAKE_TAG = 999
+
 
 class MpiMaster:
     def __init__(self, rank, api_port, det_map, pv_map, sim=True,
-                 data_port=8123, wf_length=None):
+                 data_port=8124, pub_port=1235, wf_length=None,
+                 queue_size=1000,
+                 reduction=None, batch_size=100, max_records=64,
+                 health=None, health_log_interval=10.0, reorder=None,
+                 recorder=None, recalibration=None):
         self._rank = rank
         self._det_map = det_map
         self._pv_map = pv_map
@@ -24,15 +39,39 @@ class MpiMaster:
         self._workers = range(self._comm.Get_size())[1:]
         self._running = False
         self._abort = False
-        self._queue = deque()
-        self._data_socket = self.get_data_socket()
-        self._pub_socket = self.get_pub_socket()
+        self._queue = deque(maxlen=queue_size)
+        self._queue_ready = Event()
+        self._dropped = 0
+        self._batch_size = batch_size
+        self._max_records = max_records
+        # Optionally summarize shots over windows before publishing
+        self._reducer = ShotReducer(**reduction) if reduction else None
+        # Optionally put shots from all workers back in time order
+        self._reorder = ReorderBuffer(**reorder) if reorder else None
+        # Optionally keep every record on disk for offline analysis
+        self._recorder = RecordWriter(**recorder) if recorder else None
+        # Optionally follow the ring with the worker azav profiles
+        self._recal = PeakRecalibrator(**recalibration) \
+            if recalibration else None
+        self._health = WorkerHealthMonitor(self._workers, **(health or {}))
+        self._health_log_interval = health_log_interval
+        self._last_health_log = time.monotonic()
+        self.pair_ctx = None
+        self.msg_ctx = None
+        self._data_socket = self.get_data_socket(data_port)
+        self._data_publisher = None if self._data_socket is None else \
+            DataPublisher(self._data_socket)
+        self._pv_publisher = None if sim else PvPublisher(pv_map)
+        self._pub_socket = self.get_pub_socket(pub_port)
+        # The API thread and the receive loop both send worker commands
+        self._pub_lock = Lock()
         self._msg_lock = Lock()
+        self._recv_bufs, self._recv_reqs = self.get_recv_requests()
+        self._recv_statuses = [MPI.Status() for _ in self._recv_reqs]
         self._msg_thread = Thread(target=self.start_msg_thread,
-                                  args=(api_port))
+                                  args=(api_port,), daemon=True)
         self._msg_thread.start()
-        self.pair_ctx = None
-        self.msg_ctx = None
+        self._pub_thread = Thread(target=self.start_pub_thread, daemon=True)
 
     @property
     def rank(self):
@@ -49,6 +88,16 @@ class MpiMaster:
         """Workers currently sending"""
         return self._workers
 
+    @property
+    def health(self):
+        """Health of the workers"""
+        return self._health
+
+    @property
+    def recalibration(self):
+        """PeakRecalibrator following the ring, None if disabled"""
+        return self._recal
+
     @property
     def det_map(self):
         """Detector info"""
@@ -59,6 +108,16 @@ class MpiMaster:
         """Queue for processing data from workers"""
         return self._queue
 
+    @property
+    def max_records(self):
+        """Most records a worker can send in one message"""
+        return self._max_records
+
+    @property
+    def dropped(self):
+        """Number of messages dropped because the queue was full"""
+        return self._dropped
+
     @property
     def running(self):
         """Check if master is running"""
@@ -93,23 +152,169 @@ class MpiMaster:
         socket.bind(''.join(['tcp://*:', str(data_port)]))
         return socket
 
+    def get_recv_requests(self):
+        """Preallocate one receive slot of max_records records and a
+        persistent request per worker, plus one request the master can use
+        to wake itself up
+        """
+        # Slots also receive the health reports and azav profiles
+        n_bytes = HEALTH_DTYPE.itemsize
+        if self._recal is not None:
+            n_bytes = max(n_bytes, profile_nbytes(self._recal.n_bins))
+        n_records = max(self.max_records,
+                        -(-n_bytes // RECORD_DTYPE.itemsize))
+        bufs = empty_records((len(self.workers) + 1, n_records))
+        reqs = [self.comm.Recv_init([bufs[i], MPI.BYTE], source=worker,
+                                    tag=MPI.ANY_TAG)
+                for i, worker in enumerate(self.workers)]
+        reqs.append(self.comm.Recv_init([bufs[-1], MPI.BYTE],
+                                        source=self.rank, tag=WAKE_TAG))
+        return bufs, reqs
+
+    def wake(self):
+        """Complete the wake up request so the receive loop checks abort"""
+        self.comm.Send([self._recv_bufs[-1], MPI.BYTE], dest=self.rank,
+                       tag=WAKE_TAG)
+
     def start_run(self):
-        """Main process loop, we can probably get more async
-        but for now it's a one to one recive/send
+        """Main process loop, drains every record vector that completed
+        since the last cycle and hands them to the publishing thread
         """
+        self._running = True
+        self._pub_thread.start()
+        MPI.Prequest.Startall(self._recv_reqs)
+        wake_idx = len(self._recv_reqs) - 1
+        woken = False
         while not self.abort:
-            start = time.time()
-            data = np.empty(len(self._pv_map),
-                            dtype=np.dtype(self.det_map['dtype']))
-            req = self.comm.Irecv(data, source=MPI.ANY_SOURCE)
-            self.send_from_queue()
-            req.Wait()
-            self.queue.append(data)
-            print(time.time() - start)
-        self.pair_ctx.close()
-        self.msg_ctx.close()
+            done = MPI.Prequest.Waitsome(self._recv_reqs,
+                                         self._recv_statuses) or []
+            # Statuses are filled in the order of the completed indices
+            for i, status in zip(done, self._recv_statuses):
+                if i == wake_idx:
+                    woken = True
+                    continue
+                if status.Get_tag() == HEALTH_TAG:
+                    report = self._recv_bufs[i].view(np.uint8)[
+                        :HEALTH_DTYPE.itemsize].view(HEALTH_DTYPE)[0]
+                    self.handle_health(report)
+                    self._recv_reqs[i].Start()
+                    continue
+                if status.Get_tag() == PROFILE_TAG:
+                    profile = self._recv_bufs[i].view(np.uint8)[
+                        :status.Get_count(MPI.BYTE)].view(float)
+                    self.handle_profile(profile)
+                    self._recv_reqs[i].Start()
+                    continue
+                n_records = status.Get_count(MPI.BYTE) // RECORD_DTYPE.itemsize
+                if len(self.queue) == self.queue.maxlen:
+                    self._dropped += 1
+                records = self._recv_bufs[i, :n_records].copy()
+                self.queue.append((self.workers[i], records))
+                if self._recorder is not None:
+                    self._recorder.write(records)
+                self._recv_reqs[i].Start()
+            self._queue_ready.set()
+        self._running = False
+        self._queue_ready.set()
+        self._pub_thread.join()
+        if self._pv_publisher is not None:
+            self._pv_publisher.stop()
+            logger.info(f'PV publisher stats: {self._pv_publisher.stats()}')
+        if self._recorder is not None:
+            self._recorder.close()
+            logger.info(f'Recorded {self._recorder.written} records to '
+                        f'{len(self._recorder.files)} files, dropped '
+                        f'{self._recorder.dropped} messages')
+        # Only active requests can be cancelled
+        for req in self._recv_reqs[:wake_idx]:
+            req.Cancel()
+        if not woken:
+            self._recv_reqs[wake_idx].Cancel()
+        MPI.Request.Waitall(self._recv_reqs)
+        for req in self._recv_reqs:
+            req.Free()
+        if self._dropped:
+            logger.warning(f'Dropped {self._dropped} messages, the '
+                           'publisher could not keep up')
+        # The message thread closes its own socket once the context is
+        # terminated, sockets can't be closed from another thread.  Without
+        # a context the thread hasn't got to its socket yet, it is a daemon
+        # and goes away with the process.
+        if self.pair_ctx is not None:
+            self.pair_ctx.term()
+            self._msg_thread.join()
+        if self._data_socket is not None:
+            self._data_socket.close(linger=0)
+        self._pub_socket.close(linger=0)
         MPI.Finalize()
 
+    def handle_health(self, report):
+        """Store a worker health report, log stragglers as they start or
+        stop lagging and the health of every worker now and then
+        """
+        self._health.update(report)
+        lagging, recovered = self._health.check()
+        summary = self._health.summary()
+        for rank in lagging:
+            logger.warning(f'Worker {rank} is lagging: {summary.get(rank)}')
+        for rank in recovered:
+            logger.info(f'Worker {rank} caught up: {summary.get(rank)}')
+        now = time.monotonic()
+        if now - self._last_health_log > self._health_log_interval:
+            logger.info(f'Worker health: {summary}, suggested number of '
+                        f'workers: {self._health.suggested_workers()}')
+            self._last_health_log = now
+
+    def handle_profile(self, profile):
+        """Merge a worker azav profile and move the peak bin of every
+        worker if the ring drifted
+        """
+        if self._recal is None:
+            return
+        self._recal.add(profile)
+        peak_bin = self._recal.check()
+        if peak_bin is not None:
+            self.send_command({'cmd': 'peak_bin', 'value': peak_bin})
+            logger.info(f'Changing peak bin to {peak_bin} to follow the '
+                        'ring')
+
+    def send_command(self, message):
+        """Publish a command to the workers"""
+        with self._pub_lock:
+            self._pub_socket.send_pyobj(message)
+
+    def start_pub_thread(self):
+        """Publish queued records as the receive loop hands them over"""
+        # Wake up regularly to release held records and close windows
+        # even when nothing arrives
+        timeouts = []
+        if self._reorder is not None:
+            timeouts.append(self._reorder.latency)
+        if self._reducer is not None and self._reducer.window:
+            timeouts.append(self._reducer.window)
+        timeout = min(timeouts) if timeouts else None
+        while self.running:
+            self._queue_ready.wait(timeout)
+            self._queue_ready.clear()
+            while self.send_from_queue():
+                pass
+            if self._reorder is not None:
+                self.process(self._reorder.pop_ready())
+            if self._reducer is not None:
+                summary = self._reducer.expire()
+                if summary is not None:
+                    self.publish(summary, ANY_RANK)
+        if self._reorder is not None:
+            self.process(self._reorder.flush())
+            if self._reorder.late or self._reorder.forced:
+                logger.warning(f'Reordering dropped {self._reorder.late} '
+                               'late records and released '
+                               f'{self._reorder.forced} early')
+        if self._reducer is not None:
+            summary = self._reducer.flush()
+            if summary is not None:
+                self.publish(summary, ANY_RANK)
+
     def start_msg_thread(self, api_port):
         """The thread runs a PAIR communication and acts as server side,
         this allows for control of the parameters during data aquisition
@@ -122,38 +327,83 @@ class MpiMaster:
         # TODO: make IP available arg
         socket.bind(''.join(['tcp://*:', str(api_port)]))
         while True:
-            message = socket.recv_pyobj()
+            try:
+                message = socket.recv_pyobj()
+            except zmq.ContextTerminated:
+                socket.close(linger=0)
+                return
             cmd = message['cmd']
             value = message['value']
             if cmd == 'abort':
-                self._pub_socket.send_pyobj(message)
+                self.send_command(message)
                 self.abort = True
+                self.wake()
                 logger.info('aborting jet tracking data analysis process')
             elif cmd == 'peak_bin':
-                self._pub_socket.send_pyobj(message)
+                self.send_command(message)
+                if self._recal is not None:
+                    try:
+                        self._recal.peak_bin = value
+                    except ValueError:
+                        logger.warning(f'Peak bin {value} is not an int')
                 msg_string = f'Changing peak bin to {value}'
                 logger.info(msg_string)
             elif cmd == 'delta_bin':
-                self._pub_socket.send_pyobj(message)
+                self.send_command(message)
                 msg_string = f'Changing delta bin to {value}'
                 logger.info(msg_string)
+            elif cmd == 'active_workers':
+                self._health.active_workers = value
+                message['value'] = self._health.active_workers
+                self.send_command(message)
+                logger.info('Changing number of active workers to '
+                            f'{self._health.active_workers}')
             else:
                 print('Received Message with no definition ', message)
 
     def send_from_queue(self):
-        if len(self.queue) > 0:
-            data = self.queue.popleft()
-            if self._sim:
-                # Could need this if sending large arrays,
-                # Could end up getting md info from config file
-                md = dict(dtype=str(data.dtype), shape=data.shape)
-                self._data_socket.send_json(md, 0 | zmq.NOBLOCK)
-                self._data_socket.send(data, 0, copy=False, track=False)
+        """Hand up to batch_size queued record vectors to the reorder
+        buffer, or process them as one batch, returns False if the queue
+        was empty
+        """
+        n_messages = min(len(self.queue), self._batch_size)
+        if n_messages == 0:
+            return False
+        batch = []
+        sources = set()
+        for _ in range(n_messages):
+            source, records = self.queue.popleft()
+            if self._reorder is not None:
+                self._reorder.push(records)
             else:
-                # consider caput_many with lots, ok for now
-                for k, v in self._pv_map.items():
-                    caput(v, data[k-1])
-                # caput('XCS:JTRK:REQ:DIFF_INTENSITY', data[1])
-                # caput('XCS:JTRK:REQ:I0', data[0])
+                batch.append(records)
+                sources.add(source)
+        if self._reorder is not None:
+            self.process(self._reorder.pop_ready())
+        elif batch:
+            rank = sources.pop() if len(sources) == 1 else ANY_RANK
+            self.process(np.concatenate(batch), rank)
+
+        return True
+
+    def process(self, records, rank=ANY_RANK):
+        """Publish records, or add them to the current window if reducing
+        """
+        if len(records) == 0:
+            return
+        if self._reducer is None:
+            self.publish(records, rank)
+            return
+        summaries = self._reducer.add_batch(records)
+        # Windows mix shots from every worker
+        if summaries is not None:
+            self.publish(summaries, ANY_RANK)
+
+    def publish(self, batch, rank=ANY_RANK):
+        """Send a batch of records or window summaries to the clients"""
+        if self._sim:
+            self._data_publisher.send(batch, rank)
         else:
-            pass
+            # Summaries use the record field names, so either publishes
+            for data in batch:
+                self._pv_publisher.publish(data)
@@ -1,43 +1,76 @@
 import logging
+import time
+from dataclasses import dataclass, replace
 from threading import Lock, Thread
 
-import numpy as np
 import zmq
 from mpi4py import MPI
 
+from .counters import EventCounters, StageTimer
+from .health import HealthReporter
+from .recalibration import ProfileAccumulator
+from .record_sender import RecordSender
+
 f = '%(asctime)s - %(levelname)s - %(filename)s:%(funcName)s - %(message)s'
 logging.basicConfig(level=logging.DEBUG, format=f)
 logger = logging.getLogger(__name__)
 
 
+@dataclass(frozen=True)
+class WorkerParams:
+    """Immutable snapshot of the parameters the control thread can change,
+    a new version is published for every change
+    """
+    version: int
+    peak_bin: int
+    delta_bin: int
+    abort: bool = False
+    active: bool = True
+
+    @property
+    def window(self):
+        """Range of radial bins (low, high) integrated per event"""
+        return (self.peak_bin - self.delta_bin,
+                self.peak_bin + self.delta_bin)
+
+
 class MpiWorker:
-    """This worker will collect events and do whatever
+    """This worker will collect events from an EventSource and do whatever
     necessary processing, then send to master"""
-    def __init__(self, ds, detector, ipm, jet_cam, jet_cam_axis, evr, r_mask,
-                 calib_results, event_code=40, plot=False, data_port=1235):
-        self._ds = ds  # We probably need to use kwargs to make this general
-        self._detector = detector
-        self._ipm = ipm
-        self._jet_cam = jet_cam
-        self._jet_cam_axis = jet_cam_axis
-        self._evr = evr
+    def __init__(self, source, r_index, calib_results, event_code=40,
+                 plot=False, data_port=1235, send_params=None,
+                 profile=None, timer_samples=0):
+        self._source = source
         self._comm = MPI.COMM_WORLD
         self._rank = self._comm.Get_rank()
-        self._r_mask = r_mask
+        self._r_index = r_index
         self._plot = plot
         self._event_code = event_code
-        self._peak_bin = int(calib_results['peak_bin'])
-        self._delta_bin = int(calib_results['delta_bin'])
+        # The event loop reads the current snapshot without locking, the
+        # lock only serializes writers
+        self._params = WorkerParams(0, int(calib_results['peak_bin']),
+                                    int(calib_results['delta_bin']))
+        self._params_lock = Lock()
         self._i0_thresh = [float(calib_results['i0_low']),
                            float(calib_results['i0_high'])]
         self._state = None
+        self._sender = RecordSender(self._comm, dest=0, tag=self._rank,
+                                    **(send_params or {}))
+        self._counters = EventCounters(f'Worker {self._rank}')
+        # Stage durations are only kept when asked, e.g. by the benchmark
+        self._timer = StageTimer(('gate', 'calib', 'azav', 'jet', 'send',
+                                  'profile'), capacity=timer_samples)
+        self._health = HealthReporter(self._comm, dest=0)
+        # Optionally send azav profiles so the master can follow the ring
+        self._profile = ProfileAccumulator(
+            self._comm, r_index.n_bins, dest=0, **profile) \
+            if profile else None
         self._msg_thread = Thread(target=self.start_msg_thread,
-                                  args=(data_port))
+                                  args=(data_port,), daemon=True)
         self._msg_thread.start()
-        self._attr_lock = Lock()
 
-        print('I0 threshold: {}, {}'.format(self._i0_thresh[0],
-                                            self._i0_thresh[1]))
+        logger.info(f'I0 threshold: {self._i0_thresh[0]}, '
+                    f'{self._i0_thresh[1]}')
 
     @property
     def rank(self):
@@ -45,30 +78,15 @@ class MpiWorker:
         return self._rank
 
     @property
-    def ds(self):
-        """DataSource object"""
-        return self._ds
-
-    @property
-    def detector(self):
-        """Detectors to get data from"""
-        return self._detector
+    def source(self):
+        """EventSource the events come from"""
+        return self._source
 
     @property
     def comm(self):
         """MPI communicator"""
         return self._comm
 
-    @property
-    def ipm(self):
-        """IPM Detector"""
-        return self._ipm
-
-    @property
-    def evr(self):
-        """EVR detector"""
-        return self._evr
-
     @property
     def plot(self):
         """Whether we should plot detector"""
@@ -79,98 +97,205 @@ class MpiWorker:
         """Event Code to trigger data collection on"""
         return self._event_code
 
+    @property
+    def params(self):
+        """Current parameter snapshot"""
+        return self._params
+
+    def update_params(self, **changes):
+        """
+        Publish a new parameter snapshot.
+
+        Parameters
+        ----------
+        changes: dict
+            WorkerParams fields to change.
+
+        Returns
+        -------
+        params: WorkerParams
+            The published snapshot.
+        """
+        with self._params_lock:
+            self._params = replace(self._params,
+                                   version=self._params.version + 1,
+                                   **changes)
+            return self._params
+
     @property
     def peak_bin(self):
-        return self._peak_bin
+        return self._params.peak_bin
 
     @peak_bin.setter
     def peak_bin(self, peak_bin):
-        with self._attr_lock:
-            try:
-                self._peak_bin = int(peak_bin)
-            except ValueError:
-                logger.warning('You must provide int for peak bin')
+        try:
+            self.update_params(peak_bin=int(peak_bin))
+        except ValueError:
+            logger.warning('You must provide int for peak bin')
 
     @property
     def delta_bin(self):
-        return self._delta_bin
+        return self._params.delta_bin
 
     @delta_bin.setter
     def delta_bin(self, delta_bin):
-        with self._attr_lock:
-            try:
-                self._delta_bin = int(delta_bin)
-            except ValueError:
-                logger.warning('You must provide int for delta bin')
+        try:
+            self.update_params(delta_bin=int(delta_bin))
+        except ValueError:
+            logger.warning('You must provide int for delta bin')
 
     @property
-    def jet_cam(self):
-        return self._jet_cam
+    def abort(self):
+        """See if abort has been called"""
+        return self._params.abort
+
+    @abort.setter
+    def abort(self, val):
+        """Set the abort flag"""
+        if isinstance(val, bool):
+            self.update_params(abort=val)
+
+    @property
+    def counters(self):
+        """Event counters of the current run"""
+        return self._counters
+
+    @property
+    def timer(self):
+        """Durations of the processing stages of recent events"""
+        return self._timer
 
     @property
-    def jet_cam_axis(self):
-        return self._jet_cam_axis
+    def profile(self):
+        """ProfileAccumulator of the azav profiles, None if disabled"""
+        return self._profile
+
+    @property
+    def sender(self):
+        """RecordSender batching the records to the master"""
+        return self._sender
 
     def start_run(self):
         """Worker should handle any calculations"""
-        run = next(self._ds.runs()).run()
-        psana_mask = self.detector.mask(int(run), calib=True, status=True,
-                                        edges=True, central=False,
-                                        unbond=False, unbondnbrs=False)
-        for evt_idx, evt in enumerate(self.ds.events()):
+        self._source.setup(self._r_index)
+        version = None
+        for evt in self._source.events():
+            # One snapshot per event, changes apply from the next event
+            params = self._params
+            if not params.active:
+                # The event already taken is held, then processed first
+                params = self._wait_until_active()
+            if params.abort:
+                logger.info(f'Worker {self.rank} stopping on abort')
+                break
+            if params.version != version:
+                # Rebuild the cached bin index only when parameters change
+                self._r_index.set_window(*params.window)
+                version = params.version
+            # Send a partial batch that has waited long enough
+            self._sender.poll()
+            if self._profile is not None:
+                self._profile.maybe_send()
+            self._counters.report()
+            start = time.monotonic()
+            self._timer.start()
             # Definitely not a fan of wrapping the world in a try/except
             # but too many possible failure modes from the data
             try:
-                if self.event_code not in self.evr.eventCodes(evt):
+                # First stage, no detector data is touched
+                i0 = self.prefilter(evt)
+                if i0 is None:
+                    self._counters.increment('no_event_code')
+                    continue
+                # Written in place in the send buffer, only kept on commit
+                record = self._sender.next_record()
+                record['pulse_id'], record['timestamp'] = \
+                    self._source.event_id(evt)
+                record['i0'] = i0
+                in_window = self.i0_in_window(i0)
+                self._timer.mark('gate')
+                if not in_window:
+                    # Gated shots are still sent so the dropped fraction
+                    # is known downstream
+                    self._counters.increment('i0_rejected')
+                    record['dropped'] = 1
+                    self._sender.commit()
+                    self._timer.mark('send')
+                    continue
+
+                # Second stage, detector images.  The source marks the
+                # calibration, if it has one to do.
+                intensity = self._source.intensity(evt, self._r_index,
+                                                   self._timer)
+                self._timer.mark('azav')
+                if intensity is None:
+                    self._counters.increment('no_calib')
                     continue
-                with self._attr_lock:
-                    low_bin = self.peak_bin - self.delta_bin
-                    hi_bin = self.peak_bin + self.delta_bin
-
-                # Get i0 data, this is different for different ipm detectors
-                i0 = getattr(self.ipm[0].get(evt), self.ipm[1])()
-                # Filter based on i0
-                if i0 < self._i0_thresh[0] or i0 > self._i0_thresh[1]:
-                    print(f'Bad shot: {i0}')
-                    dropped = 1
-                    intensity = 0
-                    inorm = 0
-                else:
-                    print(i0)
-                    dropped = 0
-
-                    # Detector images
-                    calib = self.detector.calib(evt)
-                    if calib is None:
-                        print(f'No data in shot #{evt_idx}')
-                        continue
-                    calib = calib*psana_mask
-                    det_image = self.detector.image(evt, calib)
-                    az_bins = (np.array([np.mean(det_image[mask])
-                               for mask in self._r_mask[low_bin:hi_bin]]))
-                    intensity = np.sum(az_bins)
-                    # Normalized intensity
-                    inorm = intensity/i0
-
-                    # Get jet projection peak and location
-                #     if self.jet_cam is not None:
-                #         jet_proj = self.jet_cam.image(evt).sum(
-                #             axis=self.jet_cam_axis)
-                #         max_jet_val = np.amax(jet_proj)
-                #         max_jet_idx = np.where(jet_proj == max_jet_val)[0][0]
-                #     else:
-                #         max_jet_val = None
-                #         max_jet_idx = None
-                #
-                # packet = np.array([i0, intensity, inorm, max_jet_val,
-                #                    max_jet_idx], dtype='float32')
-                packet = np.array([intensity, i0, inorm, dropped],
-                                  dtype='float32')
-                self.comm.Isend(packet, dest=0, tag=self.rank)
-            # else:
+                record['intensity'] = intensity
+                # Normalized intensity
+                record['inorm'] = intensity/i0
+
+                # Get jet projection peak and location
+                jet = self._source.jet(evt)
+                if jet is not None:
+                    record['jet_peak'], record['jet_loc'] = jet
+                self._timer.mark('jet')
+                self._sender.commit()
+                self._timer.mark('send')
+                self._counters.increment('processed')
+                # Full azav of a fraction of the shots in the i0 window
+                if self._profile is not None and self._profile.take():
+                    azav = self._source.azav(evt, self._r_index)
+                    if azav is not None:
+                        self._profile.add(azav)
+                    self._timer.mark('profile')
             except Exception as e:
-                logger.warning(f'Unable to Process Event: {e}')
+                self._counters.error(f'Unable to Process Event: {e}')
                 continue
+            finally:
+                self._health.event_done(time.monotonic() - start)
+                self._health.maybe_send(self._counters)
+        self._sender.close()
+        self._health.close()
+        if self._profile is not None:
+            self._profile.close()
+        self._counters.report(force=True)
+
+    def _wait_until_active(self):
+        """Hold off taking events while deactivated by the master, other
+        workers then get them from shared memory.  The event taken before
+        going idle is kept and processed once active again, it is only
+        lost on abort.
+        """
+        logger.info(f'Worker {self.rank} is idle')
+        self._sender.flush()
+        while not (self._params.active or self._params.abort):
+            self._health.maybe_send(self._counters, active=False)
+            time.sleep(0.1)
+        logger.info(f'Worker {self.rank} is active')
+        return self._params
+
+    def prefilter(self, evt):
+        """
+        Cheap first stage run before any detector calibration.
+
+        Parameters
+        ----------
+        evt: event of the EventSource
+
+        Returns
+        -------
+        i0: float or None
+            i0 of the shot, None if the event code is missing.
+        """
+        codes = self._source.event_codes(evt)
+        if codes is None or self.event_code not in codes:
+            return None
+        return self._source.i0(evt)
+
+    def i0_in_window(self, i0):
+        """Check i0 against the calibration thresholds"""
+        return self._i0_thresh[0] <= i0 <= self._i0_thresh[1]
 
     def start_msg_thread(self, data_port=1235):
         """The thread runs a PAIR communication and acts as server side,
@@ -201,6 +326,9 @@ class MpiWorker:
                               f'{value}')
                 logger.info(msg_string)
                 self.delta_bin = int(value)
+            elif cmd == 'active_workers':
+                # The lowest ranks stay active
+                self.update_params(active=self.rank <= int(value))
             else:
                 logger.warning(f'Worker {self.rank} received message with no '
                                f'definition {message}')
@@ -0,0 +1,128 @@
+import logging
+from operator import methodcaller
+
+import numpy as np
+import psana
+
+from .event_source import EventSource
+
+logger = logging.getLogger(__name__)
+
+
+class PsanaSource(EventSource):
+    """
+    Events from a psana data source, offline data or shared memory.
+
+    Parameters
+    ----------
+    ds: psana.DataSource
+
+    detector: psana.Detector
+        Area detector the intensity is integrated on.
+
+    ipm: tuple
+        (psana.Detector, method name) of the i0 monitor.
+
+    jet_cam: psana.Detector
+        Jet camera, None if there is none.
+
+    jet_cam_axis: int
+        Axis the jet camera image is projected on.
+
+    evr: psana.Detector
+        EVR giving the event codes.
+
+    raw_window: bool (Default: False)
+        Sum the peak window straight from the unassembled calib array
+        instead of the detector image.
+    """
+    def __init__(self, ds, detector, ipm, jet_cam, jet_cam_axis, evr,
+                 raw_window=False):
+        self._ds = ds
+        self._detector = detector
+        # i0 accessor differs between ipm detectors, resolve it once
+        self._i0_det = ipm[0]
+        self._i0_getter = methodcaller(ipm[1])
+        self._jet_cam = jet_cam
+        self._jet_cam_axis = jet_cam_axis
+        self._evr = evr
+        self._raw_window = raw_window
+        self._run = None
+
+    @property
+    def ds(self):
+        """DataSource object"""
+        return self._ds
+
+    @property
+    def detector(self):
+        """Detector to get data from"""
+        return self._detector
+
+    @property
+    def raw_window(self):
+        """Whether the peak window is summed from the unassembled calib
+        array instead of the detector image
+        """
+        return self._raw_window
+
+    def setup(self, r_index):
+        """Fold the psana mask into the radial index so masked pixels are
+        never gathered
+        """
+        self._run = int(next(self._ds.runs()).run())
+        psana_mask = self._detector.mask(self._run, calib=True, status=True,
+                                         edges=True, central=False,
+                                         unbond=False, unbondnbrs=False)
+        if self._raw_window:
+            # Map the raw pixels onto the radial bins once, events then
+            # skip image assembly
+            ix, iy = self._detector.indexes_xy(self._run)
+            r_index.pixel_map = np.ravel_multi_index(
+                (ix, iy), r_index.geometry.shape)
+            r_index.pixel_mask = psana_mask
+        else:
+            r_index.pixel_mask = self._detector.image(self._run, psana_mask)
+
+    def events(self):
+        return self._ds.events()
+
+    def event_id(self, evt):
+        evt_id = evt.get(psana.EventId)
+        sec, nsec = evt_id.time()
+        return evt_id.fiducials(), sec + nsec * 1e-9
+
+    def event_codes(self, evt):
+        return self._evr.eventCodes(evt)
+
+    def i0(self, evt):
+        return self._i0_getter(self._i0_det.get(evt))
+
+    def intensity(self, evt, r_index, timer=None):
+        calib = self._detector.calib(evt)
+        if calib is None:
+            return None
+        if not self._raw_window:
+            calib = self._detector.image(evt, calib)
+        if timer is not None:
+            timer.mark('calib')
+        return r_index.intensity(calib)
+
+    def azav(self, evt, r_index):
+        calib = self._detector.calib(evt)
+        if calib is None:
+            return None
+        if not self._raw_window:
+            calib = self._detector.image(evt, calib)
+        return r_index.azav(calib)
+
+    def jet(self, evt):
+        if self._jet_cam is None:
+            return None
+        image = self._jet_cam.image(evt)
+        if image is None:
+            # Jet camera missing from the event, the shot is still used
+            return None
+        jet_proj = image.sum(axis=self._jet_cam_axis)
+        max_jet_idx = np.argmax(jet_proj)
+        return jet_proj[max_jet_idx], max_jet_idx
@@ -0,0 +1,171 @@
+import logging
+import time
+from collections import deque
+from threading import Condition, Thread
+
+import epics
+import numpy as np
+
+from .records import record_field
+
+logger = logging.getLogger(__name__)
+
+
+class PvPublisher:
+    """
+    Write records to EPICS PVs from a background thread.
+
+    PV objects are created once and kept connected.  Every record is
+    written as one batch of non-blocking puts (one per mapped PV), and the
+    next batch is only started when all puts of the previous one completed.
+    Records published while a batch is in flight replace each other, so a
+    slow IOC always receives the latest values instead of a backlog.
+
+    Parameters
+    ----------
+    pv_map: dict
+        Map of PV_FIELDS index (1-based) or record field name to PV name.
+
+    pv_factory: callable (Default: epics.PV)
+        Creates the PV objects, anything with an ``epics.PV`` style
+        ``put(value, wait=False, callback=...)`` works.
+
+    timeout: float (Default: 1.0)
+        Seconds to wait for a batch to complete before giving up on it.
+
+    report_interval: float (Default: 60.0)
+        Seconds between logging publishing statistics, None to disable.
+    """
+    def __init__(self, pv_map, pv_factory=epics.PV, timeout=1.0,
+                 report_interval=60.0):
+        self._fields = {k: record_field(k) for k in pv_map}
+        self._pvs = {k: pv_factory(name) for k, name in pv_map.items()}
+        self._timeout = timeout
+        self._report_interval = report_interval
+        self._cond = Condition()
+        self._latest = None
+        self._in_flight = 0
+        self._batch = 0
+        self._batch_failed = False
+        self._batch_start = None
+        self._published = 0
+        self._dropped = 0
+        self._timeouts = 0
+        self._errors = 0
+        self._latencies = deque(maxlen=1000)
+        self._running = True
+        self._thread = Thread(target=self.start_put_thread, daemon=True)
+        self._thread.start()
+
+    @property
+    def pvs(self):
+        """PV objects by record index"""
+        return self._pvs
+
+    def publish(self, record):
+        """
+        Queue a record for writing, never blocks.
+
+        Parameters
+        ----------
+        record: np.void
+            Record or window summary, each PV gets its mapped field.
+        """
+        with self._cond:
+            if self._latest is not None:
+                self._dropped += 1
+            self._latest = record
+            self._cond.notify()
+
+    def stats(self):
+        """
+        Publishing statistics.
+
+        Returns
+        -------
+        stats: dict
+            Number of records fully published, dropped (coalesced), timed
+            out and failed puts, plus put latency mean, 95th percentile and
+            max in seconds over the last 1000 records.
+        """
+        with self._cond:
+            latencies = np.array(self._latencies)
+            stats = {'published': self._published,
+                     'dropped': self._dropped,
+                     'timeouts': self._timeouts,
+                     'errors': self._errors}
+        if len(latencies):
+            stats['latency_mean'] = latencies.mean()
+            stats['latency_p95'] = np.percentile(latencies, 95)
+            stats['latency_max'] = latencies.max()
+        return stats
+
+    def stop(self):
+        """Stop the put thread, the last queued record is still written"""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join()
+
+    def start_put_thread(self):
+        """Write the latest record whenever the previous batch is done"""
+        last_report = time.monotonic()
+        while True:
+            record = None
+            with self._cond:
+                if self._in_flight and self._batch_timed_out():
+                    self._timeouts += 1
+                    self._in_flight = 0
+                if not self._in_flight:
+                    if self._latest is not None:
+                        record = self._latest
+                        self._latest = None
+                        self._in_flight = len(self._pvs)
+                        self._batch += 1
+                        self._batch_failed = False
+                        self._batch_start = time.monotonic()
+                    elif not self._running:
+                        return
+                if record is None:
+                    self._cond.wait(self._timeout)
+            if record is not None:
+                self._put_batch(record, self._batch)
+            if self._report_interval is not None and \
+                    time.monotonic() - last_report > self._report_interval:
+                logger.info(f'PV publisher stats: {self.stats()}')
+                last_report = time.monotonic()
+
+    def _put_batch(self, record, batch):
+        """Start a non-blocking put on every PV"""
+        for k, pv in self._pvs.items():
+            try:
+                ret = pv.put(float(record[self._fields[k]]), wait=False,
+                             callback=self._put_done,
+                             callback_data={'batch': batch})
+            except Exception as e:
+                logger.warning(f'Unable to put to {pv.pvname}: {e}')
+                ret = None
+            if ret is None:
+                # Not connected or failed, this put will never complete
+                with self._cond:
+                    self._errors += 1
+                    self._batch_failed = True
+                self._put_done(batch=batch)
+
+    def _put_done(self, pvname=None, batch=None, **kwargs):
+        """Put completion callback, finishes the batch on the last one"""
+        with self._cond:
+            if batch != self._batch or self._in_flight == 0:
+                # Completion of a batch that already timed out
+                return
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                if not self._batch_failed:
+                    self._published += 1
+                    self._latencies.append(
+                        time.monotonic() - self._batch_start)
+                self._cond.notify()
+
+    def _batch_timed_out(self):
+        """Check if the batch in flight has exceeded the timeout"""
+        return time.monotonic() - self._batch_start > self._timeout
@@ -0,0 +1,205 @@
+import logging
+import time
+
+import numpy as np
+from mpi4py import MPI
+
+from ..peak_fit import GOOD, estimate_peak
+
+logger = logging.getLogger(__name__)
+
+# Tag of the azav profiles workers send next to their records
+PROFILE_TAG = 997
+
+
+def profile_nbytes(n_bins):
+    """Size of a profile message, the number of shots then the azav sum"""
+    return (n_bins + 1) * np.dtype(float).itemsize
+
+
+class ProfileAccumulator:
+    """
+    Worker side, sum the azav of every decimation-th shot and send the sum
+    to the master at a fixed interval.
+
+    Parameters
+    ----------
+    comm: MPI.Comm
+        Communicator to send on.
+
+    n_bins: int
+        Number of azav bins.
+
+    dest: int (Default: 0)
+        Rank of the master.
+
+    decimation: int (Default: 10)
+        One shot out of decimation goes in the profile.
+
+    interval: float (Default: 1.0)
+        Seconds between profiles.
+    """
+    def __init__(self, comm, n_bins, dest=0, decimation=10, interval=1.0):
+        self._comm = comm
+        self._dest = dest
+        self._decimation = max(int(decimation), 1)
+        self._interval = interval
+        # Number of shots first, then the azav sum.  The next profile is
+        # summed while the previous one is sent.
+        self._profile = np.zeros(n_bins + 1)
+        self._sending = np.zeros(n_bins + 1)
+        self._req = MPI.REQUEST_NULL
+        self._offered = 0
+        self._last_sent = time.monotonic()
+
+    @property
+    def n_shots(self):
+        """Shots in the profile not sent yet"""
+        return int(self._profile[0])
+
+    def take(self):
+        """Whether the current shot should go in the profile"""
+        take = self._offered % self._decimation == 0
+        self._offered += 1
+        return take
+
+    def add(self, azav):
+        """Add the azav of a shot, empty (NaN) bins count as 0"""
+        self._profile[0] += 1
+        self._profile[1:] += np.nan_to_num(azav)
+
+    def maybe_send(self):
+        """
+        Send the profile if the interval has passed and the previous one
+        was delivered, never blocks.
+
+        Returns
+        -------
+        sent: bool
+        """
+        now = time.monotonic()
+        if self._profile[0] == 0 or now - self._last_sent < self._interval \
+                or not self._req.Test():
+            return False
+        self._profile, self._sending = self._sending, self._profile
+        self._req = self._comm.Isend([self._sending, MPI.BYTE],
+                                     dest=self._dest, tag=PROFILE_TAG)
+        self._profile[:] = 0
+        self._last_sent = now
+
+        return True
+
+    def close(self):
+        """Wait for the last profile to be delivered"""
+        self._req.Wait()
+
+
+class PeakRecalibrator:
+    """
+    Master side, merge the worker profiles and follow the ring.
+
+    Profiles are summed for window seconds, and at least min_shots, then
+    the ring peak of the average azav is estimated.  A new peak bin is
+    proposed when the fit is good and the peak moved at least threshold
+    bins away from the current peak bin.
+
+    Parameters
+    ----------
+    n_bins: int
+        Number of azav bins.
+
+    peak_bin: int
+        Current peak bin, from the calibration.
+
+    window: float (Default: 10.0)
+        Seconds of profiles per estimate.
+
+    min_shots: int (Default: 100)
+        Shots needed for an estimate.
+
+    threshold: float (Default: 1.0)
+        Bins the peak has to move before the peak bin is changed.
+    """
+    def __init__(self, n_bins, peak_bin, window=10.0, min_shots=100,
+                 threshold=1.0):
+        self._n_bins = int(n_bins)
+        self._peak_bin = int(peak_bin)
+        self._window = window
+        self._min_shots = min_shots
+        self._threshold = threshold
+        self._sum = np.zeros(self._n_bins)
+        self._shots = 0
+        self._window_start = None
+        self._estimate = None
+
+    @property
+    def n_bins(self):
+        """Number of azav bins"""
+        return self._n_bins
+
+    @property
+    def peak_bin(self):
+        """Current peak bin"""
+        return self._peak_bin
+
+    @peak_bin.setter
+    def peak_bin(self, peak_bin):
+        """Follow a peak bin set by hand"""
+        self._peak_bin = int(peak_bin)
+
+    @property
+    def estimate(self):
+        """Last PeakEstimate, None before the first window"""
+        return self._estimate
+
+    def add(self, profile):
+        """
+        Add a worker profile.
+
+        Parameters
+        ----------
+        profile: ndarray
+            Number of shots then the azav sum, as sent by
+            ProfileAccumulator.
+        """
+        self._shots += int(profile[0])
+        self._sum += profile[1:self._n_bins + 1]
+
+    def check(self, now=None):
+        """
+        Estimate the peak once the window is full.
+
+        Parameters
+        ----------
+        now: float (Default: None)
+            Monotonic time in seconds, defaults to now.
+
+        Returns
+        -------
+        peak_bin: int or None
+            New peak bin, None if it should not change.
+        """
+        if now is None:
+            now = time.monotonic()
+        if self._window_start is None:
+            self._window_start = now
+        if now - self._window_start < self._window or \
+                self._shots < self._min_shots:
+            return None
+        estimate = estimate_peak(self._sum / self._shots)
+        self._estimate = estimate
+        self._sum[:] = 0
+        self._shots = 0
+        self._window_start = now
+        if estimate.quality != GOOD:
+            logger.info(f'Ring peak estimate is {estimate.quality}, keeping '
+                        f'peak bin {self._peak_bin}')
+            return None
+        if abs(estimate.peak - self._peak_bin) < self._threshold:
+            return None
+        logger.info(f'Ring moved to bin {estimate.peak:.2f} +/- '
+                    f'{estimate.uncertainty:.2f}, peak bin was '
+                    f'{self._peak_bin}')
+        self._peak_bin = int(round(estimate.peak))
+
+        return self._peak_bin
@@ -0,0 +1,152 @@
+import logging
+import time
+
+from mpi4py import MPI
+
+from .records import empty_records
+
+logger = logging.getLogger(__name__)
+
+# Records per message, the master receive slots must hold at least this
+DEFAULT_BATCH_SIZE = 16
+
+
+class RecordSender:
+    """
+    Batch records into a small pool of preallocated buffers and send them
+    with non-blocking sends.
+
+    Records are written in place into the current buffer, which is sent
+    once it holds batch_size records or its oldest record is older than
+    the deadline.  Completed sends return their buffer to the pool; when
+    every buffer is still in flight the sender waits for one (backpressure)
+    instead of allocating more.
+
+    Parameters
+    ----------
+    comm: MPI.Comm
+        Communicator to send on.
+
+    dest: int (Default: 0)
+        Rank receiving the records.
+
+    tag: int (Default: 0)
+        Tag of the messages.
+
+    batch_size: int (Default: DEFAULT_BATCH_SIZE)
+        Records per message.
+
+    deadline: float (Default: 0.05)
+        Seconds a record can wait in a partial batch.
+
+    n_buffers: int (Default: 4)
+        Number of send buffers.
+    """
+    def __init__(self, comm, dest=0, tag=0, batch_size=DEFAULT_BATCH_SIZE,
+                 deadline=0.05, n_buffers=4):
+        self._comm = comm
+        self._dest = dest
+        self._tag = tag
+        self._batch_size = int(batch_size)
+        self._deadline = float(deadline)
+        self._bufs = empty_records((n_buffers, self._batch_size))
+        self._template = empty_records(1)
+        self._template['rank'] = comm.Get_rank()
+        self._reqs = [MPI.REQUEST_NULL] * n_buffers
+        self._free = list(range(1, n_buffers))
+        self._current = 0
+        self._count = 0
+        self._batch_start = None
+        self._messages = 0
+        self._records = 0
+        self._stalls = 0
+        self._stall_time = 0.
+
+    @property
+    def batch_size(self):
+        """Records per message"""
+        return self._batch_size
+
+    @property
+    def count(self):
+        """Records in the current buffer"""
+        return self._count
+
+    def next_record(self):
+        """
+        Next free record slot of the current buffer.
+
+        The slot is reset on every call and only kept once `commit` is
+        called, so an event that fails halfway is simply overwritten.
+
+        Returns
+        -------
+        record: ndarray
+            One element view into the send buffer.
+        """
+        record = self._bufs[self._current, self._count:self._count + 1]
+        record[...] = self._template
+        return record
+
+    def commit(self):
+        """Keep the record returned by `next_record`, sending if full"""
+        if self._count == 0:
+            self._batch_start = time.monotonic()
+        self._count += 1
+        if self._count == self._batch_size:
+            self.flush()
+
+    def poll(self):
+        """Send the current buffer if its oldest record passed the
+        deadline, call regularly even when no records are committed
+        """
+        if self._count and \
+                time.monotonic() - self._batch_start > self._deadline:
+            self.flush()
+
+    def flush(self):
+        """Send the current buffer and switch to a free one"""
+        if self._count == 0:
+            return
+        self._reqs[self._current] = self._comm.Isend(
+            [self._bufs[self._current, :self._count], MPI.BYTE],
+            dest=self._dest, tag=self._tag)
+        self._messages += 1
+        self._records += self._count
+        self._count = 0
+        self._current = self._next_buffer()
+
+    def close(self):
+        """Send what is left and wait for every send to complete"""
+        self.flush()
+        MPI.Request.Waitall(self._reqs)
+        logger.info(f'Rank {self._template["rank"][0]} sender stats: '
+                    f'{self.stats()}')
+
+    def stats(self):
+        """
+        Sender statistics.
+
+        Returns
+        -------
+        stats: dict
+            Messages and records sent, number of times and total seconds
+            spent waiting for a free buffer.
+        """
+        return {'messages': self._messages,
+                'records': self._records,
+                'stalls': self._stalls,
+                'stall_time': self._stall_time}
+
+    def _next_buffer(self):
+        """Recycle completed sends, waiting for one if none is free"""
+        done = MPI.Request.Testsome(self._reqs)
+        if not self._free and not done:
+            # The master is lagging, hold the events back
+            start = time.monotonic()
+            done = MPI.Request.Waitsome(self._reqs)
+            self._stalls += 1
+            self._stall_time += time.monotonic() - start
+        self._free.extend(done or [])
+
+        return self._free.pop()
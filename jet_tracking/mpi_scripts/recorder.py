@@ -0,0 +1,231 @@
+import logging
+import os
+import struct
+import time
+from collections import deque
+from threading import Event, Thread
+
+import h5py
+import numpy as np
+
+from .records import RECORD_DTYPE
+
+logger = logging.getLogger(__name__)
+
+
+class RecordWriter:
+    """
+    Append records to rotating files from a background thread.
+
+    `write` only queues a reference to the records, so the caller never
+    waits on the disk.  The writer thread copies them into a preallocated
+    buffer and writes whole buffers at once, and partial ones every
+    flush_interval: appended to a chunked, compressed ``records`` dataset
+    in HDF5 mode, or to the end of a ``.npy`` file in npy mode.  The npy
+    header is rewritten in place after every write, so the file always
+    holds the records written so far.  A new file is started every
+    file_records records.
+
+    Parameters
+    ----------
+    directory: str
+        Directory for the files, created if needed.
+
+    prefix: str (Default: 'jt_records')
+        Start of the file names, followed by the start time and an index.
+
+    fmt: str (Default: 'h5')
+        'h5' or 'npy'.
+
+    buffer_records: int (Default: 4096)
+        Records per write, also the HDF5 chunk size.
+
+    file_records: int (Default: 1000000)
+        Records per file before rotating.
+
+    compression: str (Default: 'gzip')
+        HDF5 compression filter, None to disable.
+
+    queue_size: int (Default: 1000)
+        Most record arrays waiting for the writer, the oldest are dropped
+        beyond that.
+
+    flush_interval: float (Default: 1.0)
+        Seconds before a partial buffer is written.
+    """
+    def __init__(self, directory, prefix='jt_records', fmt='h5',
+                 buffer_records=4096, file_records=1000000,
+                 compression='gzip', queue_size=1000, flush_interval=1.0):
+        if fmt not in ('h5', 'npy'):
+            raise ValueError(f'Unknown record file format {fmt}')
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._prefix = prefix
+        self._fmt = fmt
+        self._file_records = int(file_records)
+        self._compression = compression
+        self._flush_interval = flush_interval
+        self._buffer = np.empty(int(buffer_records), dtype=RECORD_DTYPE)
+        self._count = 0
+        self._queue = deque(maxlen=queue_size)
+        self._queue_ready = Event()
+        self._dropped = 0
+        self._written = 0
+        self._files = []
+        self._file = None
+        self._file_count = 0
+        self._running = True
+        self._thread = Thread(target=self.start_write_thread, daemon=True)
+        self._thread.start()
+
+    @property
+    def files(self):
+        """Files written so far"""
+        return list(self._files)
+
+    @property
+    def written(self):
+        """Number of records written to disk"""
+        return self._written
+
+    @property
+    def dropped(self):
+        """Number of record arrays dropped because the queue was full"""
+        return self._dropped
+
+    def write(self, records):
+        """
+        Queue records for writing, never blocks.
+
+        Parameters
+        ----------
+        records: ndarray
+            Records of RECORD_DTYPE, must not be modified afterwards.
+        """
+        if len(self._queue) == self._queue.maxlen:
+            self._dropped += 1
+        self._queue.append(records)
+        self._queue_ready.set()
+
+    def close(self):
+        """Write everything queued and close the current file"""
+        self._running = False
+        self._queue_ready.set()
+        self._thread.join()
+
+    def start_write_thread(self):
+        """Move queued records to the buffer and write full buffers"""
+        last_flush = time.monotonic()
+        while self._running or self._queue:
+            self._queue_ready.wait(self._flush_interval)
+            self._queue_ready.clear()
+            while self._queue:
+                self._append(self._queue.popleft())
+            if time.monotonic() - last_flush > self._flush_interval:
+                self._flush()
+                last_flush = time.monotonic()
+        self._flush()
+        self._close_file()
+
+    def _append(self, records):
+        """Copy records into the buffer, writing each time it fills up"""
+        while len(records):
+            # Rotate in the middle of the array if needed
+            n_records = min(len(records), len(self._buffer) - self._count,
+                            self._file_records - self._file_count
+                            - self._count)
+            self._buffer[self._count:self._count + n_records] = \
+                records[:n_records]
+            self._count += n_records
+            records = records[n_records:]
+            if self._count == len(self._buffer) or \
+                    self._file_count + self._count == self._file_records:
+                self._flush()
+
+    def _flush(self):
+        """Write the buffer to the current file"""
+        if self._count == 0:
+            return
+        try:
+            if self._fmt == 'h5':
+                self._write_h5()
+            else:
+                self._write_npy()
+        except Exception as e:
+            logger.warning(f'Unable to write {self._count} records: {e}')
+        else:
+            self._written += self._count
+        self._count = 0
+        if self._file_count >= self._file_records:
+            self._close_file()
+
+    def _write_h5(self):
+        """Append the buffer to the records dataset"""
+        if self._file is None:
+            self._file = h5py.File(self._new_file_name(), 'w')
+            self._file.create_dataset(
+                'records', shape=(0,), maxshape=(None,), dtype=RECORD_DTYPE,
+                chunks=(len(self._buffer),), compression=self._compression)
+        dataset = self._file['records']
+        dataset.resize((self._file_count + self._count,))
+        try:
+            dataset[self._file_count:] = self._buffer[:self._count]
+        except Exception:
+            # Don't leave rows that were never written in the file
+            dataset.resize((self._file_count,))
+            raise
+        self._file.flush()
+        self._file_count += self._count
+
+    def _write_npy(self):
+        """Append the buffer to the npy file and update its header"""
+        if self._file is None:
+            self._file = open(self._new_file_name(), 'wb')
+            self._file.write(_npy_header(RECORD_DTYPE, 0))
+        start = self._file.tell()
+        try:
+            self._file.write(self._buffer[:self._count].tobytes())
+        except Exception:
+            # Later records must start where the header says
+            self._file.seek(start)
+            self._file.truncate()
+            raise
+        self._file_count += self._count
+        # Records first, so the header never counts more than are there
+        end = self._file.tell()
+        self._file.seek(0)
+        self._file.write(_npy_header(RECORD_DTYPE, self._file_count))
+        self._file.seek(end)
+        self._file.flush()
+
+    def _new_file_name(self):
+        """Name of the next file, keyed by time and file index"""
+        stamp = time.strftime('%Y%m%d_%H%M%S')
+        name = os.path.join(self._directory, f'{self._prefix}_{stamp}_'
+                            f'{len(self._files):04d}.{self._fmt}')
+        self._files.append(name)
+        return name
+
+    def _close_file(self):
+        """Close the current file, the next write starts a new one"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._file_count = 0
+
+
+def _npy_header(dtype, n_records):
+    """
+    Header of a version 1.0 npy file of n_records, padded to the same
+    length for any number of records so it can be rewritten in place.
+    """
+    def header(shape):
+        return repr({'descr': np.lib.format.dtype_to_descr(dtype),
+                     'fortran_order': False, 'shape': shape})
+
+    # Magic string, version and length take 10 bytes, the data starts
+    # aligned on 64 bytes
+    size = -(-(10 + len(header((2 ** 64,))) + 1) // 64) * 64
+    text = header((n_records,)).ljust(size - 11) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(text)) + \
+        text.encode('latin1')
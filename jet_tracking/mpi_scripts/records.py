@@ -0,0 +1,62 @@
+import numpy as np
+
+# One record per processed event, shared by the workers, the master and
+# the data subscribers.  Aligned so fields can be read in place.
+RECORD_DTYPE = np.dtype([
+    ('pulse_id', 'u8'),
+    ('timestamp', 'f8'),
+    ('i0', 'f4'),
+    ('intensity', 'f4'),
+    ('inorm', 'f4'),
+    ('jet_peak', 'f4'),
+    ('jet_loc', 'f4'),
+    ('rank', 'i2'),
+    ('dropped', 'u1'),
+], align=True)
+
+# Record fields published to the numbered pv_map entries 1, 2, ...
+PV_FIELDS = ('intensity', 'i0', 'inorm', 'jet_peak', 'jet_loc')
+
+
+def empty_records(n_records):
+    """
+    Allocate records with the values a shot gets before it is processed.
+
+    Parameters
+    ----------
+    n_records: int
+        Number of records.
+
+    Returns
+    -------
+    records: ndarray
+        Records of RECORD_DTYPE, jet values are NaN until measured.
+    """
+    records = np.zeros(n_records, dtype=RECORD_DTYPE)
+    records['jet_peak'] = np.nan
+    records['jet_loc'] = np.nan
+
+    return records
+
+
+def record_field(key):
+    """
+    Record field published to a pv_map entry.
+
+    Parameters
+    ----------
+    key: int or str
+        1-based index into PV_FIELDS, or a field name.
+
+    Returns
+    -------
+    field: str
+    """
+    if isinstance(key, str):
+        if key not in RECORD_DTYPE.names:
+            raise ValueError(f'Unknown record field {key}')
+        return key
+    if not 0 < key <= len(PV_FIELDS):
+        raise ValueError(f'pv_map index {key} is out of range, expected '
+                         f'1 to {len(PV_FIELDS)}')
+    return PV_FIELDS[key - 1]
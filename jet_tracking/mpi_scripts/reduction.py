@@ -0,0 +1,283 @@
+import time
+
+import numpy as np
+
+from .records import PV_FIELDS, RECORD_DTYPE
+
+# Means use the record field names so a summary can be published with the
+# same pv_map as the records
+SUMMARY_DTYPE = np.dtype([
+    ('intensity', 'f8'),
+    ('i0', 'f8'),
+    ('inorm', 'f8'),
+    ('jet_peak', 'f8'),
+    ('jet_loc', 'f8'),
+    ('dropped', 'f8'),
+    ('intensity_median', 'f8'),
+    ('i0_median', 'f8'),
+    ('inorm_median', 'f8'),
+    ('count', 'u4'),
+    ('t_start', 'f8'),
+    ('t_end', 'f8'),
+])
+
+
+_MEDIAN_FIELDS = ('intensity', 'i0', 'inorm')
+
+
+class ShotReducer:
+    """
+    Bucket worker records into fixed windows and summarize each window.
+
+    Windows are either a fixed length of time or a fixed number of shots,
+    timed with the event timestamps of the records.  Records of the
+    current window are kept in a preallocated array.  A batch is split
+    into windows in one pass over its timestamps, and only the windows it
+    closes are summarized (mean and median of the good shots, count and
+    dropped fraction), together with bincounts over the window of each
+    record.
+
+    Parameters
+    ----------
+    window: float (Default: None)
+        Length of a window in seconds.
+
+    shots: int (Default: None)
+        Number of shots in a window, used if no window length is given.
+
+    capacity: int (Default: 256)
+        Initial number of records a window can hold, grows as needed.
+    """
+    def __init__(self, window=None, shots=None, capacity=256):
+        if (window is None) == (shots is None):
+            raise ValueError('Specify either a window length or a number '
+                             'of shots')
+        self._window = float(window) if window is not None else None
+        self._shots = int(shots) if shots is not None else None
+        if self._shots is not None:
+            capacity = self._shots
+        self._records = np.empty(capacity, dtype=RECORD_DTYPE)
+        self._count = 0
+        # Wall clock minus event time of the latest record, to expire
+        # windows on the event clock when records stop coming
+        self._clock_offset = 0.
+        # Number of the current time window, counted from the epoch
+        self._bin = -np.inf
+        self._t_start = None
+        self._t_end = None
+
+    @property
+    def window(self):
+        """Length of a window in seconds"""
+        return self._window
+
+    @property
+    def shots(self):
+        """Number of shots in a window"""
+        return self._shots
+
+    @property
+    def count(self):
+        """Number of records in the current window"""
+        return self._count
+
+    def add(self, record, timestamp=None):
+        """
+        Add a record, closing the current window if it is complete.
+
+        Parameters
+        ----------
+        record: ndarray or np.void
+            Worker record of RECORD_DTYPE.
+
+        timestamp: float (Default: None)
+            Time of the shot in seconds, defaults to the record timestamp.
+
+        Returns
+        -------
+        summary: ndarray or None
+            Summary of the window that was closed, if any.
+        """
+        records = np.asarray(record, dtype=RECORD_DTYPE).reshape(1)
+        if timestamp is not None:
+            timestamp = np.array([timestamp], dtype=float)
+
+        return self.add_batch(records, timestamp)
+
+    def add_batch(self, records, timestamps=None):
+        """
+        Add records in the order received, closing the windows they
+        complete.
+
+        A time window closes at the first record of a later window, so
+        every record goes in the latest window seen so far, late records
+        included.  A shot window closes with its last shot.
+
+        Parameters
+        ----------
+        records: ndarray
+            Worker records of RECORD_DTYPE.
+
+        timestamps: ndarray (Default: None)
+            Time of the shots in seconds, defaults to the record
+            timestamps.
+
+        Returns
+        -------
+        summaries: ndarray or None
+            Summaries of the windows that were closed, oldest first.
+        """
+        n = len(records)
+        if n == 0:
+            return None
+        if timestamps is None:
+            timestamps = records['timestamp'].astype(float)
+        self._clock_offset = time.time() - timestamps[-1]
+        # Window of each record, 0 for the current one
+        if self._window is not None:
+            bins = np.maximum.accumulate(np.concatenate(
+                ([self._bin], np.floor(timestamps / self._window))))[1:]
+            index = np.cumsum(bins > np.concatenate(([self._bin],
+                                                     bins[:-1])))
+        else:
+            index = (self._count + np.arange(n)) // self._shots
+        n_closed = int(index[-1]) if self._window is not None \
+            else (self._count + n) // self._shots
+        # The records of the closed windows come first
+        n_done = np.searchsorted(index, n_closed)
+        summaries = None
+        if n_closed:
+            first = np.searchsorted(index[:n_done], np.arange(n_closed))
+            if self._window is not None:
+                t_start = bins[first] * self._window
+                t_start[0] = self._bin * self._window
+                t_end = t_start + self._window
+            else:
+                last = np.searchsorted(index[:n_done],
+                                       np.arange(1, n_closed + 1)) - 1
+                t_start = timestamps[first]
+                if self._count:
+                    t_start[0] = self._t_start
+                t_end = timestamps[last]
+            summaries = self._summarize(
+                np.concatenate((self._records[:self._count],
+                                records[:n_done])),
+                np.concatenate((np.zeros(self._count, dtype=int),
+                                index[:n_done])),
+                t_start, t_end)
+            self._count = 0
+            self._t_start = None
+        # The rest opens or continues the current window
+        if self._window is not None:
+            self._bin = bins[-1]
+            self._t_start = self._bin * self._window
+            self._t_end = self._t_start + self._window
+        elif n_done < n:
+            if self._count == 0:
+                self._t_start = timestamps[n_done]
+            self._t_end = timestamps[-1]
+        self._append(records[n_done:])
+
+        return summaries if summaries is not None and len(summaries) \
+            else None
+
+    def expire(self, timestamp=None):
+        """
+        Close the current time window if it has ended, so windows still
+        get published when no new shots arrive.
+
+        Parameters
+        ----------
+        timestamp: float (Default: None)
+            Current time in seconds, defaults to now on the event clock.
+
+        Returns
+        -------
+        summary: ndarray or None
+            Summary of the window that was closed, if any.
+        """
+        if timestamp is None:
+            timestamp = time.time() - self._clock_offset
+        if self._window is not None and self._count and \
+                timestamp >= self._t_end:
+            return self.flush()
+
+        return None
+
+    def flush(self):
+        """
+        Summarize and reset the current window.
+
+        Returns
+        -------
+        summary: ndarray or None
+            One element array of SUMMARY_DTYPE, None if the window is empty.
+        """
+        if self._count == 0:
+            return None
+        summary = self._summarize(self._records[:self._count],
+                                  np.zeros(self._count, dtype=int),
+                                  np.array([self._t_start], dtype=float),
+                                  np.array([self._t_end], dtype=float))
+        self._count = 0
+        if self._shots is not None:
+            self._t_start = None
+
+        return summary
+
+    def _append(self, records):
+        """Add records to the current window"""
+        end = self._count + len(records)
+        if end > len(self._records):
+            grown = np.empty(max(end, 2 * len(self._records)),
+                             dtype=RECORD_DTYPE)
+            grown[:self._count] = self._records[:self._count]
+            self._records = grown
+        self._records[self._count:end] = records
+        self._count = end
+
+    @staticmethod
+    def _summarize(records, index, t_start, t_end):
+        """
+        Summaries of windows, dropping the empty ones.
+
+        Parameters
+        ----------
+        records: ndarray
+            Records of every window, in window order.
+
+        index: ndarray
+            Window of each record.
+
+        t_start: ndarray
+            Start of each window.
+
+        t_end: ndarray
+            End of each window.
+        """
+        n_windows = len(t_start)
+        count = np.bincount(index, minlength=n_windows)
+        dropped = records['dropped'] != 0
+        good = records[~dropped]
+        good_index = index[~dropped]
+        n_good = np.bincount(good_index, minlength=n_windows)
+        summaries = np.zeros(n_windows, dtype=SUMMARY_DTYPE)
+        for name in PV_FIELDS:
+            total = np.bincount(good_index, good[name], n_windows)
+            summaries[name] = np.divide(total, n_good,
+                                        out=np.full(n_windows, np.nan),
+                                        where=n_good > 0)
+        # The good shots of a window are next to each other
+        bounds = np.searchsorted(good_index, np.arange(n_windows + 1))
+        for name in _MEDIAN_FIELDS:
+            summaries[f'{name}_median'] = [
+                np.median(good[name][lo:hi]) if hi > lo else np.nan
+                for lo, hi in zip(bounds[:-1], bounds[1:])]
+        summaries['dropped'] = np.divide(
+            np.bincount(index, dropped, n_windows), count,
+            out=np.zeros(n_windows), where=count > 0)
+        summaries['count'] = count
+        summaries['t_start'] = t_start
+        summaries['t_end'] = t_end
+
+        return summaries[count > 0]
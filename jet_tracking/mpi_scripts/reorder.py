@@ -0,0 +1,116 @@
+import heapq
+import time
+
+import numpy as np
+
+from .records import RECORD_DTYPE
+
+
+class ReorderBuffer:
+    """
+    Hold records from all workers for a short time and release them in
+    event time order.
+
+    Records are kept in a heap keyed by (timestamp, pulse_id).  A record is
+    released once the event clock, the newest timestamp seen advanced by
+    the wall time since it arrived, is more than the latency budget past
+    it.  Records older than the last released one can no longer be put in
+    order and are dropped as late.
+
+    Parameters
+    ----------
+    latency: float (Default: 0.05)
+        Seconds a record is held waiting for older ones.
+
+    capacity: int (Default: 4096)
+        Most records held, the oldest are released early beyond that.
+    """
+    def __init__(self, latency=0.05, capacity=4096):
+        self._latency = float(latency)
+        self._capacity = int(capacity)
+        self._heap = []
+        self._seq = 0
+        self._newest = None
+        self._newest_wall = None
+        self._released = -np.inf
+        self._late = 0
+        self._forced = 0
+
+    @property
+    def latency(self):
+        """Seconds a record is held"""
+        return self._latency
+
+    @property
+    def late(self):
+        """Number of records dropped because they arrived too late"""
+        return self._late
+
+    @property
+    def forced(self):
+        """Number of records released early because the buffer was full"""
+        return self._forced
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, records):
+        """
+        Add records, late ones are dropped.
+
+        Parameters
+        ----------
+        records: ndarray
+            Records of RECORD_DTYPE, kept by reference.
+        """
+        for record in records:
+            timestamp = float(record['timestamp'])
+            if timestamp < self._released:
+                self._late += 1
+                continue
+            # The sequence number keeps the heap from comparing records
+            heapq.heappush(self._heap, (timestamp, int(record['pulse_id']),
+                                        self._seq, record))
+            self._seq += 1
+            if self._newest is None or timestamp > self._newest:
+                self._newest = timestamp
+                self._newest_wall = time.monotonic()
+
+    def pop_ready(self, now=None):
+        """
+        Release the records that are past the latency budget.
+
+        Parameters
+        ----------
+        now: float (Default: None)
+            Current event time, estimated from the newest record if None.
+
+        Returns
+        -------
+        records: ndarray
+            Released records in time order, possibly empty.
+        """
+        if not self._heap:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        if now is None:
+            now = self._newest + time.monotonic() - self._newest_wall
+        watermark = now - self._latency
+        out = []
+        while self._heap and (self._heap[0][0] <= watermark or
+                              len(self._heap) > self._capacity):
+            if self._heap[0][0] > watermark:
+                self._forced += 1
+            out.append(self._pop())
+
+        return np.array(out, dtype=RECORD_DTYPE)
+
+    def flush(self):
+        """Release every record held"""
+        out = [self._pop() for _ in range(len(self._heap))]
+        return np.array(out, dtype=RECORD_DTYPE)
+
+    def _pop(self):
+        """Pop the oldest record"""
+        timestamp, _, _, record = heapq.heappop(self._heap)
+        self._released = timestamp
+        return record
@@ -0,0 +1,237 @@
+import logging
+import warnings
+from collections import namedtuple
+
+import numpy as np
+from scipy.optimize import OptimizeWarning, curve_fit
+
+logger = logging.getLogger(__name__)
+
+# Quality of a peak estimate
+GOOD = 'good'
+ROUGH = 'rough'
+FAILED = 'failed'
+
+PeakEstimate = namedtuple('PeakEstimate', ['peak', 'uncertainty', 'width',
+                                           'amplitude', 'quality', 'method'])
+PeakEstimate.__doc__ = """
+Peak of an azav.
+
+peak: float
+    Peak position in bins.
+
+uncertainty: float
+    One sigma uncertainty of the position, inf if unknown.
+
+width: float
+    Gaussian sigma of the peak in bins.
+
+amplitude: float
+    Height of the peak above the baseline.
+
+quality: str
+    GOOD when the refined fit converged inside the azav, ROUGH when only
+    the analytic estimate is usable and FAILED when there is no peak above
+    the baseline and the peak is the maximum bin.
+
+method: str
+    'fit', 'log_parabola', 'moments' or 'argmax'.
+"""
+
+
+def gaussian_line(x, a, mean, std, m, b):
+    """
+    Gaussian on a linear baseline.
+
+    Parameters
+    ----------
+    x : ndarray
+        X-coordinates.
+
+    a : float
+        Amplitude of Gaussian.
+
+    mean : float
+        Mean of Gaussian.
+
+    std : float
+        Standard deviation of Gaussian.
+
+    m : float
+        Slope of linear baseline.
+
+    b : float
+        Y-intercept of linear baseline.
+    """
+    return a * np.exp(-0.5 * ((x - mean) / std) ** 2) + m * x + b
+
+
+def gaussian_line_jac(x, a, mean, std, m, b):
+    """Jacobian of gaussian_line in its parameters, one row per x"""
+    z = (x - mean) / std
+    g = np.exp(-0.5 * z ** 2)
+    return np.column_stack([g, a * g * z / std, a * g * z ** 2 / std,
+                            x, np.ones_like(x)])
+
+
+def fit_line(ave_azav, fit_points=5):
+    """
+    Fit the line from edges of array
+
+    Parameters
+    ----------
+    ave_azav: ndarray
+        The average azimuthal average from calibration data 1D array of floats.
+
+    fit_points: int (Default: 5)
+        Number of points at each end of average azimuthal average to fit.
+
+    Returns
+    -------
+    m: float
+        slope of the fit
+
+    b: float
+        y intercept of fit
+    """
+    azav_len = len(ave_azav)
+    x0 = fit_points / 2
+    x1 = azav_len - (fit_points / 2)
+    y0 = np.mean(ave_azav[:fit_points])
+    y1 = np.mean(ave_azav[azav_len - fit_points:])
+    m, b = np.polyfit((x0, x1), (y0, y1), 1)
+
+    return m, b
+
+
+def log_parabola(x, y):
+    """
+    Gaussian through positive points from a parabola fit of their log.
+
+    Parameters
+    ----------
+    x: ndarray
+        At least 4 points around the maximum.
+
+    y: ndarray
+        Positive values above the baseline.
+
+    Returns
+    -------
+    mean, uncertainty, std, amplitude: float
+        None if the log is not concave.
+    """
+    # Weights keep the noisy low points from dominating the log
+    (c2, c1, c0), cov = np.polyfit(x, np.log(y), 2, w=np.sqrt(y), cov=True)
+    if c2 >= 0:
+        return None
+    mean = -c1 / (2 * c2)
+    # Propagate the fit covariance to the mean
+    grad = np.array([c1 / (2 * c2 ** 2), -1 / (2 * c2), 0.])
+    uncertainty = np.sqrt(max(grad @ cov @ grad, 0.))
+    std = np.sqrt(-1 / (2 * c2))
+    amplitude = np.exp(c0 - c1 ** 2 / (4 * c2))
+
+    return mean, uncertainty, std, amplitude
+
+
+def moments(x, y):
+    """
+    Gaussian with the weighted mean and spread of positive points.
+
+    Returns
+    -------
+    mean, uncertainty, std, amplitude: float
+    """
+    weight = y.sum()
+    mean = np.sum(x * y) / weight
+    std = np.sqrt(np.sum(y * (x - mean) ** 2) / weight)
+    uncertainty = std / np.sqrt(len(x))
+
+    return mean, uncertainty, max(std, 0.5), y.max()
+
+
+def estimate_peak(ave_azav, fit_points=5, top_bins=5, refine=True,
+                  max_nfev=50):
+    """
+    Find the ring peak of an azav.
+
+    A line through the ends of the azav is taken as baseline.  The peak
+    is first estimated in closed form from a parabola fit to the log of
+    the top bins above the baseline, or from the moments of the bins
+    around the maximum when the log is not concave.  A bounded fit of a
+    gaussian on a line then refines the estimate with a limited number of
+    evaluations.  This is fast enough to run on every time window while
+    tracking as well as once per calibration.
+
+    Parameters
+    ----------
+    ave_azav: ndarray
+        Radially binned intensity, e.g. averaged over shots.
+
+    fit_points: int (Default: 5)
+        Points at each end used for the baseline.
+
+    top_bins: int (Default: 5)
+        Bins around the maximum used for the log parabola.
+
+    refine: bool (Default: True)
+        Refine the closed form estimate with the nonlinear fit.
+
+    max_nfev: int (Default: 50)
+        Evaluations allowed to the nonlinear fit.
+
+    Returns
+    -------
+    estimate: PeakEstimate
+    """
+    y = np.asarray(ave_azav, dtype=float)
+    n = len(y)
+    x = np.arange(n, dtype=float)
+    m, b = fit_line(y, fit_points)
+    signal = y - (m * x + b)
+    top = int(np.nanargmax(signal)) if np.isfinite(signal).any() else 0
+    if not signal[top] > 0:
+        return PeakEstimate(float(np.nanargmax(y)), np.inf, np.nan, 0.,
+                            FAILED, 'argmax')
+
+    # Contiguous bins above the baseline around the maximum
+    below = np.flatnonzero(~(signal[:top] > 0))
+    left = below[-1] + 1 if len(below) else 0
+    after = np.flatnonzero(~(signal[top:] > 0))
+    right = top + after[0] if len(after) else n
+    half = top_bins // 2
+    low, high = max(top - half, left), min(top + half + 1, right)
+    estimate = None
+    if high - low >= 4:
+        estimate = log_parabola(x[low:high], signal[low:high])
+        method = 'log_parabola'
+    if estimate is None or not left <= estimate[0] < right:
+        estimate = moments(x[left:right], signal[left:right])
+        method = 'moments'
+    mean, uncertainty, std, amplitude = estimate
+    rough = PeakEstimate(mean, uncertainty, std, amplitude, ROUGH, method)
+    if not refine:
+        return rough
+
+    p0 = [amplitude, mean, min(std, n), m, b]
+    bounds = ([0, 0, 0.5, -np.inf, -np.inf],
+              [np.inf, n - 1, n, np.inf, np.inf])
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', OptimizeWarning)
+            popt, pcov = curve_fit(gaussian_line, x, y, p0=p0,
+                                   bounds=bounds, jac=gaussian_line_jac,
+                                   max_nfev=max_nfev)
+    except (RuntimeError, ValueError, OptimizeWarning) as e:
+        logger.debug(f'Peak fit failed, keeping the {method} estimate: {e}')
+        return rough
+    uncertainty = np.sqrt(pcov[1, 1])
+    # The fit should stay on the peak it started from
+    if not (np.isfinite(uncertainty) and abs(popt[1] - mean) < 2 * std
+            and uncertainty < popt[2]):
+        logger.debug('Peak fit moved away from the estimate, keeping the '
+                     f'{method} estimate')
+        return rough
+
+    return PeakEstimate(popt[1], uncertainty, popt[2], popt[0], GOOD, 'fit')
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+from ..azav import AzavEngine, RadialGeometry, RadialIndex, radial_labels
+
+
+def reference_masks(shape, bins):
+    """Boolean radial masks, as originally built for the azav"""
+    center = (shape[1] / 2, shape[0] / 2)
+    x, y = np.meshgrid(np.arange(shape[1]) - center[0],
+                       np.arange(shape[0]) - center[1])
+    R = np.sqrt(x**2 + y**2)
+    bin_size = (np.max(R) - np.min(R)) / bins
+    radii = np.arange(1, np.max(R), bin_size)
+    return [(R > i - bin_size) & (R < i + bin_size) for i in radii]
+
+
+@pytest.mark.parametrize('shape, bins', [((61, 64), 20), ((100, 97), 30)])
+def test_radial_labels_match_masks(shape, bins):
+    masks = reference_masks(shape, bins)
+    labels, n_bins = radial_labels(shape, bins)
+    assert n_bins == len(masks)
+    for i, mask in enumerate(masks):
+        np.testing.assert_array_equal(
+            mask, (labels == i + 1) | (labels == i + 2))
+
+
+@pytest.mark.parametrize('window', [(0, 5), (3, 9), (26, 30), (4, 4)])
+def test_radial_index_intensity(window):
+    shape, bins = (100, 97), 30
+    rng = np.random.default_rng(0)
+    image = rng.random(shape)
+    pixel_mask = rng.random(shape) > 0.2
+    masks = reference_masks(shape, bins)[slice(*window)]
+
+    r_index = RadialIndex(RadialGeometry.from_shape(shape, bins))
+    r_index.set_window(*window)
+    expected = np.sum([np.mean(image[mask]) for mask in masks])
+    assert r_index.intensity(image) == pytest.approx(expected)
+
+    r_index.pixel_mask = pixel_mask
+    masked = image * pixel_mask
+    expected = np.sum([np.mean(masked[mask]) for mask in masks])
+    assert r_index.intensity(image) == pytest.approx(expected)
+
+
+def test_radial_index_raw_layout():
+    shape, bins = (100, 97), 30
+    rng = np.random.default_rng(2)
+    # Two 40x90 panels placed in the image, the rest are gaps
+    ix, iy = np.meshgrid(np.arange(40), np.arange(90), indexing='ij')
+    ix = np.stack((ix + 5, ix + 55))
+    iy = np.stack((iy + 2, iy + 5))
+    raw = rng.random(ix.shape)
+    raw_mask = rng.random(ix.shape) > 0.2
+    image = np.zeros(shape)
+    image[ix, iy] = raw
+    image_mask = np.zeros(shape)
+    image_mask[ix, iy] = raw_mask
+
+    geometry = RadialGeometry.from_shape(shape, bins)
+    r_index = RadialIndex(geometry, pixel_mask=image_mask)
+    raw_index = RadialIndex(
+        geometry, pixel_map=np.ravel_multi_index((ix, iy), shape))
+    raw_index.pixel_mask = raw_mask
+    for window in [(0, 5), (10, 16), (12, 14)]:
+        r_index.set_window(*window)
+        raw_index.set_window(*window)
+        assert raw_index.intensity(raw) == \
+            pytest.approx(r_index.intensity(image))
+    # Full azav of the raw layout matches the one of the image
+    engine = AzavEngine(geometry, pixel_mask=image_mask)
+    np.testing.assert_allclose(raw_index.azav(raw), engine.azav(image))
+    np.testing.assert_allclose(r_index.azav(image), engine.azav(image))
+
+
+def test_azav_engine():
+    shape, bins = (100, 97), 30
+    rng = np.random.default_rng(1)
+    image = rng.random(shape)
+    pixel_mask = rng.random(shape) > 0.2
+    masks = reference_masks(shape, bins)
+
+    engine = AzavEngine(RadialGeometry.from_shape(shape, bins))
+    expected = [np.mean(image[mask]) for mask in masks]
+    np.testing.assert_allclose(engine.azav(image), expected)
+
+    engine.pixel_mask = pixel_mask
+    masked = image * pixel_mask
+    expected = [np.mean(masked[mask]) for mask in masks]
+    np.testing.assert_allclose(engine.azav(image), expected)
+
+
+def test_radial_geometry_cache(tmp_path):
+    shape, bins = (61, 64), 20
+    geometry = RadialGeometry.from_shape(shape, bins)
+    cached = RadialGeometry.cached(shape, bins, cache_dir=tmp_path)
+    assert len(list(tmp_path.iterdir())) == 2
+    reloaded = RadialGeometry.cached(shape, bins, cache_dir=tmp_path)
+    assert isinstance(reloaded.labels, np.memmap)
+    for other in (cached, reloaded):
+        assert other.n_bins == geometry.n_bins
+        np.testing.assert_array_equal(other.counts, geometry.counts)
+    for i, mask in enumerate(reference_masks(shape, bins)):
+        np.testing.assert_array_equal(reloaded.mask(i), mask)
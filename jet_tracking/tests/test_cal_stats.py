@@ -0,0 +1,166 @@
+"""
+The merge over ranks runs this module under mpiexec, every rank adds its
+share of the shots and rank 0 writes what it merged.
+"""
+import json
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import h5py
+import numpy as np
+import pytest
+from mpi4py import MPI
+
+from ..jet_tracking_cal.cal_stats import (CalibrationStats, Histogram, Welford,
+                                          mean_rows, window_sums)
+
+
+def make_shots():
+    rng = np.random.default_rng(0)
+    i0 = rng.normal(10, 2, 2000)
+    ring = np.exp(-0.5 * ((np.arange(30) - 15) / 2) ** 2)
+    azav = rng.random((2000, 30)) + np.outer(i0, ring)
+    jet_loc = rng.normal(50, 3, 2000)
+    return i0, azav, jet_loc
+
+
+@pytest.fixture
+def shots():
+    return make_shots()
+
+
+def all_shots(i0, azav, jet_loc):
+    """The calibration values from every shot, as jt_cal used to get them"""
+    counts, edges = np.histogram(i0, bins=50)
+    use = (i0 > edges[10]) & (i0 < edges[40])
+    return {'counts': counts.tolist(), 'edges': edges.tolist(),
+            'mean_azav': azav[use].mean(0).tolist(),
+            'jet_location_mean': jet_loc[use].mean(),
+            'jet_location_std': jet_loc[use].std(),
+            'i0': i0[use].tolist(),
+            'peak_vals': azav[use, 12:18].sum(axis=1).tolist()}
+
+
+def merged(stats, comm=None):
+    """The same values from CalibrationStats, on rank 0"""
+    hist = stats.i0_histogram()
+    # The cut is made on rank 0, as in jt_cal
+    edges = None if hist is None else hist.edges
+    if comm is not None:
+        edges = comm.bcast(edges, root=0)
+    use = stats.select(edges[10], edges[40])
+    mean_azav = stats.mean_azav(use)
+    jet = stats.jet_stats(use)
+    i0, peak_vals = stats.window_values(use, 12, 18)
+    if hist is None:
+        return None
+    return {'counts': hist.counts.tolist(), 'edges': hist.edges.tolist(),
+            'mean_azav': mean_azav.tolist(),
+            'jet_location_mean': jet['jet_location_mean'],
+            'jet_location_std': jet['jet_location_std'],
+            'i0': i0.tolist(), 'peak_vals': peak_vals.tolist()}
+
+
+def assert_same(result, expected):
+    # The cut is made on the same bins
+    assert result['edges'] == expected['edges']
+    assert result['counts'] == expected['counts']
+    np.testing.assert_allclose(result['mean_azav'], expected['mean_azav'])
+    for key in ('jet_location_mean', 'jet_location_std'):
+        assert result[key] == pytest.approx(expected[key])
+    # Every shot in the cut, gathered in rank order
+    order = np.argsort(result['i0'])
+    expected_order = np.argsort(expected['i0'])
+    np.testing.assert_array_equal(np.array(result['i0'])[order],
+                                  np.array(expected['i0'])[expected_order])
+    np.testing.assert_allclose(
+        np.array(result['peak_vals'])[order],
+        np.array(expected['peak_vals'])[expected_order])
+
+
+def test_welford_merge():
+    rng = np.random.default_rng(1)
+    values = rng.random((100, 3)) + 1e8
+    moments = Welford(values[:30]).merge(Welford(values[30:]))
+    moments.merge(Welford(np.empty((0, 3))))
+    assert moments.n == 100
+    np.testing.assert_allclose(moments.mean, values.mean(axis=0))
+    np.testing.assert_allclose(moments.var, values.var(axis=0))
+    assert np.isnan(Welford([]).var)
+
+
+def test_histogram():
+    rng = np.random.default_rng(2)
+    values = rng.normal(0, 1, 1000)
+    hist = Histogram.agreed(values, bins=20)
+    first, second = Histogram(hist.edges), Histogram(hist.edges)
+    first.fill(values[:400])
+    second.fill(values[400:])
+    merged = first.merge(second)
+    np.testing.assert_array_equal(merged.counts,
+                                  np.histogram(values, bins=20)[0])
+    merged.fill([-10, 10, 10])
+    assert (merged.underflow, merged.overflow) == (1, 2)
+    with pytest.raises(ValueError):
+        merged.merge(Histogram.from_range(0, 1, 20))
+
+
+@pytest.mark.parametrize('comm', [None, MPI.COMM_SELF])
+def test_stats_match_all_shots(shots, comm):
+    i0, azav, jet_loc = shots
+    stats = CalibrationStats(30, comm=comm)
+    for shot in zip(azav, i0, np.ones(len(i0)), jet_loc):
+        stats.add(*shot)
+    stats.add(azav[0], np.nan)
+    assert stats.count == len(i0)
+    assert_same(merged(stats, comm), all_shots(i0, azav, jet_loc))
+    # Nothing in the cut
+    use = stats.select(0, 0)
+    assert np.isnan(stats.mean_azav(use)).all()
+    assert np.isnan(stats.jet_stats(use)['jet_peak_mean'])
+
+
+@pytest.mark.skipif(shutil.which('mpiexec') is None,
+                    reason='mpiexec is not available')
+def test_ranks_match_all_shots(tmp_path):
+    out = tmp_path / 'merged.json'
+    cmd = ['mpiexec', '-n', '3', sys.executable, '-m',
+           'jet_tracking.tests.test_cal_stats', str(out)]
+    subprocess.run(cmd, check=True, timeout=60,
+                   cwd=Path(__file__).resolve().parents[2])
+    with open(out) as f:
+        result = json.load(f)
+    assert_same(result, all_shots(*make_shots()))
+
+
+def test_rows_of_datasets(shots, tmp_path):
+    _, azav, _ = shots
+    use = azav[:, 0] > 0.5
+    with h5py.File(tmp_path / 'smd.h5', 'w') as f:
+        f['azav'] = azav
+    with h5py.File(tmp_path / 'smd.h5', 'r') as f:
+        # Blocks smaller than the dataset
+        np.testing.assert_allclose(
+            window_sums(f['azav'], 12, 18, use, block_rows=300),
+            azav[use, 12:18].sum(1))
+        np.testing.assert_allclose(mean_rows(f['azav'], use, block_rows=300),
+                                   azav[use].mean(0))
+        np.testing.assert_allclose(mean_rows(f['azav'], block_rows=300),
+                                   azav.mean(0))
+
+
+if __name__ == '__main__':
+    comm = MPI.COMM_WORLD
+    rank, size = comm.Get_rank(), comm.Get_size()
+    stats = CalibrationStats(30, comm=comm.Dup())
+    i0, azav, jet_loc = make_shots()
+    # Each rank sees only part of the i0 range
+    order = np.argsort(i0)
+    for k in np.array_split(order, size)[rank]:
+        stats.add(azav[k], i0[k], 1., jet_loc[k])
+    result = merged(stats, comm)
+    if rank == 0:
+        with open(sys.argv[1], 'w') as f:
+            json.dump(result, f)
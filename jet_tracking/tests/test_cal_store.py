@@ -0,0 +1,38 @@
+import json
+
+import numpy as np
+
+from ..cal_store import INDEX_NAME, CalibrationStore
+
+
+def test_store_latest(tmp_path):
+    writer = CalibrationStore(tmp_path)
+    reader = CalibrationStore(tmp_path, poll_interval=0.)
+    assert reader.latest() is None
+    writer.add({'peak_bin': np.int64(40), 'i0_low': np.float64(0.5),
+                'jet_peak_mean': None}, 'xcs', 'xcsx47519', 10)
+    entry = reader.latest()
+    assert entry['results'] == {'peak_bin': 40, 'i0_low': 0.5,
+                                'jet_peak_mean': None}
+    assert isinstance(entry['results']['peak_bin'], int)
+    writer.add({'peak_bin': 42}, 'xcs', 'xcsx47519', 11)
+    # Only the appended line is read
+    assert reader.latest()['run'] == '11'
+    assert reader.latest('xcs', 'xcsx47519', 10)['results']['peak_bin'] \
+        == 40
+    assert reader.latest(run=12) is None
+    assert len(reader.entries) == 2
+
+    # A line being written is only picked up once complete
+    with open(tmp_path / INDEX_NAME, 'a') as f:
+        f.write('{"hutch": "xcs"')
+    assert len(reader.entries) == 2
+
+
+def test_store_legacy_file(tmp_path):
+    with open(tmp_path / 'jt_cal_10_results', 'w') as f:
+        json.dump({'peak_bin': '40', 'i0_low': '0.5', 'jet_loc': 'None'}, f)
+    entry = CalibrationStore(tmp_path).latest()
+    assert entry['results'] == {'peak_bin': 40, 'i0_low': 0.5,
+                                'jet_loc': None}
+    assert entry['file'].endswith('jt_cal_10_results')
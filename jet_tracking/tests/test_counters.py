@@ -0,0 +1,48 @@
+import logging
+import time
+
+import numpy as np
+import pytest
+
+from ..mpi_scripts.counters import (EventCounters, StageTimer,
+                                    percentile_summary)
+
+
+def test_counters_rate_limited(caplog):
+    counters = EventCounters('Worker 1', report_interval=60.)
+    caplog.set_level(logging.INFO)
+    for _ in range(5):
+        counters.increment('processed')
+        assert not counters.report()
+    counters.error('bad event')
+    assert counters.counts == {'processed': 5, 'errors': 1}
+    assert not caplog.records
+    assert counters.report(force=True)
+    assert 'processed' in caplog.records[0].getMessage()
+    assert 'bad event' in caplog.records[1].getMessage()
+    # At most one report per interval
+    counters = EventCounters('Worker 1', report_interval=0.05)
+    assert not counters.report()
+    time.sleep(0.06)
+    assert counters.report()
+    assert not counters.report()
+
+
+def test_stage_timer():
+    timer = StageTimer(('gate', 'send'), capacity=4)
+    for i in range(6):
+        timer.add('gate', float(i))
+    timer.start()
+    timer.mark('send')
+    # Only the latest durations are kept
+    assert sorted(timer.samples('gate')) == [2., 3., 4., 5.]
+    assert len(timer.samples('send')) == 1
+    summary = timer.summary(percentiles=(50,))
+    assert summary['gate'] == {'count': 4, 'mean': 3.5, 'max': 5.,
+                               'p50': 3.5}
+    # Nothing is kept by default
+    timer = StageTimer(('gate',))
+    timer.add('gate', 1.)
+    assert len(timer.samples('gate')) == 0
+    assert percentile_summary(np.array([])) == {'count': 0}
+    assert percentile_summary(np.arange(101))['p99'] == pytest.approx(99)
@@ -0,0 +1,66 @@
+import time
+
+import numpy as np
+import pytest
+import zmq
+
+from ..mpi_scripts.data_protocol import (ANY_RANK, DataPublisher,
+                                         DataSubscriber, pack_header,
+                                         unpack_header)
+
+DTYPE = np.dtype([('intensity', 'f4'), ('i0', 'f4'), ('dropped', 'u1')])
+
+
+@pytest.mark.parametrize('data', [np.arange(4, dtype='float32'),
+                                  np.zeros((3, 4), dtype='>f8'),
+                                  np.zeros(5, dtype=DTYPE)])
+def test_header_roundtrip(data):
+    dtypes = {}
+    for _ in range(2):
+        header = unpack_header(pack_header(data, 7, 1.5, 3), dtypes)
+        assert header.seq == 7
+        assert header.timestamp == 1.5
+        assert header.rank == 3
+        assert header.dtype == data.dtype
+        assert header.shape == data.shape
+    assert len(dtypes) == 1
+
+
+def test_header_version():
+    header = bytearray(pack_header(np.zeros(2), 0, 0.))
+    header[0] = 0
+    with pytest.raises(ValueError):
+        unpack_header(header)
+
+
+def test_publish_subscribe():
+    ctx = zmq.Context()
+    pub_socket = ctx.socket(zmq.PUB)
+    pub_socket.bind('inproc://data')
+    publisher = DataPublisher(pub_socket)
+    subscriber = DataSubscriber('inproc://data', ctx)
+    try:
+        _check_publish_subscribe(publisher, subscriber)
+    finally:
+        subscriber.close()
+        pub_socket.close(linger=0)
+        ctx.term()
+
+
+def _check_publish_subscribe(publisher, subscriber):
+    # Give the subscription time to reach the publisher
+    time.sleep(0.1)
+    batch = np.zeros(100, dtype=DTYPE)
+    batch['intensity'] = np.arange(100)
+    assert publisher.send(batch, rank=2)
+    publisher._seq += 1  # Pretend a message was lost
+    assert publisher.send(np.arange(4, dtype='float32'))
+
+    header, data = subscriber.recv()
+    assert header.rank == 2
+    np.testing.assert_array_equal(data, batch)
+    header, data = subscriber.recv()
+    assert header.rank == ANY_RANK
+    assert header.seq == 2
+    np.testing.assert_array_equal(data, np.arange(4))
+    assert subscriber.missed == 1
@@ -0,0 +1,73 @@
+import time
+
+import h5py
+import numpy as np
+import pytest
+
+from ..azav import RadialGeometry, RadialIndex
+from ..mpi_scripts.event_source import (FrameReplay, SmallDataReplay,
+                                        make_synthetic_frames)
+
+
+@pytest.fixture
+def smd_file(tmp_path):
+    path = tmp_path / 'run1_jt_cal.h5'
+    rng = np.random.default_rng(0)
+    with h5py.File(path, 'w') as f:
+        f['azav'] = rng.random((10, 20))
+        f['i0'] = np.arange(10.)
+        f['jet_peak'] = np.full(10, 5.)
+        f['jet_loc'] = np.arange(10) + 100
+        f['fiducials'] = np.arange(10) * 3
+    return path
+
+
+def test_small_data_replay(smd_file):
+    sources = [SmallDataReplay(smd_file, worker_index=i, n_workers=3)
+               for i in range(3)]
+    events = [list(source.events()) for source in sources]
+    # Round robin between the workers
+    assert [evt.index for evt in events[1]] == [1, 4, 7]
+    assert sum(len(e) for e in events) == 10
+    source = sources[1]
+    evt = events[1][1]
+    assert source.event_id(evt)[0] == 12
+    assert source.i0(evt) == 4.
+    assert source.jet(evt) == (5., 104.)
+    assert 40 in source.event_codes(evt)
+    index = RadialIndex(RadialGeometry.from_shape((8, 8), 20))
+    index.set_window(3, 7)
+    with h5py.File(smd_file, 'r') as f:
+        expected = f['azav'][4, 3:7].sum()
+    assert source.intensity(evt, index) == pytest.approx(expected)
+
+    with pytest.raises(FileNotFoundError, match='save_small_data'):
+        SmallDataReplay(smd_file.parent / 'run2_jt_cal.h5')
+
+
+def test_replay_loop_and_rate(smd_file):
+    source = SmallDataReplay(smd_file, rate=500, loop=True, max_events=25)
+    start = time.time()
+    events = list(source.events())
+    assert time.time() - start == pytest.approx(24 / 500, abs=0.03)
+    assert len(events) == 25
+    assert events[12].index == 2
+    # Pulse ids keep increasing over the loops
+    assert np.all(np.diff([evt.pulse_id for evt in events]) > 0)
+
+
+def test_frame_replay(tmp_path):
+    path = str(tmp_path / 'frames.npy')
+    i0_path = make_synthetic_frames(path, (60, 60), 4, bins=20, ring_bin=8,
+                                    noise=0.)
+    source = FrameReplay(path, i0_path=i0_path)
+    geometry = RadialGeometry.from_shape((60, 60), 20)
+    index = RadialIndex(geometry)
+    index.set_window(7, 10)
+    events = list(source.events())
+    norm = [source.intensity(evt, index) / source.i0(evt)
+            for evt in events]
+    # The ring scales with i0
+    np.testing.assert_allclose(norm, norm[0], rtol=1e-5)
+    index.set_window(14, 17)
+    assert source.intensity(events[0], index) < 0.1 * norm[0]
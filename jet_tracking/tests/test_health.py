@@ -0,0 +1,52 @@
+import numpy as np
+from mpi4py import MPI
+
+from ..mpi_scripts.counters import EventCounters
+from ..mpi_scripts.health import (HEALTH_DTYPE, HEALTH_TAG, HealthReporter,
+                                  WorkerHealthMonitor)
+
+
+def make_report(rank, t, events, busy):
+    report = np.zeros(1, dtype=HEALTH_DTYPE)[0]
+    report['rank'] = rank
+    report['time'] = t
+    report['events'] = events
+    report['busy'] = busy
+    return report
+
+
+def test_monitor_stragglers():
+    monitor = WorkerHealthMonitor([1, 2, 3], timeout=5.)
+    for rank, events in [(1, 100), (2, 100), (3, 20)]:
+        monitor.update(make_report(rank, 0., 0, 0.))
+        monitor.update(make_report(rank, 1., events, 0.4))
+    assert monitor.check(now=1.) == ({3}, set())
+    assert monitor.summary()[1]['event_rate'] == 100
+    assert monitor.suggested_workers(target_utilization=0.7) == 2
+
+    # Stalled workers lag too, inactive workers are ignored
+    monitor.update(make_report(3, 6., 600, 2.4))
+    monitor.update(make_report(1, 6., 600, 2.4))
+    assert monitor.check(now=7.) == ({2}, {3})
+    monitor.active_workers = 1
+    assert monitor.active == [1]
+    assert monitor.check(now=7.) == (set(), {2})
+
+
+def test_reporter_sends():
+    comm = MPI.COMM_SELF
+    buf = np.zeros(1, dtype=HEALTH_DTYPE)
+    req = comm.Irecv([buf, MPI.BYTE], source=0, tag=HEALTH_TAG)
+    counters = EventCounters('Worker 0')
+    for key, n in [('processed', 5), ('i0_rejected', 2), ('no_event_code', 3)]:
+        counters.increment(key, n)
+    reporter = HealthReporter(comm, interval=0.)
+    reporter.event_done(0.01)
+    reporter.event_done(0.03)
+    assert reporter.maybe_send(counters)
+    reporter.close()
+    req.Wait()
+    assert buf['events'] == 10
+    assert buf['rejected'] == 2
+    assert buf['busy'] == 0.04
+    assert buf['latency_max'] == 0.03
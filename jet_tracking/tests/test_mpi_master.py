@@ -0,0 +1,113 @@
+"""
+The master receive loop needs a worker rank, so the test runs this module
+under mpiexec: rank 0 is the master and rank 1 sends it records, health
+reports and profiles.
+"""
+import json
+import shutil
+import socket
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+N_BINS = 4
+# Records in each data message
+BATCHES = (2, 3, 4)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('', 0))
+        return s.getsockname()[1]
+
+
+@pytest.mark.skipif(shutil.which('mpiexec') is None,
+                    reason='mpiexec is not available')
+@pytest.mark.parametrize('api', ['api', 'no_api'])
+def test_receive_loop(tmp_path, api):
+    out = tmp_path / 'master.json'
+    ports = [str(free_port()) for _ in range(3)]
+    # Without the API the run ends before the message thread has a context
+    cmd = ['mpiexec', '-n', '2', sys.executable, '-m',
+           'jet_tracking.tests.test_mpi_master', str(out), api] + ports
+    # Returns once the master stopped and both ranks finalized
+    subprocess.run(cmd, check=True, timeout=60,
+                   cwd=Path(__file__).resolve().parents[2])
+    with open(out) as f:
+        result = json.load(f)
+    # Every message of every tag, with the slot re-armed after each one
+    assert sorted(result['pulse_ids']) == list(range(sum(BATCHES)))
+    assert result['health'] == [[1, 0], [1, 1], [1, 2]]
+    assert result['profiles'] == [[1., 0.], [2., 1.], [3., 2.]]
+    assert result['dropped'] == 0
+
+
+def run_master(out, api, api_port, data_port, pub_port):
+    from ..mpi_scripts.mpi_master import MpiMaster
+
+    class RecordingMaster(MpiMaster):
+        """Keep what the loop hands over and stop after the last record"""
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.result = {'pulse_ids': [], 'health': [], 'profiles': []}
+
+        def start_msg_thread(self, api_port):
+            if api:
+                super().start_msg_thread(api_port)
+
+        def handle_health(self, report):
+            self.result['health'].append([int(report['rank']),
+                                          int(report['events'])])
+
+        def handle_profile(self, profile):
+            self.result['profiles'].append(profile[:2].tolist())
+
+        def publish(self, batch, rank=None):
+            self.result['pulse_ids'].extend(batch['pulse_id'].tolist())
+            if len(self.result['pulse_ids']) == sum(BATCHES):
+                # From the publishing thread, while the loop waits
+                self.abort = True
+                self.wake()
+
+    master = RecordingMaster(0, api_port, {}, {}, sim=True,
+                             data_port=data_port, pub_port=pub_port,
+                             recalibration={'n_bins': N_BINS,
+                                            'peak_bin': 2})
+    master.start_run()
+    master.result['dropped'] = master.dropped
+    with open(out, 'w') as f:
+        json.dump(master.result, f)
+
+
+def run_worker(comm):
+    from ..mpi_scripts.health import HEALTH_DTYPE, HEALTH_TAG
+    from ..mpi_scripts.recalibration import PROFILE_TAG
+    from ..mpi_scripts.records import empty_records
+
+    rank = comm.Get_rank()
+    start = 0
+    for k, n_records in enumerate(BATCHES):
+        records = empty_records(n_records)
+        records['pulse_id'] = np.arange(start, start + n_records)
+        start += n_records
+        comm.Send([records, 'B'], dest=0, tag=rank)
+        report = np.zeros(1, dtype=HEALTH_DTYPE)
+        report['rank'] = rank
+        report['events'] = k
+        comm.Send([report, 'B'], dest=0, tag=HEALTH_TAG)
+        profile = np.zeros(N_BINS + 1)
+        profile[:2] = k + 1, k
+        comm.Send([profile, 'B'], dest=0, tag=PROFILE_TAG)
+
+
+if __name__ == '__main__':
+    from mpi4py import MPI
+
+    if MPI.COMM_WORLD.Get_rank() == 0:
+        run_master(sys.argv[1], sys.argv[2] == 'api',
+                   *(int(port) for port in sys.argv[3:6]))
+    else:
+        run_worker(MPI.COMM_WORLD)
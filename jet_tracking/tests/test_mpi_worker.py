@@ -0,0 +1,215 @@
+import logging
+import socket
+import time
+from threading import Thread, Timer
+
+import numpy as np
+import pytest
+from mpi4py import MPI
+
+from ..mpi_scripts.event_source import EventSource
+from ..mpi_scripts.mpi_worker import MpiWorker
+from ..mpi_scripts.records import RECORD_DTYPE
+
+CALIB = {'peak_bin': 10, 'delta_bin': 2, 'i0_low': 0.5, 'i0_high': 1.5}
+
+
+class CountingIndex:
+    """Radial index that counts the window changes"""
+    n_bins = 20
+
+    def __init__(self):
+        self.windows = []
+
+    def set_window(self, low, high):
+        self.windows.append((low, high))
+
+
+class ListSource(EventSource):
+    """
+    Events 0 to n_events - 1, hooks[i] is called before event i is handed
+    out, e.g. to change the worker parameters between events.
+    """
+    def __init__(self, n_events, hooks=None):
+        self.n_events = n_events
+        self.hooks = hooks or {}
+
+    def events(self):
+        for i in range(self.n_events):
+            if i in self.hooks:
+                self.hooks[i]()
+            yield i
+
+    def event_id(self, evt):
+        return evt, float(evt)
+
+    def event_codes(self, evt):
+        return (40,)
+
+    def i0(self, evt):
+        return 1.
+
+    def intensity(self, evt, r_index, timer=None):
+        return 2.
+
+
+class SelfReceiver(Thread):
+    """Receive what the worker sends to the master, itself on rank 0"""
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.pulse_ids = []
+        self.dropped = []
+        self.running = True
+
+    def run(self):
+        comm = MPI.COMM_WORLD
+        status = MPI.Status()
+        while self.running or comm.Iprobe(source=0, status=status):
+            if not comm.Iprobe(source=0, tag=MPI.ANY_TAG, status=status):
+                time.sleep(0.001)
+                continue
+            buf = np.empty(status.Get_count(MPI.BYTE), dtype=np.uint8)
+            comm.Recv([buf, MPI.BYTE], source=0, tag=status.Get_tag())
+            # Tag 0 is the data of the worker on rank 0
+            if status.Get_tag() == 0:
+                records = buf.view(RECORD_DTYPE)
+                self.pulse_ids.extend(records['pulse_id'].tolist())
+                self.dropped.extend(records['dropped'].tolist())
+
+
+@pytest.fixture
+def receiver():
+    receiver = SelfReceiver()
+    receiver.start()
+    yield receiver
+    receiver.running = False
+    receiver.join()
+
+
+class StagedSource(ListSource):
+    """Events failing the prefilter stages, the calls are recorded"""
+    def __init__(self):
+        super().__init__(6)
+        # 1 and 2 lack event code 40, 3 is outside the i0 window and 4
+        # has no calibrated detector data
+        self.codes = {1: None, 2: (41,)}
+        self.i0s = {3: 2.}
+        self.no_calib = {4}
+        self.i0_calls = []
+        self.intensity_calls = []
+
+    def event_codes(self, evt):
+        return self.codes.get(evt, (40,))
+
+    def i0(self, evt):
+        self.i0_calls.append(evt)
+        return self.i0s.get(evt, 1.)
+
+    def intensity(self, evt, r_index, timer=None):
+        self.intensity_calls.append(evt)
+        return None if evt in self.no_calib else 2.
+
+
+def make_worker(source, r_index=None, **kwargs):
+    with socket.socket() as s:
+        s.bind(('', 0))
+        port = s.getsockname()[1]
+    return MpiWorker(source, r_index or CountingIndex(), CALIB,
+                     data_port=port, **kwargs)
+
+
+def test_window_set_once_per_version(receiver):
+    source = ListSource(6)
+    r_index = CountingIndex()
+    worker = make_worker(source, r_index)
+    source.hooks = {
+        2: lambda: worker.update_params(peak_bin=12),
+        # Two changes between the same events are one new snapshot
+        4: lambda: (worker.update_params(peak_bin=14),
+                    worker.update_params(delta_bin=3))}
+    worker.start_run()
+    assert r_index.windows == [(8, 12), (10, 14), (11, 17)]
+    assert worker.params.version == 3
+    assert worker.counters.counts['processed'] == 6
+
+
+def test_snapshots_never_torn():
+    worker = make_worker(ListSource(0))
+    n_writers, n_updates = 4, 500
+
+    def write():
+        for i in range(n_updates):
+            # Both fields always change together
+            worker.update_params(peak_bin=i, delta_bin=i)
+
+    writers = [Thread(target=write) for _ in range(n_writers)]
+    for writer in writers:
+        writer.start()
+    versions = []
+    while any(writer.is_alive() for writer in writers):
+        params = worker.params
+        assert params.peak_bin == params.delta_bin
+        versions.append(params.version)
+    for writer in writers:
+        writer.join()
+    assert np.all(np.diff(versions) >= 0)
+    # No update lost
+    assert worker.params.version == n_writers * n_updates
+
+
+def test_event_kept_while_inactive(receiver):
+    source = ListSource(5)
+    worker = make_worker(source)
+
+    def deactivate():
+        worker.update_params(active=False)
+        Timer(0.3, worker.update_params, kwargs={'active': True}).start()
+
+    source.hooks = {2: deactivate}
+    start = time.monotonic()
+    worker.start_run()
+    assert time.monotonic() - start >= 0.3
+    # The event taken when the worker went idle is processed afterwards
+    assert receiver.pulse_ids == list(range(5))
+
+
+def test_prefilter_stages(receiver):
+    source = StagedSource()
+    worker = make_worker(source)
+    worker.start_run()
+    assert worker.counters.counts == {'processed': 2, 'no_event_code': 2,
+                                      'i0_rejected': 1, 'no_calib': 1}
+    # Each rejected event stops at its own stage
+    assert source.i0_calls == [0, 3, 4, 5]
+    assert source.intensity_calls == [0, 4, 5]
+    # Gated shots are sent flagged, the others not at all
+    assert receiver.pulse_ids == [0, 3, 5]
+    assert receiver.dropped == [0, 1, 0]
+
+
+def test_counter_reports_throttled(receiver, caplog):
+    caplog.set_level(logging.INFO, logger='jet_tracking.mpi_scripts.counters')
+    worker = make_worker(ListSource(500))
+    worker.start_run()
+    assert worker.counters.counts == {'processed': 500}
+    # Only the report forced at the end of the run, none per event
+    reports = [r for r in caplog.records if 'totals' in r.getMessage()]
+    assert len(reports) == 1
+
+
+class CalibratingSource(ListSource):
+    """Calibration and azav each take a while"""
+    def intensity(self, evt, r_index, timer=None):
+        time.sleep(0.01)
+        timer.mark('calib')
+        time.sleep(0.02)
+        return 2.
+
+
+def test_calib_and_azav_timed_apart(receiver):
+    worker = make_worker(CalibratingSource(5), timer_samples=10)
+    worker.start_run()
+    calib = worker.timer.samples('calib')
+    azav = worker.timer.samples('azav')
+    assert len(calib) == len(azav) == 5
+    assert np.all(calib >= 0.01) and np.all(azav >= 0.02)
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from ..peak_fit import FAILED, GOOD, ROUGH, estimate_peak
+
+
+def ring(center, width=3., noise=0.05, seed=0):
+    x = np.arange(100)
+    rng = np.random.default_rng(seed)
+    return (10 * np.exp(-0.5 * ((x - center) / width) ** 2) + 0.02 * x + 3
+            + rng.normal(0, noise, len(x)))
+
+
+@pytest.mark.parametrize('center', [12.2, 40.3, 70.7])
+def test_estimate_peak(center):
+    estimate = estimate_peak(ring(center))
+    assert estimate.quality == GOOD
+    assert estimate.peak == pytest.approx(center, abs=0.05)
+    assert estimate.width == pytest.approx(3., rel=0.05)
+    assert 0 < estimate.uncertainty < 0.05
+    rough = estimate_peak(ring(center), refine=False)
+    assert rough.quality == ROUGH
+    assert rough.method == 'log_parabola'
+    assert rough.peak == pytest.approx(center, abs=0.2)
+
+
+def test_no_peak():
+    estimate = estimate_peak(np.linspace(5, 1, 100))
+    assert estimate.quality == FAILED
+    assert estimate.peak == 0
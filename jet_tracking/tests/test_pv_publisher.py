@@ -0,0 +1,99 @@
+import time
+
+import pytest
+
+from ..mpi_scripts.pv_publisher import PvPublisher
+from ..mpi_scripts.records import empty_records
+
+
+class FakePV:
+    """Records puts, completes them right away unless held"""
+    def __init__(self, pvname, hold=False, connected=True):
+        self.pvname = pvname
+        self.hold = hold
+        self.connected = connected
+        self.values = []
+        self.pending = []
+
+    def put(self, value, wait=False, callback=None, callback_data=None):
+        if not self.connected:
+            return None
+        self.values.append(value)
+        if self.hold:
+            self.pending.append((callback, callback_data))
+        else:
+            callback(pvname=self.pvname, **callback_data)
+        return 1
+
+    def complete(self):
+        for callback, callback_data in self.pending:
+            callback(pvname=self.pvname, **callback_data)
+        self.pending = []
+
+
+def make_record(intensity, i0=1.):
+    record = empty_records(1)[0]
+    record['intensity'] = intensity
+    record['i0'] = i0
+    record['inorm'] = intensity / i0
+    return record
+
+
+def wait_for(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end
+        time.sleep(0.001)
+
+
+def test_publish_batches():
+    pv_map = {1: 'TST:INTENSITY', 3: 'TST:INORM', 'i0': 'TST:I0'}
+    publisher = PvPublisher(pv_map, pv_factory=FakePV)
+    publisher.publish(make_record(1., 2.))
+    wait_for(lambda: publisher.stats()['published'] == 1)
+    publisher.publish(make_record(4., 8.))
+    publisher.stop()
+    assert publisher.pvs[1].values == [1., 4.]
+    assert publisher.pvs[3].values == [0.5, 0.5]
+    assert publisher.pvs['i0'].values == [2., 8.]
+    stats = publisher.stats()
+    assert stats['published'] == 2
+    assert stats['dropped'] == 0
+    assert stats['latency_max'] >= 0
+
+
+def test_publish_coalesces_while_in_flight():
+    publisher = PvPublisher({1: 'TST:INTENSITY'},
+                            pv_factory=lambda name: FakePV(name, hold=True))
+    pv = publisher.pvs[1]
+    publisher.publish(make_record(1.))
+    wait_for(lambda: pv.values)
+    for value in (2., 3., 4.):
+        publisher.publish(make_record(value))
+    pv.complete()
+    wait_for(lambda: len(pv.values) == 2)
+    pv.complete()
+    publisher.stop()
+    assert pv.values == [1., 4.]
+    assert publisher.stats()['dropped'] == 2
+
+
+@pytest.mark.parametrize('hold, connected, counter',
+                         [(True, True, 'timeouts'), (False, False, 'errors')])
+def test_publish_failures(hold, connected, counter):
+    publisher = PvPublisher(
+        {1: 'TST:INTENSITY'}, timeout=0.01,
+        pv_factory=lambda name: FakePV(name, hold, connected))
+    publisher.publish(make_record(1.))
+    wait_for(lambda: publisher.stats()[counter] == 1)
+    publisher.publish(make_record(2.))
+    wait_for(lambda: publisher.stats()[counter] == 2)
+    # Late completions of given up batches are ignored
+    publisher.pvs[1].complete()
+    publisher.stop()
+    assert publisher.stats()['published'] == 0
+
+
+def test_pv_map_validation():
+    with pytest.raises(ValueError):
+        PvPublisher({6: 'TST:BAD'}, pv_factory=FakePV)
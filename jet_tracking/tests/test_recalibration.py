@@ -0,0 +1,43 @@
+import numpy as np
+from mpi4py import MPI
+
+from ..mpi_scripts.recalibration import (PROFILE_TAG, PeakRecalibrator,
+                                         ProfileAccumulator)
+
+
+def ring(center, n_bins=100):
+    x = np.arange(n_bins)
+    return 10 * np.exp(-0.5 * ((x - center) / 3) ** 2) + 0.02 * x + 3
+
+
+def test_profile_accumulator():
+    comm = MPI.COMM_SELF
+    buf = np.zeros(101)
+    req = comm.Irecv([buf, MPI.BYTE], source=0, tag=PROFILE_TAG)
+    profile = ProfileAccumulator(comm, 100, decimation=3, interval=0.)
+    for _ in range(9):
+        if profile.take():
+            profile.add(ring(40.))
+    assert profile.n_shots == 3
+    assert profile.maybe_send()
+    profile.close()
+    req.Wait()
+    assert buf[0] == 3
+    np.testing.assert_allclose(buf[1:], 3 * ring(40.))
+    assert profile.n_shots == 0
+
+
+def test_recalibrator_follows_ring():
+    recal = PeakRecalibrator(100, peak_bin=40, window=1., min_shots=10,
+                             threshold=1.)
+    recal.add(np.concatenate([[20], 20 * ring(40.3)]))
+    # The window has to be full first
+    assert recal.check(now=0.) is None
+    assert recal.check(now=1.) is None
+    assert abs(recal.estimate.peak - 40.3) < 0.05
+    recal.add(np.concatenate([[5], 5 * ring(45.)]))
+    # Not enough shots, keeps accumulating
+    assert recal.check(now=2.) is None
+    recal.add(np.concatenate([[5], 5 * ring(45.)]))
+    assert recal.check(now=2.) == 45
+    assert recal.peak_bin == 45
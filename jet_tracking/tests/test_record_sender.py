@@ -0,0 +1,63 @@
+import time
+
+import numpy as np
+from mpi4py import MPI
+
+from ..mpi_scripts.record_sender import RecordSender
+from ..mpi_scripts.records import RECORD_DTYPE, empty_records
+
+
+class SelfReceiver:
+    """Receives posted up front, sends to ourselves only complete once
+    they are matched
+    """
+    def __init__(self, comm, n_messages, batch_size):
+        self.bufs = empty_records((n_messages, batch_size))
+        self.reqs = [comm.Irecv([buf, MPI.BYTE], source=0, tag=3)
+                     for buf in self.bufs]
+
+    def messages(self):
+        messages = []
+        for buf, req in zip(self.bufs, self.reqs):
+            status = MPI.Status()
+            if req.Test(status):
+                n_records = status.Get_count(MPI.BYTE) // RECORD_DTYPE.itemsize
+                messages.append(buf[:n_records])
+            else:
+                req.Cancel()
+                req.Wait()
+        return messages
+
+
+def test_sender_batches():
+    comm = MPI.COMM_SELF
+    receiver = SelfReceiver(comm, 4, 3)
+    sender = RecordSender(comm, dest=0, tag=3, batch_size=3, n_buffers=2)
+    for i in range(8):
+        record = sender.next_record()
+        record['pulse_id'] = i
+        if i == 4:
+            # Uncommitted records are overwritten by the next one
+            continue
+        sender.commit()
+    sender.close()
+    messages = receiver.messages()
+    assert [len(m) for m in messages] == [3, 3, 1]
+    np.testing.assert_array_equal(np.concatenate(messages)['pulse_id'],
+                                  [0, 1, 2, 3, 5, 6, 7])
+    assert sender.stats()['records'] == 7
+
+
+def test_sender_deadline():
+    comm = MPI.COMM_SELF
+    receiver = SelfReceiver(comm, 2, 10)
+    sender = RecordSender(comm, dest=0, tag=3, batch_size=10, deadline=0.01)
+    sender.next_record()
+    sender.commit()
+    sender.poll()
+    assert sender.count == 1
+    time.sleep(0.02)
+    sender.poll()
+    assert sender.count == 0
+    sender.close()
+    assert [len(m) for m in receiver.messages()] == [1]
@@ -0,0 +1,72 @@
+import time
+
+import h5py
+import numpy as np
+import pytest
+
+from ..mpi_scripts.recorder import RecordWriter
+from ..mpi_scripts.records import empty_records
+
+
+@pytest.mark.parametrize('fmt', ['h5', 'npy'])
+def test_record_writer_rotates(tmp_path, fmt):
+    writer = RecordWriter(tmp_path, fmt=fmt, buffer_records=4,
+                          file_records=10)
+    records = empty_records(25)
+    records['pulse_id'] = np.arange(25)
+    for i in range(0, 25, 3):
+        writer.write(records[i:i + 3])
+    writer.close()
+    assert writer.written == 25
+    assert len(writer.files) == 3
+    if fmt == 'h5':
+        segments = []
+        for name in writer.files:
+            with h5py.File(name, 'r') as f:
+                segments.append(f['records'][:])
+    else:
+        segments = [np.load(name) for name in writer.files]
+    assert [len(s) for s in segments] == [10, 10, 5]
+    written = np.concatenate(segments)
+    assert written.dtype.names == records.dtype.names
+    np.testing.assert_array_equal(written['pulse_id'], records['pulse_id'])
+
+
+def test_npy_flushed_while_open(tmp_path):
+    writer = RecordWriter(tmp_path, fmt='npy', buffer_records=100,
+                          flush_interval=0.05)
+    records = empty_records(30)
+    records['pulse_id'] = np.arange(30)
+    writer.write(records[:10])
+    time.sleep(0.3)
+    # Readable before the file is complete
+    np.testing.assert_array_equal(np.load(writer.files[0])['pulse_id'],
+                                  np.arange(10))
+    writer.write(records[10:])
+    writer.close()
+    assert len(writer.files) == 1
+    np.testing.assert_array_equal(np.load(writer.files[0])['pulse_id'],
+                                  records['pulse_id'])
+
+
+def test_failed_h5_write_leaves_no_rows(tmp_path, monkeypatch):
+    setitem = h5py.Dataset.__setitem__
+    calls = []
+
+    def fail_third(dataset, key, value):
+        calls.append(key)
+        if len(calls) == 3:
+            raise OSError('disk full')
+        setitem(dataset, key, value)
+
+    monkeypatch.setattr(h5py.Dataset, '__setitem__', fail_third)
+    writer = RecordWriter(tmp_path, buffer_records=4)
+    records = empty_records(12)
+    records['pulse_id'] = np.arange(12)
+    writer.write(records)
+    # The last block fails on close
+    writer.close()
+    assert writer.written == 8
+    with h5py.File(writer.files[0], 'r') as f:
+        np.testing.assert_array_equal(f['records']['pulse_id'],
+                                      np.arange(8))
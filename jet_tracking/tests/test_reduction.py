@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from ..mpi_scripts.records import empty_records
+from ..mpi_scripts.reduction import ShotReducer
+
+
+def make_records(timestamps, intensity, i0, dropped):
+    records = empty_records(len(timestamps))
+    records['timestamp'] = timestamps
+    records['intensity'] = intensity
+    records['i0'] = i0
+    records['inorm'] = np.divide(intensity, i0)
+    records['dropped'] = dropped
+    return records
+
+
+def test_reducer_requires_one_window_type():
+    with pytest.raises(ValueError):
+        ShotReducer()
+    with pytest.raises(ValueError):
+        ShotReducer(window=0.01, shots=10)
+
+
+def test_reducer_shot_windows():
+    reducer = ShotReducer(shots=4)
+    records = make_records(np.arange(4), [1, 3, 0, 5], [10, 10, 1, 10],
+                           [0, 0, 1, 0])
+    summaries = [reducer.add(record) for record in records]
+    assert summaries[:3] == [None, None, None]
+    summary = summaries[-1][0]
+    assert summary['count'] == 4
+    assert summary['dropped'] == 0.25
+    assert summary['intensity'] == pytest.approx(3)
+    assert summary['intensity_median'] == pytest.approx(3)
+    assert summary['i0'] == pytest.approx(10)
+    assert summary['inorm'] == pytest.approx(0.3)
+    assert np.isnan(summary['jet_peak'])
+    assert (summary['t_start'], summary['t_end']) == (0, 3)
+    assert reducer.count == 0
+
+
+def test_reducer_time_windows():
+    reducer = ShotReducer(window=0.5, capacity=2)
+    timestamps = np.arange(0, 0.5, 0.1)
+    for record in make_records(timestamps, timestamps, 1, 0):
+        assert reducer.add(record) is None
+    summary = reducer.add(make_records([0.6], 0, 1, 1)[0])[0]
+    assert summary['count'] == 5
+    assert summary['intensity'] == pytest.approx(0.2)
+    assert (summary['t_start'], summary['t_end']) == (0, 0.5)
+    assert reducer.expire(timestamp=0.9) is None
+    summary = reducer.expire(timestamp=1.0)[0]
+    assert summary['count'] == 1
+    assert summary['dropped'] == 1
+    assert np.isnan(summary['intensity'])
+
+
+def test_reducer_expires_on_event_clock():
+    # Replayed events are far in the past, windows still expire
+    reducer = ShotReducer(window=0.5)
+    reducer.add(make_records([100.2], 1, 1, 0)[0])
+    assert reducer.expire() is None
+    assert reducer.expire(timestamp=100.5)[0]['count'] == 1
+
+
+@pytest.mark.parametrize('window', [{'window': 0.05}, {'shots': 7}])
+def test_reducer_batches_match_records(window):
+    rng = np.random.default_rng(3)
+    n = 200
+    # Mostly in order, with some late records
+    timestamps = np.sort(rng.random(n)) - 0.03 * (rng.random(n) < 0.1)
+    records = make_records(timestamps, rng.random(n), 1 + rng.random(n),
+                           rng.random(n) < 0.2)
+    single, batched = ShotReducer(**window), ShotReducer(**window)
+    expected = [single.add(record) for record in records]
+    expected = np.concatenate([s for s in expected if s is not None])
+    splits = np.sort(rng.choice(np.arange(1, n), 20, replace=False))
+    summaries = [batched.add_batch(batch)
+                 for batch in np.split(records, splits)]
+    summaries = np.concatenate([s for s in summaries if s is not None])
+    assert len(summaries) == len(expected) > 3
+    for name in summaries.dtype.names:
+        np.testing.assert_allclose(summaries[name], expected[name],
+                                   rtol=1e-6)
+    assert batched.count == single.count
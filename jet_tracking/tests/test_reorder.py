@@ -0,0 +1,34 @@
+import numpy as np
+
+from ..mpi_scripts.records import empty_records
+from ..mpi_scripts.reorder import ReorderBuffer
+
+
+def make_records(timestamps):
+    records = empty_records(len(timestamps))
+    records['timestamp'] = timestamps
+    records['pulse_id'] = np.arange(len(timestamps))
+    return records
+
+
+def test_reorder_releases_in_order():
+    reorder = ReorderBuffer(latency=0.5)
+    reorder.push(make_records([1.0, 1.4, 1.2]))
+    reorder.push(make_records([1.1, 2.0]))
+    released = reorder.pop_ready(now=1.75)
+    np.testing.assert_array_equal(released['timestamp'], [1.0, 1.1, 1.2])
+    assert len(reorder) == 2
+    # Older than what was already released
+    reorder.push(make_records([1.15, 1.5]))
+    assert reorder.late == 1
+    np.testing.assert_array_equal(reorder.flush()['timestamp'],
+                                  [1.4, 1.5, 2.0])
+
+
+def test_reorder_capacity():
+    reorder = ReorderBuffer(latency=10., capacity=2)
+    reorder.push(make_records([3., 1., 2., 4.]))
+    np.testing.assert_array_equal(reorder.pop_ready(now=4.)['timestamp'],
+                                  [1., 2.])
+    assert reorder.forced == 2
+    assert len(reorder.pop_ready(now=4.)) == 0
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from ..tools.ringBuffer import RingBuffer
+
+
+def test_ring_buffer_wraps():
+    ring = RingBuffer(('i0', 'dropped'), capacity=5)
+    assert len(ring) == 0
+    assert np.isnan(ring.latest('i0'))
+    for i in range(8):
+        ring.append({'i0': i, 'dropped': None if i % 2 else True})
+    assert len(ring) == 5
+    np.testing.assert_array_equal(ring.last('i0'), [3, 4, 5, 6, 7])
+    np.testing.assert_array_equal(ring.last('i0', 2), [6, 7])
+    np.testing.assert_array_equal(ring.last('dropped', 3),
+                                  [np.nan, 1, np.nan])
+    assert ring.latest('i0') == 7
+    # Views into the buffer, not copies
+    view = ring.last('i0', 3)
+    assert view.base is not None
+    with pytest.raises(ValueError):
+        view[0] = 0
+    ring.clear()
+    assert len(ring.last('i0')) == 0
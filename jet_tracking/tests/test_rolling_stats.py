@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from ..tools.rollingStats import RollingCount, RollingStats
+
+
+def test_rolling_stats():
+    rng = np.random.default_rng(0)
+    values = rng.normal(5, 2, 500)
+    values[rng.random(500) < 0.1] = np.nan
+    dropped = rng.random(500) < 0.1
+    stats = RollingStats(20, refresh=3)
+    kept = np.where(dropped, np.nan, values)
+    for i, (value, drop) in enumerate(zip(values, dropped)):
+        stats.append(value, drop)
+        window = kept[max(i - 19, 0):i + 1]
+        window = window[~np.isnan(window)]
+        assert stats.count == len(window)
+        if len(window):
+            assert stats.mean == pytest.approx(window.mean())
+            assert stats.std() == pytest.approx(window.std(), abs=1e-9)
+        if len(window) > 1:
+            assert stats.std(ddof=1) == pytest.approx(window.std(ddof=1))
+
+
+def test_rolling_stats_empty():
+    stats = RollingStats(3)
+    for _ in range(4):
+        stats.append(None)
+    assert stats.count == 0
+    assert np.isnan(stats.mean)
+    assert np.isnan(stats.std())
+
+
+def test_rolling_count():
+    counter = RollingCount(3)
+    for flag in [1, None, np.nan, True, 0., 2]:
+        counter.append(flag)
+    assert counter.count == 2
+    counter.append(0)
+    counter.append(0)
+    assert counter.count == 1
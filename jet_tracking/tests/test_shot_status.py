@@ -0,0 +1,65 @@
+import numpy as np
+
+from ..tools.shotStatus import ShotStatus, event_flags
+
+
+def shot(ratio, dropped=False):
+    return {'i0': 10 * ratio, 'diff': 2 * ratio, 'ratio': ratio,
+            'dropped': dropped}
+
+
+def test_event_flags():
+    assert event_flags(1.0, (0.5, 2.0)) == {'high intensity': 0,
+                                            'missed shot': 0}
+    assert event_flags(3.0, (0.5, 2.0))['high intensity'] == 3.0
+    assert event_flags(0.2, (0.5, 2.0))['missed shot'] == 0.2
+    # A ratio of 0 is still a missed shot
+    assert event_flags(0.0, (0.5, 2.0))['missed shot'] == 0.01
+
+
+def test_averages_leave_out_dropped_shots():
+    shots = ShotStatus(averaging_size=3, notification_tolerance=2,
+                       num_cali=2)
+    assert np.isnan(shots.average())
+    shots.add(shot(0, dropped=True))
+    assert np.isnan(shots.average())
+    assert len(shots.averages) == 0
+    for ratio in (1, 2, 3, 4):
+        shots.add(shot(ratio))
+    shots.add(shot(100, dropped=True))
+    # 3, 4 and the dropped shot are in the window
+    assert shots.average() == 3.5
+    assert shots.averages.latest('i0') == 35
+    assert shots.averages.latest('diff') == 7
+
+
+def test_flags_counted_once_calibrated():
+    shots = ShotStatus(averaging_size=5, notification_tolerance=2,
+                       num_cali=2)
+    for _ in range(5):
+        shots.add(shot(10))
+    assert shots.status() is None
+    for _ in range(3):
+        shots.add(shot(10), ratio_range=(0.5, 2.0))
+    assert shots.status() == 'high intensity'
+    for _ in range(3):
+        shots.add(shot(0, dropped=True), ratio_range=(0.5, 2.0))
+    # Missed shots come before dropped shots
+    assert shots.status() == 'missed shot'
+
+
+def test_calibration_shots():
+    shots = ShotStatus(averaging_size=5, notification_tolerance=2,
+                       num_cali=2)
+    assert shots.add_calibration_shot(shot(1)) is None
+    assert shots.add_calibration_shot(shot(50, dropped=True)) is None
+    assert shots.add_calibration_shot(shot(2)) is None
+    stats = shots.add_calibration_shot(shot(6))
+    assert stats['ratio'] == (3, np.std([1, 2, 6], ddof=1))
+    assert stats['i0'][0] == 30
+    # Starts over
+    assert len(shots.cal_shots) == 0
+    shots.set_num_cali(1)
+    assert shots.add_calibration_shot(shot(1)) is None
+    assert shots.add_calibration_shot(shot(3))['ratio'] == \
+        (2, np.std([1, 3], ddof=1))
@@ -0,0 +1,104 @@
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Fixed size history of aligned columns, e.g. the values and flags of
+    every shot.
+
+    Each column is preallocated at twice the capacity and every row is
+    written twice, at i and i + capacity.  The last n rows are then always
+    one contiguous slice, so reading them is a view instead of a copy and
+    appending is O(1).  Rows are only appended by one thread, readers get
+    read only views that stay valid until the rows are overwritten.
+
+    Parameters
+    ----------
+    columns: iterable of str or dict
+        Column names, or names and dtypes.  Columns are float by default.
+
+    capacity: int (Default: 2000)
+        Number of rows kept.
+
+    fill: float (Default: np.nan)
+        Value of the columns missing from an appended row.
+    """
+    def __init__(self, columns, capacity=2000, fill=np.nan):
+        if not isinstance(columns, dict):
+            columns = dict.fromkeys(columns, float)
+        self._capacity = int(capacity)
+        self._fill = fill
+        self._data = {name: np.full(2 * self._capacity, fill, dtype=dtype)
+                      for name, dtype in columns.items()}
+        # Index of the next row, in the first copy
+        self._head = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def capacity(self):
+        """Number of rows kept"""
+        return self._capacity
+
+    @property
+    def columns(self):
+        """Names of the columns"""
+        return list(self._data)
+
+    def append(self, values):
+        """
+        Add a row.
+
+        Parameters
+        ----------
+        values: dict
+            Value of each column, missing columns and None get the fill
+            value.
+        """
+        head = self._head
+        for name, column in self._data.items():
+            value = values.get(name)
+            if value is None:
+                value = self._fill
+            column[head] = column[head + self._capacity] = value
+        # The row is complete before it becomes visible
+        self._head = (head + 1) % self._capacity
+        self._count = min(self._count + 1, self._capacity)
+
+    def last(self, name, n=None):
+        """
+        Latest rows of a column, oldest first.
+
+        Parameters
+        ----------
+        name: str
+            Column name.
+
+        n: int (Default: None)
+            Number of rows, all the rows kept if None or more than that.
+
+        Returns
+        -------
+        values: ndarray
+            Read only view into the buffer.
+        """
+        n = self._count if n is None else min(max(int(n), 0), self._count)
+        end = self._head + self._capacity
+        view = self._data[name][end - n:end]
+        view.flags.writeable = False
+        return view
+
+    def latest(self, name):
+        """Last value of a column, the fill value if empty"""
+        if not self._count:
+            return self._fill
+        return self._data[name][self._head + self._capacity - 1]
+
+    def clear(self):
+        """Forget every row"""
+        for column in self._data.values():
+            column[:] = self._fill
+        self._head = 0
+        self._count = 0
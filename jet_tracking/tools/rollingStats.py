@@ -0,0 +1,145 @@
+import numpy as np
+
+
+class RollingStats:
+    """
+    Mean and standard deviation of the last window shots, updated in O(1)
+    per shot.
+
+    The running mean and sum of squared differences are updated with
+    Welford's method when a shot enters the window and reversed when it
+    leaves.  NaN values and dropped shots take a place in the window but
+    are left out of the statistics.  The sums are recomputed from the
+    window now and then so rounding errors don't build up.
+
+    Parameters
+    ----------
+    window: int
+        Number of shots in the window.
+
+    refresh: int (Default: 100)
+        Recompute the sums every refresh windows of shots.
+    """
+    def __init__(self, window, refresh=100):
+        self._window = max(int(window), 1)
+        self._refresh = self._window * refresh
+        self._values = np.full(self._window, np.nan)
+        self._pos = 0
+        self._appended = 0
+        self._n = 0
+        self._mean = 0.
+        self._m2 = 0.
+
+    @property
+    def window(self):
+        """Number of shots in the window"""
+        return self._window
+
+    @property
+    def count(self):
+        """Number of valid shots in the window"""
+        return self._n
+
+    @property
+    def mean(self):
+        """Mean of the valid shots, NaN without any"""
+        return self._mean if self._n else np.nan
+
+    def var(self, ddof=0):
+        """Variance of the valid shots, NaN without enough of them"""
+        if self._n <= ddof:
+            return np.nan
+        return self._m2 / (self._n - ddof)
+
+    def std(self, ddof=0):
+        """Standard deviation of the valid shots"""
+        return np.sqrt(self.var(ddof))
+
+    def append(self, value, dropped=False):
+        """
+        Add a shot, the oldest one leaves the window once it is full.
+
+        Parameters
+        ----------
+        value: float or None
+            None and NaN are not counted.
+
+        dropped: bool (Default: False)
+            Dropped shots are not counted.
+        """
+        old = self._values[self._pos]
+        if not np.isnan(old):
+            self._remove(old)
+        if dropped or value is None:
+            value = np.nan
+        value = float(value)
+        self._values[self._pos] = value
+        self._pos = (self._pos + 1) % self._window
+        self._appended += 1
+        if self._appended % self._refresh == 0:
+            self._recompute()
+        elif not np.isnan(value):
+            self._add(value)
+
+    def _add(self, value):
+        self._n += 1
+        delta = value - self._mean
+        self._mean += delta / self._n
+        self._m2 += delta * (value - self._mean)
+
+    def _remove(self, value):
+        if self._n == 1:
+            self._n, self._mean, self._m2 = 0, 0., 0.
+            return
+        self._n -= 1
+        delta = value - self._mean
+        self._mean -= delta / self._n
+        self._m2 = max(self._m2 - delta * (value - self._mean), 0.)
+
+    def _recompute(self):
+        """Sums straight from the values in the window"""
+        valid = self._values[~np.isnan(self._values)]
+        self._n = len(valid)
+        self._mean = valid.mean() if self._n else 0.
+        self._m2 = float(((valid - self._mean) ** 2).sum())
+
+
+class RollingCount:
+    """
+    Number of flagged shots among the last window shots, updated in O(1)
+    per shot.
+
+    Parameters
+    ----------
+    window: int
+        Number of shots in the window.
+    """
+    def __init__(self, window):
+        self._window = max(int(window), 1)
+        self._flags = np.zeros(self._window, dtype=bool)
+        self._pos = 0
+        self._count = 0
+
+    @property
+    def window(self):
+        """Number of shots in the window"""
+        return self._window
+
+    @property
+    def count(self):
+        """Number of flagged shots in the window"""
+        return self._count
+
+    def append(self, flag):
+        """
+        Add a shot.
+
+        Parameters
+        ----------
+        flag: float or bool
+            The shot is flagged if the value is neither 0, NaN nor None.
+        """
+        flagged = flag is not None and bool(flag) and not np.isnan(flag)
+        self._count += int(flagged) - int(self._flags[self._pos])
+        self._flags[self._pos] = flagged
+        self._pos = (self._pos + 1) % self._window
@@ -0,0 +1,147 @@
+import numpy as np
+
+from .ringBuffer import RingBuffer
+from .rollingStats import RollingCount, RollingStats
+
+# Values StatusThread follows for every shot
+SIGNALS = ('i0', 'diff', 'ratio')
+# Flags by priority, the first one seen too often sets the status
+FLAGS = ('missed shot', 'dropped', 'high intensity')
+
+
+def event_flags(ratio, ratio_range):
+    """
+    Flag a shot whose ratio is outside the calibrated range.
+
+    Parameters
+    ----------
+    ratio: float
+
+    ratio_range: tuple
+        Low and high allowed ratio.
+
+    Returns
+    -------
+    flags: dict
+        The high intensity and missed shot flags, 0 for a shot inside the
+        range, the ratio otherwise (0.01 for a ratio of 0).
+    """
+    high_intensity = 0
+    missed_shot = 0
+    if ratio > ratio_range[1]:
+        high_intensity = ratio
+    if ratio < ratio_range[0]:
+        missed_shot = ratio
+        if missed_shot == 0:
+            missed_shot = 0.01
+    return {'high intensity': high_intensity, 'missed shot': missed_shot}
+
+
+class ShotStatus:
+    """
+    What StatusThread keeps of the shots, apart from Qt.
+
+    The rolling statistics of i0, diff and ratio over the averaging
+    window and the count of each flag over the notification window are
+    updated with every shot.  The averages are kept in a RingBuffer, and
+    so are the shots of a calibration in the GUI, whose statistics are
+    computed on views of its columns.
+
+    Parameters
+    ----------
+    averaging_size: int
+        Shots in the averaging window.
+
+    notification_tolerance: int
+        Flagged shots that change the status, counted over 1.5 times as
+        many shots.
+
+    num_cali: int
+        Shots of a calibration in the GUI.
+    """
+    def __init__(self, averaging_size, notification_tolerance, num_cali):
+        self._tolerance = notification_tolerance
+        self.rolling = {name: RollingStats(averaging_size)
+                        for name in SIGNALS}
+        self.flag_counts = {
+            name: RollingCount(int(1.5 * notification_tolerance))
+            for name in FLAGS}
+        self.averages = RingBuffer(SIGNALS, 2000)
+        self.set_num_cali(num_cali)
+
+    def add(self, vals, ratio_range=None):
+        """
+        Add a shot.
+
+        Parameters
+        ----------
+        vals: dict
+            i0, diff, ratio and dropped of the shot.
+
+        ratio_range: tuple (Default: None)
+            Allowed ratio once calibrated, the high intensity and missed
+            shot flags are only counted with one.
+        """
+        flags = {'dropped': vals.get('dropped')}
+        if ratio_range is not None:
+            flags.update(event_flags(vals.get('ratio'), ratio_range))
+        dropped = bool(vals.get('dropped'))
+        for name, rolling in self.rolling.items():
+            rolling.append(vals.get(name), dropped)
+        for name, counter in self.flag_counts.items():
+            counter.append(flags.get(name))
+
+    def average(self):
+        """
+        Add the means over the averaging window to the averages, unless
+        there is no valid shot in it.
+
+        Returns
+        -------
+        ratio: float
+            Latest average ratio, NaN before the first one.
+        """
+        if self.rolling['ratio'].count:
+            self.averages.append({name: self.rolling[name].mean
+                                  for name in SIGNALS})
+        return self.averages.latest('ratio')
+
+    def status(self):
+        """
+        Flag seen more than notification_tolerance times, by priority.
+
+        Returns
+        -------
+        flag: str or None
+            'missed shot', 'dropped' or 'high intensity', None if
+            everything is good.
+        """
+        for name in FLAGS:
+            if self.flag_counts[name].count > self._tolerance:
+                return name
+        return None
+
+    def set_num_cali(self, num_cali):
+        """Start over a calibration in the GUI, of num_cali shots"""
+        self.cal_shots = RingBuffer(SIGNALS, int(num_cali) + 1)
+
+    def add_calibration_shot(self, vals):
+        """
+        Add a shot to a calibration in the GUI, dropped shots are left
+        out.
+
+        Returns
+        -------
+        stats: dict or None
+            Mean and standard deviation of i0, diff and ratio once there
+            are more than num_cali shots, then the calibration starts over.
+        """
+        if not vals.get('dropped'):
+            self.cal_shots.append(vals)
+        if len(self.cal_shots) < self.cal_shots.capacity:
+            return None
+        stats = {name: (np.mean(self.cal_shots.last(name)),
+                        np.std(self.cal_shots.last(name), ddof=1))
+                 for name in SIGNALS}
+        self.cal_shots.clear()
+        return stats